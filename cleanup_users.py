@@ -1,63 +1,511 @@
-import firebase_admin
-from firebase_admin import credentials, auth, db
+"""
+Bulk cleanup of users and their content.
+
+Deletes, in order:
+  1. Firebase Auth users: 1,000-UID delete_users batches, several in flight,
+     paced to AUTH_DELETE_QPS and retried with backoff when over quota.
+  2. RTDB nodes (users, posts, stories): keys are listed with shallow reads
+     and removed with parallel multi-path updates of RTDB_CHUNK_SIZE keys, so
+     no single write has to delete the whole node.
+  3. Firestore collections (users, posts, stories): recursive deletes through
+     a BulkWriter, subcollections included.
+
+Progress is saved to a checkpoint file after every step, so an interrupted
+run picks up where it stopped; finished phases are skipped.
+
+With any filter option only matching users are removed, together with their
+RTDB and Firestore user records, their posts and stories. Filters are
+ANDed; several --prefix values are ORed. createdAt and last sign-in come from
+Auth metadata; users that exist only in RTDB or Firestore (e.g. the seeded
+demo_user_* accounts) are matched on their id and their createdAt field, and
+count as never signed in. RTDB keys are listed with shallow reads and
+Firestore ids with empty projections over a per-prefix id range, so user
+records are never downloaded in bulk. Owned
+posts and stories are found with one userId query per user, which needs
+".indexOn": ["userId"] on /posts and /stories in the database rules.
+
+Run: python cleanup_users.py [--only auth rtdb firestore] [--fresh]
+     python cleanup_users.py --prefix demo_user_ user_ [--created-after 2026-01-01]
+                             [--created-before 2026-03-01] [--inactive-days 90] [--dry-run]
+"""
+import argparse
+import json
+import os
+import random
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import firebase_admin
+from firebase_admin import credentials, auth, db, firestore
 
 # The project ID from your screenshot
 PROJECT_ID = "kitahack2026-f1f3e"
 
-# SETUP
-try:
-    cred = credentials.Certificate('service-account.json')
-    # Explicitly setting project_id in initialization
-    firebase_admin.initialize_app(cred, {
-        'projectId': PROJECT_ID,
-        'databaseURL': f'https://{PROJECT_ID}-default-rtdb.asia-southeast1.firebasedatabase.app/'
-    })
-    print(f"✅ Firebase Admin Initialized for {PROJECT_ID}")
-except Exception as e:
-    print(f"❌ Failed to initialize Firebase Admin: {e}")
-    sys.exit(1)
-
-def cleanup_auth_and_db():
-    print("🧹 Cleaning up Firebase Auth and Realtime Database...")
-    
-    # 1. Delete all users from Firebase Auth
-    try:
+AUTH_BATCH_SIZE = 1000  # delete_users limit
+AUTH_DELETE_QPS = float(os.environ.get("AUTH_DELETE_QPS", 1))  # Auth batch-delete quota
+AUTH_WORKERS = 4
+RTDB_NODES = ["users", "posts", "stories"]
+RTDB_CHUNK_SIZE = 500
+RTDB_WORKERS = 8
+FIRESTORE_COLLECTIONS = ["users", "posts", "stories"]
+OWNED_NODES = ["posts", "stories"]  # children carry the owner's userId
+LOOKUP_WORKERS = 16
+FIRESTORE_IN_LIMIT = 30  # values per "in" filter
+MAX_ATTEMPTS = 5
+CHECKPOINT_FILE = "cleanup_checkpoint.json"
+PHASES = ["auth", "rtdb", "firestore"]
+
+
+class Checkpoint:
+    """Per-phase progress persisted as JSON after every update."""
+
+    def __init__(self, path: str, fresh: bool = False):
+        self.path = path
+        self.state = {}
+        if not fresh and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+        self._lock = threading.Lock()
+
+    def done(self, step: str) -> bool:
+        return self.state.get(step, {}).get("done", False)
+
+    def add(self, step: str, count: int):
+        with self._lock:
+            entry = self.state.setdefault(step, {"done": False, "deleted": 0})
+            entry["deleted"] += count
+            self._save()
+
+    def finish(self, step: str):
+        with self._lock:
+            self.state.setdefault(step, {"deleted": 0})["done"] = True
+            self._save()
+
+    def _save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+class Progress:
+    """Thread-safe counter that prints a throughput line every few seconds."""
+
+    def __init__(self, label: str, interval: float = 5.0):
+        self.label = label
+        self.count = 0
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._last = self.started
+        self._lock = threading.Lock()
+
+    def add(self, n: int):
+        with self._lock:
+            self.count += n
+            now = time.perf_counter()
+            if now - self._last >= self.interval:
+                self._last = now
+                print(f"   … {self.label}: {self.count} deleted ({self.rate():,.0f}/s)")
+
+    def rate(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed else 0.0
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"✅ {self.label}: {self.count} deleted in {elapsed:.1f}s ({self.rate():,.0f}/s)")
+
+
+def _with_retry(fn, *args):
+    """Retries quota and transient errors with jittered exponential backoff."""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return fn(*args)
+        except Exception as e:
+            message = str(e).upper()
+            transient = any(s in message for s in ("QUOTA", "429", "UNAVAILABLE", "DEADLINE", "TIMEOUT", "503"))
+            if not transient or attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, min(30, 2 ** attempt)))
+
+
+# ── Auth ────────────────────────────────────────────────────────────────────
+
+def auth_uid_batches():
+    """Yields lists of up to AUTH_BATCH_SIZE UIDs, one per list_users page."""
+    page = auth.list_users(max_results=AUTH_BATCH_SIZE)
+    while page:
+        uids = [user.uid for user in page.users]
+        if uids:
+            yield uids
+        page = page.get_next_page()
+
+
+def delete_auth_users(uid_batches, checkpoint: Checkpoint = None, workers: int = AUTH_WORKERS, qps: float = AUTH_DELETE_QPS) -> int:
+    """Deletes UID batches concurrently, starting at most `qps` batches per second."""
+    progress = Progress("Auth users")
+    failures = 0
+
+    def delete(uids):
+        nonlocal failures
+        result = _with_retry(auth.delete_users, uids)
+        progress.add(result.success_count)
+        if checkpoint:
+            checkpoint.add("auth", result.success_count)
+        for error in result.errors:
+            failures += 1
+            print(f"   ⚠️  {uids[error.index]}: {error.reason}")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        next_start = time.monotonic()
+        for uids in uid_batches:
+            delay = next_start - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_start = time.monotonic() + 1.0 / qps
+            futures.append(pool.submit(delete, uids))
+        for future in futures:
+            future.result()
+    progress.report()
+    if failures:
+        print(f"   ⚠️  {failures} users could not be deleted")
+    return progress.count
+
+
+# ── Realtime Database ───────────────────────────────────────────────────────
+
+def shallow_keys(path: str) -> list:
+    """Child keys of `path` without downloading the children."""
+    return list((db.reference(path).get(shallow=True) or {}).keys())
+
+
+def delete_rtdb_keys(path: str, keys: list, checkpoint: Checkpoint = None, workers: int = RTDB_WORKERS) -> int:
+    """Removes `keys` under `path` with parallel multi-path updates of RTDB_CHUNK_SIZE keys."""
+    progress = Progress(f"RTDB /{path}")
+    ref = db.reference(path)
+
+    def delete(chunk):
+        _with_retry(ref.update, {key: None for key in chunk})
+        progress.add(len(chunk))
+        if checkpoint:
+            checkpoint.add(f"rtdb:{path}", len(chunk))
+
+    chunks = [keys[i:i + RTDB_CHUNK_SIZE] for i in range(0, len(keys), RTDB_CHUNK_SIZE)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(delete, chunks))
+    progress.report()
+    return progress.count
+
+
+# ── Firestore ───────────────────────────────────────────────────────────────
+
+def delete_firestore_collection(fs, name: str, checkpoint: Checkpoint = None) -> int:
+    """Deletes a collection and every subcollection below it in BulkWriter batches."""
+    progress = Progress(f"Firestore {name}")
+    writer = fs.bulk_writer()
+    writer.on_write_result(lambda *_: progress.add(1))
+    deleted = fs.recursive_delete(fs.collection(name), bulk_writer=writer)  # closes the writer
+    if checkpoint:
+        checkpoint.add(f"firestore:{name}", deleted)
+    progress.report()
+    return deleted
+
+
+# ── Selective cleanup ───────────────────────────────────────────────────────
+
+class UserFilter:
+    """UID prefixes (any of), createdAt range and minimum days since last sign-in."""
+
+    def __init__(self, prefixes=(), created_after: datetime = None, created_before: datetime = None, inactive_days: float = None):
+        self.prefixes = tuple(prefixes)
+        self.created_after = _millis(created_after)
+        self.created_before = _millis(created_before)
+        self.inactive_before = None
+        if inactive_days is not None:
+            self.inactive_before = int((time.time() - inactive_days * 86400) * 1000)
+
+    def __bool__(self):
+        return bool(self.prefixes) or any(
+            v is not None for v in (self.created_after, self.created_before, self.inactive_before))
+
+    @property
+    def needs_created(self) -> bool:
+        return self.created_after is not None or self.created_before is not None
+
+    def matches_uid(self, uid: str) -> bool:
+        return not self.prefixes or uid.startswith(self.prefixes)
+
+    def matches(self, uid: str, created_ms=None, last_sign_in_ms=None) -> bool:
+        """`created_ms`/`last_sign_in_ms` are epoch millis or None (unknown / never)."""
+        if not self.matches_uid(uid):
+            return False
+        if self.needs_created:
+            if not isinstance(created_ms, (int, float)):
+                return False
+            if self.created_after is not None and created_ms < self.created_after:
+                return False
+            if self.created_before is not None and created_ms >= self.created_before:
+                return False
+        if self.inactive_before is not None and last_sign_in_ms and last_sign_in_ms >= self.inactive_before:
+            return False
+        return True
+
+
+def _millis(value: datetime):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def _batches(items, size: int):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def firestore_user_ids(fs, flt: UserFilter) -> dict:
+    """
+    {uid: createdAt millis or None} for Firestore users docs whose id passes
+    the prefix filter. Each prefix is an id range query; only createdAt is
+    read, and only when the filter needs it.
+    """
+    users = fs.collection("users")
+    fields = ["createdAt"] if flt.needs_created else []
+    queries = []
+    for prefix in flt.prefixes or [""]:
+        query = users.select(fields)
+        if prefix:
+            query = (query
+                     .where(filter=firestore.FieldFilter("__name__", ">=", users.document(prefix)))
+                     .where(filter=firestore.FieldFilter("__name__", "<", users.document(prefix + "\uf8ff"))))
+        queries.append(query)
+    found = {}
+    for query in queries:
+        for doc in query.stream():
+            created = (doc.to_dict() or {}).get("createdAt")
+            found[doc.id] = _millis(created) if isinstance(created, datetime) else created
+    return found
+
+
+def select_users(flt: UserFilter, workers: int = LOOKUP_WORKERS, fs=None):
+    """
+    Returns (auth_uids, rtdb_uids, firestore_uids): matching Auth users, and
+    matching ids under RTDB /users and Firestore users (Auth matches plus
+    users that exist only in that database and pass the filter). Firestore is
+    only listed when `fs` is given.
+    """
+    auth_uids, auth_seen = [], set()
+    page = auth.list_users(max_results=AUTH_BATCH_SIZE)
+    while page:
+        for user in page.users:
+            if not flt.matches_uid(user.uid):
+                continue
+            auth_seen.add(user.uid)
+            meta = user.user_metadata
+            if flt.matches(user.uid, meta.creation_timestamp, meta.last_sign_in_timestamp):
+                auth_uids.append(user.uid)
+        page = page.get_next_page()
+
+    matched = set(auth_uids)
+    keys = shallow_keys("users")
+    rtdb_only = [k for k in keys if flt.matches_uid(k) and k not in auth_seen]
+    if flt.needs_created:
+        # Only the createdAt leaf is read, never the whole user record
+        def created(uid):
+            return uid, _with_retry(db.reference(f"users/{uid}/createdAt").get)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            rtdb_only = [uid for uid, ms in pool.map(created, rtdb_only) if flt.matches(uid, ms)]
+    else:
+        rtdb_only = [uid for uid in rtdb_only if flt.matches(uid)]
+    rtdb_uids = [k for k in keys if k in matched] + rtdb_only
+
+    firestore_uids = []
+    if fs is not None:
+        docs = firestore_user_ids(fs, flt)
+        firestore_uids = [uid for uid, created in docs.items()
+                          if uid in matched or (uid not in auth_seen and flt.matches(uid, created))]
+    return auth_uids, rtdb_uids, firestore_uids
+
+
+def owned_keys(node: str, uids, workers: int = LOOKUP_WORKERS) -> list:
+    """Keys of children of `node` whose userId is one of `uids`, one indexed query per user."""
+    ref = db.reference(node)
+
+    def lookup(uid):
+        return list((_with_retry(ref.order_by_child("userId").equal_to(uid).get) or {}).keys())
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return [key for keys in pool.map(lookup, uids) for key in keys]
+
+
+def _delete_document_tree(writer, ref):
+    """
+    Queues `ref` and every document in its subcollections on `writer`.
+    Same walk as recursive_delete, which closes its writer after one
+    reference, so it cannot share a BulkWriter across users.
+    """
+    for collection in ref.collections():
+        for doc in collection.recursive().select([]).stream():
+            writer.delete(doc.reference)
+    writer.delete(ref)
+
+
+def delete_firestore_owned(fs, user_ids, owner_ids) -> dict:
+    """
+    Deletes users/{uid} for `user_ids` with everything below it (counter
+    shards, leaderboard stats), and posts/stories whose userId is in
+    `owner_ids`, through one BulkWriter.
+    """
+    progress = Progress("Firestore documents")
+    counts = {"users": 0, **{name: 0 for name in OWNED_NODES}}
+    writer = fs.bulk_writer()
+    writer.on_write_result(lambda *_: progress.add(1))
+    for uid in user_ids:
+        _delete_document_tree(writer, fs.collection("users").document(uid))
+        counts["users"] += 1
+    for name in OWNED_NODES:
+        for chunk in _batches(owner_ids, FIRESTORE_IN_LIMIT):
+            query = fs.collection(name).where(filter=firestore.FieldFilter("userId", "in", chunk)).select([])
+            for doc in query.stream():
+                writer.delete(doc.reference)
+                counts[name] += 1
+    writer.close()
+    progress.report()
+    return counts
+
+
+def cleanup_matching(flt: UserFilter, phases=PHASES, dry_run: bool = False) -> dict:
+    """Removes users matching `flt` and everything they own. Returns per-target counts."""
+    print(f"🔎 Selecting users ({'dry run' if dry_run else 'delete'})...")
+    started = time.perf_counter()
+    fs = firestore.client() if "firestore" in phases else None
+    auth_uids, rtdb_uids, firestore_uids = select_users(flt, fs=fs)
+    uids = sorted(set(auth_uids) | set(rtdb_uids) | set(firestore_uids))
+    report = {"auth": len(auth_uids), "rtdb:users": len(rtdb_uids)}
+    print(f"   {len(uids)} matching users ({len(auth_uids)} in Auth, {len(rtdb_uids)} in RTDB, "
+          f"{len(firestore_uids)} in Firestore)")
+    for uid in uids[:10]:
+        print(f"   • {uid}")
+    if len(uids) > 10:
+        print(f"   … and {len(uids) - 10} more")
+
+    owned = {}
+    if "rtdb" in phases:
+        for node in OWNED_NODES:
+            owned[node] = owned_keys(node, uids)
+            report[f"rtdb:{node}"] = len(owned[node])
+
+    if dry_run:
+        if fs is not None:
+            report["firestore:users"] = len(firestore_uids)
+            for name in OWNED_NODES:
+                report[f"firestore:{name}"] = sum(
+                    fs.collection(name).where(filter=firestore.FieldFilter("userId", "in", chunk)).count().get()[0][0].value
+                    for chunk in _batches(uids, FIRESTORE_IN_LIMIT))
+        print("📝 Dry run, nothing deleted:")
+        for target, count in report.items():
+            print(f"   {target}: {count}")
+        return report
+
+    if "auth" in phases and auth_uids:
+        print("🗑️ Deleting matching Auth users...")
+        delete_auth_users(_batches(auth_uids, AUTH_BATCH_SIZE))
+    if "rtdb" in phases:
+        print("🗑️ Deleting matching RTDB users, posts and stories...")
+        delete_rtdb_keys("users", rtdb_uids)
+        for node, keys in owned.items():
+            delete_rtdb_keys(node, keys)
+    if fs is not None and uids:
+        print("🗑️ Deleting matching Firestore users, posts and stories...")
+        for name, count in delete_firestore_owned(fs, firestore_uids, uids).items():
+            report[f"firestore:{name}"] = count
+
+    print(f"\n✨ Selective cleanup finished in {time.perf_counter() - started:.1f}s!")
+    return report
+
+
+def cleanup_auth_and_db(phases=PHASES, checkpoint: Checkpoint = None):
+    print("🧹 Cleaning up Firebase Auth, Realtime Database and Firestore...")
+    checkpoint = checkpoint or Checkpoint(CHECKPOINT_FILE)
+    started = time.perf_counter()
+
+    # 1. Auth users. Deleted users drop out of list_users, so a resumed run
+    # simply lists what is left.
+    if "auth" in phases and not checkpoint.done("auth"):
         print("🗑️ Deleting all users from Firebase Auth...")
-        # Iterating through all users
-        page = auth.list_users()
-        total_deleted = 0
-        while True:
-            uids = [user.uid for user in page.users]
-            if uids:
-                result = auth.delete_users(uids)
-                total_deleted += result.success_count
-                print(f"   - Deleted {result.success_count} users...")
-            
-            if page.has_next_page:
-                page = page.get_next_page()
-            else:
-                break
-        
-        if total_deleted == 0:
-            print("ℹ️ No users found in Firebase Auth.")
-        else:
-            print(f"✅ Total users deleted: {total_deleted}")
-            
-    except Exception as e:
-        print(f"❌ Error deleting users from Auth: {e}")
-        print("   (Note: You can also delete users manually in Firebase Console -> Authentication)")
+        try:
+            delete_auth_users(auth_uid_batches(), checkpoint)
+            checkpoint.finish("auth")
+        except Exception as e:
+            print(f"❌ Error deleting users from Auth: {e}")
+            print("   (Note: You can also delete users manually in Firebase Console -> Authentication)")
 
-    # 2. Clear 'users' node in Realtime Database
-    try:
-        print("🗑️ Clearing 'users' node in Realtime Database...")
-        ref = db.reference('/users')
-        ref.delete()
-        print("✅ 'users' node cleared.")
-    except Exception as e:
-        print(f"❌ Error clearing RTDB: {e}")
+    # 2. RTDB nodes, chunk by chunk
+    if "rtdb" in phases:
+        for node in RTDB_NODES:
+            step = f"rtdb:{node}"
+            if checkpoint.done(step):
+                continue
+            print(f"🗑️ Clearing '{node}' node in Realtime Database...")
+            try:
+                delete_rtdb_keys(node, shallow_keys(node), checkpoint)
+                checkpoint.finish(step)
+            except Exception as e:
+                print(f"❌ Error clearing RTDB /{node}: {e}")
+
+    # 3. Firestore collections
+    if "firestore" in phases:
+        fs = firestore.client()
+        for name in FIRESTORE_COLLECTIONS:
+            step = f"firestore:{name}"
+            if checkpoint.done(step):
+                continue
+            print(f"🗑️ Deleting Firestore '{name}' (recursive)...")
+            try:
+                delete_firestore_collection(fs, name, checkpoint)
+                checkpoint.finish(step)
+            except Exception as e:
+                print(f"❌ Error deleting Firestore {name}: {e}")
+
+    print(f"\n✨ Cleanup Process Finished in {time.perf_counter() - started:.1f}s!")
+    print(f"   Checkpoint: {checkpoint.path} (delete it or pass --fresh to start over)")
 
-    print("\n✨ Cleanup Process Finished!")
 
 if __name__ == "__main__":
-    cleanup_auth_and_db()
+    parser = argparse.ArgumentParser(description="Delete all users and their content.")
+    parser.add_argument("--only", nargs="+", choices=PHASES, default=PHASES, help="Phases to run.")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_FILE)
+    parser.add_argument("--fresh", action="store_true", help="Ignore an existing checkpoint.")
+    selective = parser.add_argument_group("selective cleanup (any of these deletes only matching users)")
+    selective.add_argument("--prefix", nargs="+", default=[], help="UID prefixes, e.g. demo_user_ user_")
+    selective.add_argument("--created-after", type=datetime.fromisoformat, help="ISO date/time (UTC if no offset).")
+    selective.add_argument("--created-before", type=datetime.fromisoformat, help="ISO date/time (UTC if no offset).")
+    selective.add_argument("--inactive-days", type=float, help="No sign-in for at least this many days.")
+    selective.add_argument("--dry-run", action="store_true", help="Report what would be deleted.")
+    args = parser.parse_args()
+    user_filter = UserFilter(args.prefix, args.created_after, args.created_before, args.inactive_days)
+    if args.dry_run and not user_filter:
+        parser.error("--dry-run needs at least one filter")
+
+    # SETUP
+    try:
+        cred = credentials.Certificate('service-account.json')
+        # Explicitly setting project_id in initialization
+        firebase_admin.initialize_app(cred, {
+            'projectId': PROJECT_ID,
+            'databaseURL': f'https://{PROJECT_ID}-default-rtdb.asia-southeast1.firebasedatabase.app/'
+        })
+        print(f"✅ Firebase Admin Initialized for {PROJECT_ID}")
+    except Exception as e:
+        print(f"❌ Failed to initialize Firebase Admin: {e}")
+        sys.exit(1)
+
+    if user_filter:
+        cleanup_matching(user_filter, args.only, args.dry_run)
+    else:
+        cleanup_auth_and_db(args.only, Checkpoint(args.checkpoint, fresh=args.fresh))
@@ -0,0 +1,103 @@
+"""
+Batched writes and key paging shared by the scheduled jobs and the seed
+scripts (seed/bulk_loader.py puts this directory on sys.path).
+
+    for chunk in chunks(items, MAX_BATCH_WRITES): ...
+
+    with BatchCommitter(db) as writer:          # commits every MAX_BATCH_WRITES writes
+        writer.reserve(2)                       # the next two writes land in one commit
+        writer.set(ref, data)
+        writer.delete(other_ref)
+
+    page = rtdb_page(node, cursor, 200)         # next 200 children by key after `cursor`
+    for key, value in rtdb_pages(node, 1000): ...
+"""
+
+import itertools
+
+MAX_BATCH_WRITES = 500  # Firestore limit on writes per commit
+
+
+def chunks(iterable, size: int):
+    """Yields lists of up to `size` items without materialising the iterable."""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class BatchCommitter:
+    """
+    WriteBatch that commits itself before it would exceed `max_writes` writes
+    or, when given, roughly `max_bytes` of reserved payload. Same set/update/
+    delete signatures as a WriteBatch, so helpers that take a `writer` (e.g.
+    counters.reset) work with it too. The last partial batch is committed on
+    leaving the `with` block, unless it is left by an exception.
+    """
+
+    def __init__(self, db, max_writes: int = MAX_BATCH_WRITES, max_bytes: int = None):
+        self.db = db
+        self.max_writes = max_writes
+        self.max_bytes = max_bytes
+        self.commits = 0
+        self._batch = db.batch()
+        self._writes = 0
+        self._size = 0
+
+    def reserve(self, writes: int, size: int = 0):
+        """Commits first unless `writes` more writes (and `size` bytes) fit, so they share a commit."""
+        too_big = self.max_bytes is not None and self._size + size > self.max_bytes
+        if self._writes and (self._writes + writes > self.max_writes or too_big):
+            self.commit()
+        self._size += size
+
+    def _next(self):
+        if self._writes >= self.max_writes:
+            self.commit()
+        self._writes += 1
+        return self._batch
+
+    def set(self, ref, data, merge=False):
+        self._next().set(ref, data, merge=merge)
+
+    def update(self, ref, data):
+        self._next().update(ref, data)
+
+    def delete(self, ref):
+        self._next().delete(ref)
+
+    def commit(self):
+        if self._writes:
+            self._batch.commit()
+            self.commits += 1
+        self._batch, self._writes, self._size = self.db.batch(), 0, 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.commit()
+
+
+def rtdb_page(node, cursor, page_size: int) -> list:
+    """Up to `page_size` (key, value) children of an RTDB node ordered by key, after `cursor` (None: from the start)."""
+    query = node.order_by_key()
+    if cursor is None:
+        return list((query.limit_to_first(page_size).get() or {}).items())
+    # start_at is inclusive; fetch one extra and drop the cursor itself
+    page = query.start_at(cursor).limit_to_first(page_size + 1).get() or {}
+    return [(k, v) for k, v in page.items() if k != cursor][:page_size]
+
+
+def rtdb_pages(node, page_size: int):
+    """Yields every (key, value) child of an RTDB node ordered by key, one page per read."""
+    cursor = None
+    while True:
+        items = rtdb_page(node, cursor, page_size)
+        yield from items
+        if len(items) < page_size:
+            return
+        cursor = items[-1][0]
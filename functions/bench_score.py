@@ -0,0 +1,298 @@
+"""
+End-to-end benchmark for score_sdg_post against the Firestore and Storage
+emulators, with Gemini replaced by a stub model of configurable latency and
+failure rate.
+
+Seeds N pending SDG posts (+ their users and image blobs), replays N storage
+events at a target rate (open loop: events are not held back by slow ones)
+and reports p50/p95/p99 latency, throughput, Firestore RPCs per post and peak
+RSS. Results are saved as JSON so runs can be diffed between commits.
+
+Usage:
+  firebase emulators:start --only firestore,storage
+  export FIRESTORE_EMULATOR_HOST=localhost:8080
+  export STORAGE_EMULATOR_HOST=http://localhost:9199
+  python bench_score.py --events 500 --rate 50 --latency-ms 800 --failure-rate 0.02 --out bench/HEAD.json
+  python bench_score.py --compare bench/base.json bench/HEAD.json
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core import exceptions as gexc
+
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "demo-bench")
+PROJECT = os.environ["GOOGLE_CLOUD_PROJECT"]
+
+import main  # noqa: E402
+
+# Counted as Firestore RPCs. Transactions count their reads via get/get_all
+# and their commit via Transaction._commit.
+FIRESTORE_RPCS = [
+    ("google.cloud.firestore_v1.document", "DocumentReference", ["get", "set", "update", "delete", "create"]),
+    ("google.cloud.firestore_v1.batch", "WriteBatch", ["commit"]),
+    ("google.cloud.firestore_v1.transaction", "Transaction", ["_commit", "_begin"]),
+    ("google.cloud.firestore_v1.client", "Client", ["get_all"]),
+    ("google.cloud.firestore_v1.query", "Query", ["stream"]),
+]
+
+
+class _Response:
+    # Never blocked: no block reason and no candidates to inspect
+    prompt_feedback = types.SimpleNamespace(block_reason=0)
+    candidates = ()
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubGenerativeModel:
+    """Stands in for genai.GenerativeModel: sleeps, sometimes fails, returns valid JSON."""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, failure_rate: float, unsafe_rate: float):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.unsafe_rate = unsafe_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, parts):
+        with self._lock:
+            self.calls += 1
+        time.sleep(max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000)
+        if random.random() < self.failure_rate:
+            raise gexc.ResourceExhausted("Resource has been exhausted (stub)")
+        prompt = parts[-1]
+        safety = {"is_safe": random.random() >= self.unsafe_rate, "reason": "stub"}
+        score = random.randint(0, 100)
+        sdg = {"is_sdg_related": score > 20, "sdg_goals": [random.randint(1, 17)], "score": score, "reason": "stub"}
+        if prompt == main.COMBINED_PROMPT:
+            return _Response(json.dumps({"safety": safety, "sdg": sdg}))
+        if prompt == main.SAFETY_PROMPT:
+            return _Response(json.dumps(safety))
+        return _Response(json.dumps(sdg))
+
+
+class RpcCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self.enabled = False
+
+    def install(self):
+        import importlib
+
+        for module_name, class_name, methods in FIRESTORE_RPCS:
+            cls = getattr(importlib.import_module(module_name), class_name)
+            for method in methods:
+                setattr(cls, method, self._wrap(getattr(cls, method)))
+
+    def _wrap(self, fn):
+        counter = self
+
+        def wrapped(*args, **kwargs):
+            if counter.enabled:
+                with counter._lock:
+                    counter.count += 1
+            return fn(*args, **kwargs)
+
+        return wrapped
+
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def _install_emulator_clients(model: StubGenerativeModel):
+    from google.auth.credentials import AnonymousCredentials
+    from google.cloud import firestore as gcf
+    from google.cloud import storage as gcs
+
+    main._clients["firestore"] = gcf.Client(project=PROJECT, credentials=AnonymousCredentials())
+    main._clients["storage"] = gcs.Client(project=PROJECT, credentials=AnonymousCredentials())
+    main._clients["gemini"] = model
+    for model_name in main.GEMINI_FALLBACK_MODELS:
+        main._clients[f"gemini:{model_name}"] = model
+
+
+def _seed(events: int, users: int, bucket_name: str, image_bytes: int, duplicate_rate: float) -> list:
+    """Creates users, pending posts and blobs; returns the storage events to replay."""
+    db = main.get_db()
+    bucket = main.get_storage_client().bucket(bucket_name)
+    run_id = f"{int(time.time())}"
+    writer = db.bulk_writer()
+    for u in range(users):
+        writer.set(db.collection("users").document(f"bench_user_{u}"), {"uid": f"bench_user_{u}", "streak": 0})
+
+    shared_image = b"\xff\xd8\xff\xe0" + os.urandom(image_bytes)
+    payloads = []
+    for i in range(events):
+        post_id = f"bench_{run_id}_{i:06d}"
+        user = random.randrange(users)
+        writer.set(db.collection("posts").document(post_id), {
+            "id": post_id,
+            "userId": f"bench_user_{user}",
+            "userDisplayName": f"Bench User {user}",
+            "userPhotoURL": "",
+            "type": "sdg",
+            "status": "pending",
+            "mediaType": "image",
+            "caption": "benchmark post",
+            "createdAt": main.firestore.SERVER_TIMESTAMP,
+        })
+        # Duplicates exercise the Gemini result cache
+        data = shared_image if random.random() < duplicate_rate else b"\xff\xd8\xff\xe0" + os.urandom(image_bytes)
+        payloads.append((f"posts/{post_id}.jpg", data))
+    writer.close()
+
+    def upload(payload) -> dict:
+        name, data = payload
+        blob = bucket.blob(name)
+        blob.upload_from_string(data, content_type="image/jpeg")
+        return {
+            "bucket": bucket_name, "name": name, "generation": str(blob.generation),
+            "size": str(len(data)), "contentType": "image/jpeg",
+        }
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        return list(pool.map(upload, payloads))
+
+
+def run(args) -> dict:
+    model = StubGenerativeModel(args.latency_ms, args.jitter_ms, args.failure_rate, args.unsafe_rate)
+    _install_emulator_clients(model)
+    bucket = main.get_storage_client().bucket(args.bucket)
+    if not bucket.exists():
+        bucket.create()
+
+    print(f"Seeding {args.events} pending posts...")
+    events = _seed(args.events, args.users, args.bucket, args.image_bytes, args.duplicate_rate)
+
+    rpcs = RpcCounter()
+    rpcs.install()
+    rpcs.enabled = True
+    main.STAGE_HISTOGRAMS = True
+    main.stage_histograms(reset=True)
+    model.calls = 0
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def fire(event, scheduled_at):
+        nonlocal errors
+        try:
+            main.score_sdg_post(event, None)
+        except Exception as e:
+            with lock:
+                errors += 1
+            print(f"  ⚠️  {event['name']}: {e}")
+        with lock:
+            latencies.append(time.perf_counter() - scheduled_at)
+
+    print(f"Replaying {len(events)} events at {args.rate}/s...")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for i, event in enumerate(events):
+            scheduled_at = started + i / args.rate
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, event, scheduled_at)
+    elapsed = time.perf_counter() - started
+    rpcs.enabled = False
+
+    return {
+        "commit": _git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "events": len(events),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(events) / elapsed, 2),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50) * 1000, 1),
+            "p95": round(_percentile(latencies, 95) * 1000, 1),
+            "p99": round(_percentile(latencies, 99) * 1000, 1),
+            "mean": round(statistics.mean(latencies) * 1000, 1),
+        },
+        "firestore_rpcs_per_post": round(rpcs.count / len(events), 2),
+        "gemini_calls_per_post": round(model.calls / len(events), 2),
+        "rate_limits": main.gemini_rate_limit_metrics(),
+        "stages": main.stage_histograms(),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def _flatten(result: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in result.items():
+        if key == "config":
+            continue
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(base_path: str, head_path: str):
+    with open(base_path) as f:
+        base = _flatten(json.load(f))
+    with open(head_path) as f:
+        head = _flatten(json.load(f))
+    print(f"{'metric':<28} {'base':>12} {'head':>12} {'change':>9}")
+    for key in base:
+        if key in head:
+            change = (head[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+            print(f"{key:<28} {base[key]:>12} {head[key]:>12} {change:>+8.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20.0, help="events per second")
+    parser.add_argument("--concurrency", type=int, default=64, help="max in-flight events")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--bucket", default="bench-bucket")
+    parser.add_argument("--image-bytes", type=int, default=200_000)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--latency-ms", type=float, default=800.0, help="stub Gemini latency")
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--unsafe-rate", type=float, default=0.02)
+    parser.add_argument("--out", help="write the JSON result here")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="diff two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    if not (os.environ.get("FIRESTORE_EMULATOR_HOST") and os.environ.get("STORAGE_EMULATOR_HOST")):
+        sys.exit("Refusing to run: FIRESTORE_EMULATOR_HOST and STORAGE_EMULATOR_HOST must point at the emulators.")
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved to {args.out}")
@@ -0,0 +1,55 @@
+"""
+Startup benchmark for the scoring function's client registry.
+Compares the cold path (new clients + first round trip, what every event paid
+before the registry) with the warm path (reused clients + round trip).
+
+Usage: python bench_startup.py [--rounds 5]
+Needs the same credentials / env vars as the function (GEMINI_API_KEY,
+POSTS_BUCKET, or the emulator hosts).
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+t0 = time.perf_counter()
+import main  # noqa: E402
+IMPORT_MS = (time.perf_counter() - t0) * 1000
+
+
+def _reset_clients():
+    with main._clients_lock:
+        main._clients.clear()
+
+
+def run(rounds: int) -> dict:
+    cold = {"firestore": [], "storage": [], "gemini": []}
+    warm = {"firestore": [], "storage": [], "gemini": []}
+
+    for _ in range(rounds):
+        _reset_clients()
+        for name, entry in main.check_clients(deep=True).items():
+            cold[name].append(entry["latency_ms"])
+        for name, entry in main.check_clients(deep=True).items():
+            warm[name].append(entry["latency_ms"])
+
+    return {
+        "import_ms": round(IMPORT_MS, 1),
+        "rounds": rounds,
+        "cold_median_ms": {k: statistics.median(v) for k, v in cold.items()},
+        "warm_median_ms": {k: statistics.median(v) for k, v in warm.items()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    result = run(args.rounds)
+    print(f"Module import: {result['import_ms']} ms")
+    print(f"{'client':<10} {'cold ms':>10} {'warm ms':>10}")
+    for name in result["cold_median_ms"]:
+        print(f"{name:<10} {result['cold_median_ms'][name]:>10.1f} {result['warm_median_ms'][name]:>10.1f}")
+    print(json.dumps(result))
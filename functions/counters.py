@@ -0,0 +1,105 @@
+"""
+Distributed counters for hot numeric fields such as users.sdgScore and
+donation_projects.raisedAmount.
+
+Increments never touch the owning document. They land on one of N shard docs
+in its `counter_shards` subcollection:
+
+    {doc}/counter_shards/{field}_{i} -> {"field": field, "value": <pending delta>}
+
+A periodic roll-up moves each shard's pending delta onto the owning field
+(which is what clients read) and subtracts the same amount from the shard, in
+one atomic batch. Increments that race the roll-up simply stay on the shard
+for the next run, so nothing is lost and no transaction is needed.
+
+The roll-up query (`value != 0` over the collection group) needs a
+collection-group single-field index on `counter_shards.value`.
+
+Shared by the scoring function and the seed scripts, so it must not import
+main.py.
+"""
+
+import random
+
+from firebase_admin import firestore
+
+import batching
+
+SHARDS_SUBCOLLECTION = "counter_shards"
+DEFAULT_NUM_SHARDS = 10
+
+
+def shard_ref(doc_ref, field: str, index: int):
+    return doc_ref.collection(SHARDS_SUBCOLLECTION).document(f"{field}_{index}")
+
+
+def increment(doc_ref, field: str, amount, num_shards: int = DEFAULT_NUM_SHARDS, writer=None):
+    """
+    Adds `amount` to a random shard of doc_ref.field. Pass a transaction or
+    batch as `writer` to make the increment part of it.
+    """
+    ref = shard_ref(doc_ref, field, random.randrange(num_shards))
+    data = {
+        "field": field,
+        "value": firestore.Increment(amount),
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }
+    if writer is None:
+        ref.set(data, merge=True)
+    else:
+        writer.set(ref, data, merge=True)
+
+
+def _shards(doc_ref, field: str, transaction=None):
+    query = doc_ref.collection(SHARDS_SUBCOLLECTION).where(
+        filter=firestore.FieldFilter("field", "==", field)
+    )
+    return list(query.stream(transaction=transaction))
+
+
+def total(doc_ref, field: str, transaction=None):
+    """Aggregate read: rolled-up value on the document plus every pending shard delta."""
+    doc = doc_ref.get(transaction=transaction)
+    base = (doc.to_dict() or {}).get(field, 0) if doc.exists else 0
+    return base + sum(shard.to_dict().get("value", 0) for shard in _shards(doc_ref, field, transaction))
+
+
+def reset(doc_ref, field: str, value, writer):
+    """
+    Sets doc_ref.field to `value` and zeroes its shards as part of `writer`
+    (a batch or transaction), so stale pending deltas from an earlier run are
+    not added on top of freshly seeded data.
+    """
+    writer.set(doc_ref, {field: value}, merge=True)
+    for shard in _shards(doc_ref, field):
+        writer.set(shard.reference, {"value": 0}, merge=True)
+
+
+def roll_up(db) -> int:
+    """
+    Moves every pending shard delta onto its owning field. Returns the number
+    of shards rolled up. Shards whose owning document no longer exists are
+    deleted instead; otherwise their delta would be retried (and fail) on
+    every run.
+    """
+    query = db.collection_group(SHARDS_SUBCOLLECTION).where(
+        filter=firestore.FieldFilter("value", "!=", 0)
+    )
+    rolled = 0
+    # Both writes for a shard go in the same batch so the move is atomic.
+    for chunk in batching.chunks(query.stream(), batching.MAX_BATCH_WRITES // 2):
+        owners = {shard.reference.parent.parent.path: shard.reference.parent.parent for shard in chunk}
+        existing = {doc.reference.path for doc in db.get_all(list(owners.values()), field_paths=[]) if doc.exists}
+        batch = db.batch()
+        for shard in chunk:
+            data = shard.to_dict()
+            delta = data.get("value", 0)
+            owner = shard.reference.parent.parent
+            if owner.path not in existing:
+                batch.delete(shard.reference)
+                continue
+            batch.update(owner, {data["field"]: firestore.Increment(delta)})
+            batch.update(shard.reference, {"value": firestore.Increment(-delta)})
+            rolled += 1
+        batch.commit()
+    return rolled
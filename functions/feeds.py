@@ -0,0 +1,141 @@
+"""
+Materialized feeds: small, precomputed documents holding the newest posts so
+clients read one doc instead of downloading the whole `posts` collection.
+
+    feeds/global       newest FEED_SIZE posts for the main feed
+    feeds/sdg          newest FEED_SIZE scored SDG posts
+    feeds/user_{uid}   newest FEED_SIZE posts by one user
+
+Membership mirrors the client-side filters in DatabaseService.watchFeed,
+watchSdgFeed and watchUserPosts. Each feed doc is {"items": [...], "updatedAt"}
+with items sorted newest first.
+"""
+
+from datetime import datetime
+
+from firebase_admin import firestore
+
+import batching
+
+FEEDS_COLLECTION = "feeds"
+FEED_SIZE = 50
+GLOBAL_FEED = "global"
+SDG_FEED = "sdg"
+
+# Post fields copied into feed items (everything PostModel needs to render a card)
+ITEM_FIELDS = (
+    "userId", "userDisplayName", "userPhotoURL", "type", "mediaURL", "mediaType",
+    "imageURLs", "caption", "sdgScore", "sdgGoals", "aiReason", "status", "likes",
+    "createdAt",
+)
+
+
+def user_feed_id(user_id: str) -> str:
+    return f"user_{user_id}"
+
+
+def memberships(post: dict) -> dict:
+    """Maps every feed id the post could appear in to whether it belongs there now."""
+    status = post.get("status")
+    is_sdg = post.get("type") == "sdg"
+    result = {
+        # Normal posts show unless rejected; SDG posts only once certified.
+        GLOBAL_FEED: status == "scored" if is_sdg else status != "rejected",
+        SDG_FEED: is_sdg and status == "scored",
+    }
+    if post.get("userId"):
+        result[user_feed_id(post["userId"])] = True
+    return result
+
+
+def _is_inline(value) -> bool:
+    return isinstance(value, str) and value.startswith("data:")
+
+
+def to_item(post_id: str, post: dict) -> dict:
+    """
+    Feed item for a post. Inline data: URIs are left out: FEED_SIZE of them
+    would push a feed past Firestore's 1 MiB document limit. Clients fall
+    back to the post itself until media.py moves the image to Storage.
+    """
+    item = {field: post[field] for field in ITEM_FIELDS if field in post}
+    if _is_inline(item.get("mediaURL")):
+        del item["mediaURL"]
+    if isinstance(item.get("imageURLs"), list):
+        item["imageURLs"] = [url for url in item["imageURLs"] if not _is_inline(url)]
+    item["id"] = post_id
+    return item
+
+
+def _sort_key(item: dict) -> float:
+    created_at = item.get("createdAt")
+    if isinstance(created_at, datetime):
+        return created_at.timestamp()
+    if isinstance(created_at, (int, float)):
+        return created_at / 1000  # RTDB-style epoch millis
+    return 0.0
+
+
+def _merge(items: list, post_id: str, item, feed_size: int) -> list:
+    items = [i for i in items if i.get("id") != post_id]
+    if item is not None:
+        items.append(item)
+        items.sort(key=_sort_key, reverse=True)
+    return items[:feed_size]
+
+
+def apply_post_change(db, post_id: str, post, user_id: str = None, feed_size: int = FEED_SIZE):
+    """
+    Upserts or removes one post in every feed it can appear in, in a single
+    transaction. Pass post=None (and the author's user_id) for a deleted post.
+    """
+    if post is None:
+        targets = {GLOBAL_FEED: False, SDG_FEED: False}
+        if user_id:
+            targets[user_feed_id(user_id)] = False
+    else:
+        targets = memberships(post)
+    item = to_item(post_id, post) if post is not None else None
+    refs = {feed_id: db.collection(FEEDS_COLLECTION).document(feed_id) for feed_id in targets}
+
+    @firestore.transactional
+    def update(transaction):
+        for snapshot in db.get_all(list(refs.values()), transaction=transaction):
+            items = (snapshot.to_dict() or {}).get("items", []) if snapshot.exists else []
+            include = targets[snapshot.id]
+            present = any(i.get("id") == post_id for i in items)
+            if not include and not present:
+                continue
+            if include and not present and len(items) >= feed_size and _sort_key(item) <= _sort_key(items[-1]):
+                continue  # Older than everything in a full feed
+            transaction.set(refs[snapshot.id], {
+                "items": _merge(items, post_id, item if include else None, feed_size),
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            })
+
+    update(db.transaction())
+
+
+def rebuild(db, feed_size: int = FEED_SIZE) -> dict:
+    """
+    Recomputes every feed from the posts collection in one pass over posts
+    ordered newest first, then writes them in batches. Used for backfills.
+    """
+    feeds = {GLOBAL_FEED: [], SDG_FEED: []}
+    scanned = 0
+    query = db.collection("posts").order_by("createdAt", direction=firestore.Query.DESCENDING)
+    for doc in query.stream():
+        scanned += 1
+        post = doc.to_dict()
+        for feed_id, include in memberships(post).items():
+            items = feeds.setdefault(feed_id, [])
+            if include and len(items) < feed_size:
+                items.append(to_item(doc.id, post))
+
+    with batching.BatchCommitter(db) as writer:
+        for feed_id, items in feeds.items():
+            writer.set(db.collection(FEEDS_COLLECTION).document(feed_id), {
+                "items": items,
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            })
+    return {"posts_scanned": scanned, "feeds_written": len(feeds)}
@@ -0,0 +1,181 @@
+"""
+Server-maintained leaderboards, so clients read one small document instead of
+ordering the whole users node.
+
+    leaderboards/overall            top TOP_N users by scored-post points
+    leaderboards/sdg_{goal}         top TOP_N per SDG goal (1-17)
+    leaderboards/weekly_{YYYY-Www}  top TOP_N for one ISO week (UTC)
+
+Each board is {"entries": [{uid, displayName, photoURL, score}], "minScore",
+"updatedAt"} with entries sorted by score, highest first.
+
+Per-user window totals live in users/{uid}/stats/leaderboard, so a user who
+is not on a board yet can still be ranked from their own totals. Both are
+updated together in one transaction per award; boards are only written when
+the user actually enters or moves on them.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+import batching
+
+LEADERBOARDS_COLLECTION = "leaderboards"
+OVERALL_BOARD = "overall"
+TOP_N = 100
+WEEKS_KEPT = 8  # weekly totals kept on each user's stats doc
+
+
+def goal_board_id(goal: int) -> str:
+    return f"sdg_{goal}"
+
+
+def week_key(when: datetime) -> str:
+    year, week, _ = when.astimezone(timezone.utc).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def weekly_board_id(when: datetime) -> str:
+    return f"weekly_{week_key(when)}"
+
+
+def _stats_ref(db, user_id: str):
+    return db.collection("users").document(user_id).collection("stats").document("leaderboard")
+
+
+def _rank(entries: list, entry: dict, top_n: int):
+    """Returns the new entries list, or None when the board does not change."""
+    others = [e for e in entries if e["uid"] != entry["uid"]]
+    if len(others) >= top_n and entry["score"] <= others[-1]["score"]:
+        if len(others) == len(entries):
+            return None  # Not on the board and not good enough to enter
+        return others[:top_n]
+    ranked = sorted(others + [entry], key=lambda e: e["score"], reverse=True)
+    return ranked[:top_n]
+
+
+def _board_doc(entries: list) -> dict:
+    return {
+        "entries": entries,
+        "minScore": entries[-1]["score"] if entries else 0,
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }
+
+
+def record_score(db, user_id: str, points: int, sdg_goals: list, profile: dict, when: datetime = None, top_n: int = TOP_N,
+                 claim=None):
+    """
+    Adds `points` to the user's overall, per-goal and weekly totals and updates
+    every affected board in a single transaction. `when` picks the week
+    (callers pass the post's createdAt, as rebuild does); a week older than
+    the user's last WEEKS_KEPT is not tracked, so only its weekly board is
+    left alone.
+
+    `claim` is an optional (doc_ref, step): the points are only added while
+    `step` is listed in that document's awardPending field, and it is removed
+    in the same transaction, so a retried award is applied exactly once.
+    Returns False when the claim was already spent.
+    """
+    when = when or datetime.now(timezone.utc)
+    week = week_key(when)
+    board_ids = [OVERALL_BOARD, weekly_board_id(when)] + [goal_board_id(g) for g in set(sdg_goals)]
+    stats_ref = _stats_ref(db, user_id)
+    board_refs = [db.collection(LEADERBOARDS_COLLECTION).document(b) for b in board_ids]
+
+    claim_refs = [claim[0]] if claim else []
+
+    @firestore.transactional
+    def update(transaction):
+        snapshots = {s.reference.path: s for s in db.get_all([stats_ref] + board_refs + claim_refs, transaction=transaction)}
+        if claim:
+            claim_doc = snapshots[claim[0].path]
+            if not claim_doc.exists or claim[1] not in (claim_doc.to_dict() or {}).get("awardPending", []):
+                return False
+            transaction.update(claim[0], {"awardPending": firestore.ArrayRemove([claim[1]])})
+        stats_doc = snapshots[stats_ref.path]
+        stats = stats_doc.to_dict() if stats_doc.exists else {}
+
+        total = stats.get("total", 0) + points
+        goals = dict(stats.get("goals", {}))
+        for goal in set(sdg_goals):
+            goals[str(goal)] = goals.get(str(goal), 0) + points
+        weeks = dict(stats.get("weeks", {}))
+        weeks[week] = weeks.get(week, 0) + points
+        weeks = dict(sorted(weeks.items())[-WEEKS_KEPT:])
+        transaction.set(stats_ref, {"total": total, "goals": goals, "weeks": weeks})
+
+        scores = {OVERALL_BOARD: total}
+        if week in weeks:
+            scores[weekly_board_id(when)] = weeks[week]
+        scores.update({goal_board_id(g): goals[str(g)] for g in set(sdg_goals)})
+        for ref in board_refs:
+            if ref.id not in scores:
+                continue
+            board = snapshots[ref.path]
+            entries = (board.to_dict() or {}).get("entries", []) if board.exists else []
+            entry = {
+                "uid": user_id,
+                "displayName": profile.get("displayName", ""),
+                "photoURL": profile.get("photoURL", ""),
+                "score": scores[ref.id],
+            }
+            ranked = _rank(entries, entry, top_n)
+            if ranked is not None:
+                transaction.set(ref, _board_doc(ranked))
+        return True
+
+    return update(db.transaction())
+
+
+def rebuild(db, top_n: int = TOP_N) -> dict:
+    """
+    Recomputes every board and every user's stats doc from scored SDG posts.
+    Weekly boards are rebuilt for the last WEEKS_KEPT weeks that have posts.
+    """
+    totals = defaultdict(int)
+    goals = defaultdict(lambda: defaultdict(int))
+    weeks = defaultdict(lambda: defaultdict(int))
+    profiles = {}
+
+    query = (
+        db.collection("posts")
+        .where(filter=firestore.FieldFilter("status", "==", "scored"))
+        .where(filter=firestore.FieldFilter("type", "==", "sdg"))
+        .select(["userId", "userDisplayName", "userPhotoURL", "sdgScore", "sdgGoals", "createdAt"])
+    )
+    scanned = 0
+    for doc in query.stream():
+        scanned += 1
+        post = doc.to_dict()
+        uid = post.get("userId")
+        points = int(post.get("sdgScore", 0))
+        if not uid or points <= 0:
+            continue
+        profiles[uid] = {"displayName": post.get("userDisplayName", ""), "photoURL": post.get("userPhotoURL", "")}
+        totals[uid] += points
+        for goal in set(post.get("sdgGoals", [])):
+            goals[uid][str(goal)] += points
+        created_at = post.get("createdAt")
+        if isinstance(created_at, datetime):
+            weeks[uid][week_key(created_at)] += points
+
+    def top(scores: dict) -> list:
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:top_n]
+        return [{"uid": uid, **profiles[uid], "score": score} for uid, score in ranked]
+
+    boards = {OVERALL_BOARD: top(totals)}
+    for goal in range(1, 18):
+        boards[goal_board_id(goal)] = top({uid: g[str(goal)] for uid, g in goals.items() if str(goal) in g})
+    recent_weeks = sorted({w for user_weeks in weeks.values() for w in user_weeks})[-WEEKS_KEPT:]
+    for week in recent_weeks:
+        boards[f"weekly_{week}"] = top({uid: w[week] for uid, w in weeks.items() if week in w})
+
+    with batching.BatchCommitter(db) as writer:
+        for board_id, entries in boards.items():
+            writer.set(db.collection(LEADERBOARDS_COLLECTION).document(board_id), _board_doc(entries))
+        for uid, total in totals.items():
+            user_weeks = dict(sorted(weeks[uid].items())[-WEEKS_KEPT:])
+            writer.set(_stats_ref(db, uid), {"total": total, "goals": dict(goals[uid]), "weeks": user_weeks})
+    return {"posts_scanned": scanned, "users": len(totals), "boards": len(boards)}
@@ -1,23 +1,302 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
 from google import generativeai as genai
+from google.api_core.exceptions import NotFound
+import batching
+import counters
+import feeds
+import leaderboard
+import media
+import ratelimit
+import resilience
+import stories
+import asyncio
+import contextvars
 import json
 import base64
+import hashlib
+import io
 import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
 
-# Initialize Firebase Admin
+# Initialize Firebase Admin. The Realtime Database (where the app keeps
+# stories) is only reachable when FIREBASE_DATABASE_URL is set.
+DATABASE_URL = os.environ.get("FIREBASE_DATABASE_URL", "")
 if not firebase_admin._apps:
-    firebase_admin.initialize_app()
+    firebase_admin.initialize_app(options={"databaseURL": DATABASE_URL} if DATABASE_URL else None)
 
-db = firestore.client()
-
-# Configure Gemini
+# Gemini
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel(
-    model_name="gemini-1.5-flash",
-    generation_config={"response_mime_type": "application/json", "temperature": 0.3},
+GEMINI_MODEL_NAME = "gemini-1.5-flash"
+# Tried in order when the primary model is missing, throttled or down, like
+# GeminiService._generateWithFallback in the app (image-capable models only).
+GEMINI_FALLBACK_MODELS = [
+    m for m in os.environ.get("GEMINI_FALLBACK_MODELS", "gemini-1.5-flash-8b,gemini-1.5-pro").split(",") if m
+]
+GEMINI_MODEL_CHAIN = [GEMINI_MODEL_NAME] + [m for m in GEMINI_FALLBACK_MODELS if m != GEMINI_MODEL_NAME]
+GEMINI_MAX_ATTEMPTS = int(os.environ.get("GEMINI_MAX_ATTEMPTS", resilience.MAX_ATTEMPTS))
+GEMINI_BREAKER_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_THRESHOLD", 5))
+GEMINI_BREAKER_RESET_SECONDS = float(os.environ.get("GEMINI_BREAKER_RESET_SECONDS", 30))
+
+# Per-model quota shared by all instances through rate_limits/{model}
+# (GEMINI_RATE_LIMIT_BACKEND=local keeps it per process). Calls queue for up
+# to GEMINI_RATE_LIMIT_MAX_WAIT seconds before moving to the next model.
+# Token cost is estimated up front: a fixed cost per image plus the prompt
+# and a typical JSON answer. A budget of 0 disables that dimension.
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", 2000))
+GEMINI_TPM = int(os.environ.get("GEMINI_TPM", 4_000_000))
+GEMINI_RATE_LIMIT_BACKEND = os.environ.get("GEMINI_RATE_LIMIT_BACKEND", "firestore")
+GEMINI_RATE_LIMIT_MAX_WAIT = float(os.environ.get("GEMINI_RATE_LIMIT_MAX_WAIT", 60))
+GEMINI_IMAGE_TOKENS = 258
+GEMINI_OUTPUT_TOKENS = 200
+
+# Client registry: Firestore, Storage and Gemini clients are created lazily on
+# first use and then shared by every invocation a warm instance serves.
+# Firestore and Gemini keep one long-lived gRPC channel each; the Storage
+# client's HTTP session gets a pool large enough for the batch workers so
+# keep-alive connections are reused instead of discarded.
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 32))
+HEALTH_CHECK_COLLECTION = "_health"
+
+_clients: dict = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+def _new_storage_client():
+    from google.cloud import storage as gcs
+    from requests.adapters import HTTPAdapter
+
+    client = gcs.Client()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    client._http.mount("https://", adapter)
+    return client
+
+
+def _new_gemini_model(model_name: str = GEMINI_MODEL_NAME):
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(
+        model_name=model_name,
+        generation_config={"response_mime_type": "application/json", "temperature": 0.3},
+    )
+
+
+def get_db():
+    return _get_client("firestore", firestore.client)
+
+
+def get_storage_client():
+    return _get_client("storage", _new_storage_client)
+
+
+def get_model(model_name: str = GEMINI_MODEL_NAME):
+    key = "gemini" if model_name == GEMINI_MODEL_NAME else f"gemini:{model_name}"
+    return _get_client(key, lambda: _new_gemini_model(model_name))
+
+
+def check_clients(deep: bool = False) -> dict:
+    """
+    Reports which clients this instance has initialised. With deep=True each
+    client also makes one cheap round trip and the latency is recorded.
+    """
+    probes = {
+        "firestore": lambda: get_db().collection(HEALTH_CHECK_COLLECTION).document("ping").get(),
+        "storage": lambda: list(get_storage_client().bucket(POSTS_BUCKET).list_blobs(max_results=1)),
+        "gemini": lambda: (get_model(), genai.get_model(f"models/{GEMINI_MODEL_NAME}")),
+    }
+    report = {}
+    for name, probe in probes.items():
+        entry = {"initialised": name in _clients}
+        if deep:
+            start = time.perf_counter()
+            try:
+                probe()
+                entry["ok"] = True
+            except Exception as e:
+                entry["ok"] = False
+                entry["error"] = str(e)
+            entry["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        report[name] = entry
+    return report
+
+
+# Tracing: every scoring request gets a request id (the event id when the
+# trigger provides one) and a per-stage timings dict, carried in a context
+# variable so worker threads started with asyncio.to_thread see them too.
+# Logs are one JSON object per line, which Cloud Logging parses into
+# structured entries. With STAGE_HISTOGRAMS each stage duration is also
+# counted into in-process latency histograms (see stage_histograms()).
+STAGE_HISTOGRAMS = os.environ.get("STAGE_HISTOGRAMS", "false").lower() == "true"
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_histograms: dict = {}
+_histograms_lock = threading.Lock()
+
+
+def _start_trace(request_id: str = None, **fields) -> dict:
+    """Starts a trace for the current context and returns it."""
+    trace = {"requestId": request_id or uuid.uuid4().hex, "fields": fields, "timings": {}}
+    _trace.set(trace)
+    return trace
+
+
+def _log(message: str, severity: str = "INFO", **fields):
+    trace = _trace.get()
+    entry = {"severity": severity, "message": message}
+    if trace is not None:
+        entry["requestId"] = trace["requestId"]
+        entry.update(trace["fields"])
+    entry.update(fields)
+    print(json.dumps(entry, default=str))
+
+
+@contextmanager
+def _stage(name: str):
+    """Times a block into the current trace (summed if it repeats) and the histograms."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        trace = _trace.get()
+        if trace is not None:
+            trace["timings"][name] = trace["timings"].get(name, 0.0) + elapsed
+        if STAGE_HISTOGRAMS:
+            _observe(name, elapsed * 1000)
+
+
+def _observe(stage: str, elapsed_ms: float):
+    with _histograms_lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = {"count": 0, "sum_ms": 0.0, "counts": [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)}
+            _histograms[stage] = histogram
+        histogram["count"] += 1
+        histogram["sum_ms"] += elapsed_ms
+        index = next((i for i, b in enumerate(HISTOGRAM_BUCKETS_MS) if elapsed_ms <= b), len(HISTOGRAM_BUCKETS_MS))
+        histogram["counts"][index] += 1
+
+
+def _histogram_quantile(counts: list, total: int, q: float) -> float:
+    """Upper bound of the bucket holding the q-quantile (inf for the overflow bucket)."""
+    rank = q * total
+    seen = 0
+    for bound, count in zip(HISTOGRAM_BUCKETS_MS + (float("inf"),), counts):
+        seen += count
+        if seen >= rank:
+            return bound
+    return float("inf")
+
+
+def stage_histograms(reset: bool = False) -> dict:
+    """Per-stage latency histograms collected with STAGE_HISTOGRAMS, in milliseconds."""
+    with _histograms_lock:
+        snapshot = {stage: dict(h, counts=list(h["counts"])) for stage, h in _histograms.items()}
+        if reset:
+            _histograms.clear()
+    report = {}
+    for stage, h in snapshot.items():
+        report[stage] = {
+            "count": h["count"],
+            "mean_ms": round(h["sum_ms"] / h["count"], 1),
+            "p50_ms": _histogram_quantile(h["counts"], h["count"], 0.50),
+            "p95_ms": _histogram_quantile(h["counts"], h["count"], 0.95),
+            "p99_ms": _histogram_quantile(h["counts"], h["count"], 0.99),
+            "buckets": dict(zip([f"le_{b}" for b in HISTOGRAM_BUCKETS_MS] + ["inf"], h["counts"])),
+        }
+    return report
+
+
+def _timings_ms(timings: dict) -> dict:
+    return {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+
+
+# Gemini result cache: in-process LRU in front of a Firestore collection.
+# Configure a Firestore TTL policy on `gemini_cache.expiresAt` so stale
+# entries are also purged server-side.
+GEMINI_CACHE_COLLECTION = "gemini_cache"
+GEMINI_CACHE_TTL_SECONDS = int(os.environ.get("GEMINI_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+GEMINI_CACHE_LRU_SIZE = int(os.environ.get("GEMINI_CACHE_LRU_SIZE", 512))
+
+_gemini_lru: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+_gemini_lru_lock = threading.Lock()
+
+# Batch drain (score_pending_posts)
+POSTS_BUCKET = os.environ.get(
+    "POSTS_BUCKET", f"{os.environ.get('GOOGLE_CLOUD_PROJECT', '')}.appspot.com"
 )
+BATCH_LIMIT = int(os.environ.get("BATCH_LIMIT", 500))
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 8))
+
+# Image preprocessing: uploads are downscaled and re-encoded once before they
+# are sent to Gemini (IMAGE_OUTPUT_FORMAT is a Pillow format: JPEG or WEBP).
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", 1024))
+IMAGE_OUTPUT_FORMAT = os.environ.get("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 85))
+GEMINI_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/heic", "image/heif"}
+
+# Upload validation: oversized or non-image objects are rejected from their
+# metadata and the first bytes of the stream, before any full download.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 15 * 1024 * 1024))
+IMAGE_HEADER_BYTES = 12  # enough for every signature in _sniff_image_type
+
+# Start the Gemini calls as soon as the image is downloaded, before the post
+# document confirms it is an SDG post. Saves latency, may spend quota on
+# uploads that turn out not to need scoring.
+SPECULATIVE_SCORING = os.environ.get("SPECULATIVE_SCORING", "false").lower() == "true"
+
+# Expired-story sweeper (sweep_expired_stories): "delete" or "archive".
+STORY_SWEEP_MODE = os.environ.get("STORY_SWEEP_MODE", "delete")
+STORIES_BUCKET = os.environ.get("STORIES_BUCKET", POSTS_BUCKET)
+
+# Inline media normaliser (normalise_inline_media, see media.py): each
+# scheduled run handles at most MEDIA_NORMALISE_PAGES pages per source and
+# resumes from its checkpoint next time.
+MEDIA_BUCKET = os.environ.get("MEDIA_BUCKET", POSTS_BUCKET)
+MEDIA_COLLECTIONS = ("stories", "posts")
+MEDIA_NORMALISE_PAGES = int(os.environ.get("MEDIA_NORMALISE_PAGES", 20))
+
+# Event ledger: storage triggers are delivered at least once, so every object
+# generation is claimed in processed_events/{sha256(bucket/name#generation)}
+# before any model call. A claim left "processing" by a crashed invocation
+# can be taken over once its lease expires. Configure a Firestore TTL policy
+# on `processed_events.expiresAt` to purge old entries.
+EVENT_LEDGER_COLLECTION = "processed_events"
+EVENT_CLAIM_LEASE_SECONDS = int(os.environ.get("EVENT_CLAIM_LEASE_SECONDS", 600))
+EVENT_LEDGER_TTL_DAYS = int(os.environ.get("EVENT_LEDGER_TTL_DAYS", 30))
+SCORABLE_STATUSES = ("pending", "pending_retry")
+
+# Sharded counters (see counters.py); roll_up_counters folds the shards back
+# into the user-facing fields on a schedule.
+USER_SCORE_SHARDS = int(os.environ.get("USER_SCORE_SHARDS", counters.DEFAULT_NUM_SHARDS))
+
+# Posts that cannot be scored because Gemini is unavailable are parked as
+# status "pending_retry" and picked up again by score_pending_posts once
+# nextRetryAt has passed. The delay doubles per attempt up to the cap.
+SCORING_RETRY_BASE_SECONDS = int(os.environ.get("SCORING_RETRY_BASE_SECONDS", 300))
+SCORING_RETRY_CAP_SECONDS = int(os.environ.get("SCORING_RETRY_CAP_SECONDS", 6 * 3600))
+
+# "separate": safety call, then scoring call (two round trips).
+# "combined": one call returning both verdicts, falling back to "separate"
+# when the merged response does not validate.
+SCORING_MODE = os.environ.get("SCORING_MODE", "separate")
 
 SDG_SCORING_PROMPT = """
 Analyse this image submitted for a sustainable social media platform.
@@ -45,104 +324,1042 @@ Is this image safe and appropriate for a family-friendly social platform?
 Return ONLY: {"is_safe": true, "reason": "..."}
 """
 
+COMBINED_PROMPT = """
+Analyse this image submitted for a family-friendly, sustainable social media platform.
+
+A. Safety: is this image safe and appropriate for a family-friendly social platform?
+
+B. SDG impact:
+1. Does this image relate to any UN Sustainable Development Goals (SDGs)?
+2. If yes, which SDG numbers (1-17)?
+3. Give an SDG Impact Score from 0-100:
+   - 0-20: No SDG relevance
+   - 21-50: Mild relevance
+   - 51-80: Clear, meaningful SDG action
+   - 81-100: Exceptional direct impact
+4. Short reason (1-2 sentences, encouraging tone).
+
+Return ONLY valid JSON:
+{
+  "safety": {"is_safe": true, "reason": "..."},
+  "sdg": {
+    "is_sdg_related": true,
+    "sdg_goals": [4, 12],
+    "score": 75,
+    "reason": "This image shows..."
+  }
+}
+"""
+
 
 def score_sdg_post(event, context):
     """
     Cloud Storage trigger: fires when a new file is uploaded to the 'posts/' prefix.
     Reads Firestore to find the pending post, calls Gemini, updates the score.
+    Thin synchronous wrapper around score_sdg_post_async.
+    """
+    return asyncio.run(score_sdg_post_async(event, context))
+
+
+async def score_sdg_post_async(event, context) -> dict:
     """
-    bucket = event["bucket"]
+    Async scoring pipeline. The post lookup and the image download are
+    independent, so they run concurrently; with SPECULATIVE_SCORING the Gemini
+    calls also start as soon as the bytes arrive instead of waiting for the
+    post document. Each object generation is claimed in the event ledger
+    first, so redelivered events exit after one read. Returns per-stage
+    timings in seconds and logs them as one structured entry.
+    """
+    started = time.perf_counter()
     file_path = event["name"]  # e.g. "posts/abc123.jpg"
 
     if not file_path.startswith("posts/"):
-        return
+        return {}
 
     # Derive postId from filename
     post_id = file_path.split("/")[1].rsplit(".", 1)[0]
+    trace = _start_trace(getattr(context, "event_id", None), postId=post_id)
+    timings = trace["timings"]
+    event_key = _event_key(event["bucket"], file_path, event.get("generation"))
+    if not await _run_timed("claim", _claim_event, event_key, event, post_id):
+        _log("Event already handled, skipping.", object=file_path, generation=event.get("generation"))
+        return timings
 
-    # Get post document
-    post_ref = db.collection("posts").document(post_id)
-    post_doc = post_ref.get()
+    try:
+        outcome = await _score_upload(event, post_id)
+    except BaseException:
+        await asyncio.to_thread(_release_event, event_key)
+        raise
+    await _run_timed("ledger_update", _finish_event, event_key, outcome)
+    timings["total"] = time.perf_counter() - started
+    if STAGE_HISTOGRAMS:
+        _observe("total", timings["total"] * 1000)
+    _log("Scoring finished.", outcome=outcome, timings_ms=_timings_ms(timings))
+    return timings
+
+
+async def _score_upload(event: dict, post_id: str) -> str:
+    """Scores one upload and returns the outcome recorded in the event ledger."""
+    post_ref = get_db().collection("posts").document(post_id)
+    blob = get_storage_client().bucket(event["bucket"]).blob(event["name"])
+
+    async def download_and_evaluate():
+        # Oversized / non-image uploads are rejected from the event metadata
+        # alone; the rejection only lands once the post is known to be scorable
+        _check_upload_metadata(event.get("size"), event.get("contentType"))
+        image_bytes = await _run_timed("download", _download_image, blob)
+        if not SPECULATIVE_SCORING:
+            return image_bytes, None
+        return image_bytes, await _run_timed("evaluate", _evaluate_image, image_bytes)
+
+    # Get post document while the image downloads
+    fetch_task = asyncio.create_task(_run_timed("doc_fetch", post_ref.get))
+    media_task = asyncio.create_task(download_and_evaluate())
+    post_doc = await fetch_task
     if not post_doc.exists:
-        print(f"Post {post_id} not found in Firestore.")
-        return
+        _discard_task(media_task)
+        _log("Post not found in Firestore.", severity="WARNING")
+        return "post_missing"
 
     post_data = post_doc.to_dict()
     if post_data.get("type") != "sdg":
-        print(f"Post {post_id} is not an SDG post. Skipping scoring.")
+        _discard_task(media_task)
+        _log("Not an SDG post, skipping scoring.")
+        return "not_sdg"
+    if post_data.get("status") not in SCORABLE_STATUSES:
+        # A redelivery after a failed award, or a new object generation for a
+        # post that already has a verdict
+        _discard_task(media_task)
+        if post_data.get("awardPending"):
+            _log("Resuming award for an already scored post.", pending=post_data["awardPending"])
+            await _run_timed("feed_update", _apply_feed_change, post_id, post_data)
+            await _run_timed("award", _award_points, post_id, post_data)
+            return post_data["status"]
+        _log("Post already has a verdict, skipping scoring.", status=post_data.get("status"))
+        return "already_scored"
+
+    # Safety check + SDG scoring
+    try:
+        image_bytes, verdicts = await media_task
+        if verdicts is None:
+            verdicts = await _run_timed("evaluate", _evaluate_image, image_bytes)
+    except UploadRejected as e:
+        await _run_timed("post_update", _reject_upload, post_ref, post_id, e)
+        return "rejected"
+    except resilience.CallFailed as e:
+        await _run_timed("post_update", _defer_scoring, post_ref, post_id, post_data, e)
+        return "pending_retry"
+    safety_result, score_result = verdicts
+    update_data, points = _build_post_update(safety_result, score_result)
+    update_data.update(_award_fields(post_data, points))
+    await _run_timed("post_update", post_ref.update, update_data)
+    await _run_timed("feed_update", _apply_feed_change, post_id, {**post_data, **update_data})
+    if not safety_result.get("is_safe", True):
+        _log("Post rejected: not safe.")
+        return "rejected"
+
+    # Update user score and leaderboards
+    await _run_timed("award", _award_points, post_id, {**post_data, **update_data})
+
+    _log("Post scored.", status=update_data["status"], sdgScore=update_data["sdgScore"], sdgGoals=update_data["sdgGoals"])
+    return update_data["status"]
+
+
+def _apply_feed_change(post_id: str, post: dict):
+    """
+    Feed update on the scoring paths. A failure is logged rather than raised
+    so it never blocks the award; `python main.py rebuild-feeds` repairs it.
+    """
+    try:
+        feeds.apply_post_change(get_db(), post_id, post)
+    except Exception as e:
+        _log("Feed update failed.", severity="ERROR", postId=post_id, error=str(e))
+
+
+def _discard_task(task: asyncio.Task):
+    """Cancels a task whose result is no longer needed without leaking its exception."""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+async def _run_timed(stage: str, fn, *args):
+    """Runs a blocking call on a worker thread, timed as `stage` of the current trace."""
+    with _stage(stage):
+        return await asyncio.to_thread(fn, *args)
+
+
+def score_pending_posts(event=None, context=None, limit: int = None, workers: int = None) -> dict:
+    """
+    Scheduled entry point (Pub/Sub trigger from Cloud Scheduler): drains all
+    pending SDG posts in one invocation instead of one invocation per upload,
+    plus any "pending_retry" posts whose retry is due.
+    Scores concurrently on a bounded worker pool and writes the post results
+    back in batched commits. Posts it has to skip are parked as pending_retry
+    (see _park_post). Also runnable locally, see `python main.py drain -h`.
+    """
+    limit = limit or BATCH_LIMIT
+    workers = workers or BATCH_WORKERS
+    db = get_db()
+    query = (
+        db.collection("posts")
+        .where(filter=firestore.FieldFilter("status", "==", "pending"))
+        .where(filter=firestore.FieldFilter("type", "==", "sdg"))
+        .limit(limit)
+    )
+    pending = [(doc.id, doc.to_dict()) for doc in query.stream()]
+    if len(pending) < limit:
+        pending += _due_retries(db, limit - len(pending))
+    unawarded = _pending_awards(db, limit)
+    stats = {
+        "pending": len(pending), "scored": 0, "rejected": 0, "pending_retry": 0,
+        "missing_image": 0, "duplicate": 0, "failed": 0, "post_missing": 0,
+        "award_resumed": len(unawarded), "award_failed": 0,
+    }
+    if not pending and not unawarded:
+        _log("No pending SDG posts.")
+        return stats
+    batch_id = uuid.uuid4().hex
+
+    bucket = get_storage_client().bucket(POSTS_BUCKET)
+
+    def score_one(item):
+        # (post_id, post_data, update_data, points, event_key), with a skip
+        # reason in place of update_data when the post was not scored.
+        post_id, post_data = item
+        trace = _start_trace(postId=post_id, batchId=batch_id)
+        result = _score_pending_post(bucket, post_id, post_data)
+        outcome = result[2] if isinstance(result[2], str) else result[2]["status"]
+        if isinstance(result[2], str):
+            # Parked with a backoff, so skipped posts do not come back on every
+            # run and fill the pending query's limit
+            try:
+                _park_post(db, post_id, outcome)
+            except Exception as e:
+                _log("Parking skipped post failed.", severity="ERROR", error=str(e))
+        _log("Batch scoring finished.", outcome=outcome, timings_ms=_timings_ms(trace["timings"]))
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(score_one, pending))
+
+    scored = []
+    for post_id, post_data, update_data, points, event_key in results:
+        if isinstance(update_data, str):
+            stats[update_data] += 1
+            continue
+        update_data = {**update_data, **_award_fields(post_data, points)}
+        scored.append((post_id, {**post_data, **update_data}, update_data, event_key))
+    deleted = _commit_post_updates(db, [(post_id, update_data) for post_id, _, update_data, _ in scored])
+
+    changed = []
+    for post_id, post, update_data, event_key in scored:
+        if post_id in deleted:
+            # Deleted while it was being scored; nothing left to award
+            stats["post_missing"] += 1
+            _release_event(event_key)
+            continue
+        stats[update_data["status"]] += 1
+        changed.append((post_id, post, event_key))
+
+    # Posts scored earlier whose award did not complete are finished here too
+    changed += [(post_id, post, None) for post_id, post in unawarded]
+
+    # Feeds and user scores are updated only after the post results are
+    # committed. A failure leaves the post's awardPending in place for the
+    # next drain and does not stop the rest of the batch.
+    def finish(change) -> bool:
+        post_id, post, event_key = change
+        _apply_feed_change(post_id, post)
+        ok = True
+        try:
+            _award_points(post_id, post)
+        except Exception as e:
+            _log("Award failed, will resume on the next drain.", severity="ERROR", postId=post_id, error=str(e))
+            ok = False
+        if event_key is not None:
+            try:
+                _finish_event(event_key, post["status"])
+            except Exception as e:
+                _log("Event ledger update error.", severity="ERROR", postId=post_id, error=str(e))
+        return ok
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        stats["award_failed"] = sum(not ok for ok in pool.map(finish, changed))
+
+    _trace.set(None)
+    _log("Batch scoring done.", batchId=batch_id, stats=stats, rateLimits=gemini_rate_limit_metrics())
+    return stats
+
+
+def _score_pending_post(bucket, post_id: str, post_data: dict) -> tuple:
+    """Scores one post for the batch drain; see score_pending_posts for the result shape."""
+    event_key = None
+    try:
+        with _stage("claim"):
+            blobs = list(bucket.list_blobs(prefix=f"posts/{post_id}.", max_results=1))
+            if not blobs:
+                return post_id, post_data, "missing_image", 0, None
+            blob = blobs[0]
+            # Same ledger entry as the storage trigger for this object generation
+            event_key = _event_key(bucket.name, blob.name, blob.generation)
+            event = {"bucket": bucket.name, "name": blob.name, "generation": blob.generation}
+            if not _claim_event(event_key, event, post_id):
+                return post_id, post_data, "duplicate", 0, None
+        try:
+            _check_upload_metadata(blob.size, blob.content_type)
+            with _stage("download"):
+                image_bytes = _download_image(blob)
+        except UploadRejected as e:
+            _log("Post rejected.", reason=e.message)
+            return post_id, post_data, _rejection_update(e), 0, event_key
+        try:
+            with _stage("evaluate"):
+                update_data, points = _build_post_update(*_evaluate_image(image_bytes))
+        except resilience.CallFailed as e:
+            _log("Post requeued.", severity="WARNING", error=str(e))
+            return post_id, post_data, _retry_update(post_data, e.kind), 0, event_key
+        return post_id, post_data, update_data, points, event_key
+    except Exception as e:
+        _log("Batch scoring error.", severity="ERROR", error=str(e))
+        if event_key is not None:
+            _release_event(event_key)
+        return post_id, post_data, "failed", 0, None
+
+
+def _commit_post_updates(db, updates: list) -> set:
+    """
+    Commits (post_id, update_data) pairs in batches of batching.MAX_BATCH_WRITES.
+    A batch that fails because a post was deleted mid-run is retried one write
+    at a time. Returns the ids of the posts that no longer exist.
+    """
+    deleted = set()
+    for chunk in batching.chunks(updates, batching.MAX_BATCH_WRITES):
+        batch = db.batch()
+        for post_id, update_data in chunk:
+            batch.update(db.collection("posts").document(post_id), update_data)
+        try:
+            batch.commit()
+        except NotFound:
+            for post_id, update_data in chunk:
+                try:
+                    db.collection("posts").document(post_id).update(update_data)
+                except NotFound:
+                    deleted.add(post_id)
+    return deleted
+
+
+def _park_post(db, post_id: str, reason: str):
+    """
+    Moves a post the drain could not score ("missing_image", "duplicate",
+    "failed") to pending_retry with a backoff, unless its status changed in
+    the meantime. The storage trigger still scores pending_retry posts, so a
+    late upload is picked up as soon as it lands.
+    """
+    post_ref = db.collection("posts").document(post_id)
+
+    @firestore.transactional
+    def park(transaction):
+        snapshot = post_ref.get(transaction=transaction)
+        if not snapshot.exists or snapshot.get("status") not in SCORABLE_STATUSES:
+            return None
+        post_data = snapshot.to_dict()
+        update_data = _retry_update(post_data, reason)
+        transaction.update(post_ref, update_data)
+        return {**post_data, **update_data}
+
+    post = park(db.transaction())
+    if post is not None:
+        feeds.apply_post_change(db, post_id, post)
+
+
+class UploadRejected(Exception):
+    """An upload that fails validation before any model call."""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def _check_upload_metadata(size, content_type):
+    """Validates object metadata (from the storage event or blob) before downloading."""
+    if size is not None and int(size) > MAX_UPLOAD_BYTES:
+        raise UploadRejected("too_large", f"Image is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+    if content_type and not content_type.startswith("image/") and content_type != "application/octet-stream":
+        raise UploadRejected("not_an_image", f"Unsupported upload type {content_type}.")
+
+
+class _CappedImageBuffer(io.BytesIO):
+    """
+    Download sink that checks the magic bytes as soon as the header arrives and
+    aborts the transfer once MAX_UPLOAD_BYTES is exceeded.
+    """
+
+    def write(self, chunk) -> int:
+        before = self.tell()
+        written = super().write(chunk)
+        size = before + written
+        if before < IMAGE_HEADER_BYTES <= size and _sniff_image_type(self.getvalue()) is None:
+            raise UploadRejected("not_an_image", "Upload is not a supported image.")
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadRejected("too_large", f"Image is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+        return written
+
+
+def _download_image(blob) -> bytes:
+    """Streams the blob into memory, rejecting non-images and oversized objects early."""
+    sink = _CappedImageBuffer()
+    blob.download_to_file(sink)
+    data = sink.getvalue()
+    if len(data) < IMAGE_HEADER_BYTES and _sniff_image_type(data) is None:
+        raise UploadRejected("not_an_image", "Upload is not a supported image.")
+    return data
+
+
+def _rejection_update(error: UploadRejected) -> dict:
+    return {"status": "rejected", "aiReason": error.message, "rejectReason": error.code}
+
+
+def _reject_upload(post_ref, post_id: str, error: UploadRejected):
+    try:
+        post_ref.update(_rejection_update(error))
+    except NotFound:
         return
+    post_doc = post_ref.get()
+    if post_doc.exists:
+        feeds.apply_post_change(get_db(), post_id, post_doc.to_dict())
+    _log("Post rejected.", postId=post_id, reason=error.message)
 
-    # Download image bytes from Cloud Storage
-    from google.cloud import storage as gcs
-    gcs_client = gcs.Client()
-    blob = gcs_client.bucket(bucket).blob(file_path)
-    image_bytes = blob.download_as_bytes()
 
-    # Safety check
-    safety_result = _call_gemini_with_image(image_bytes, SAFETY_PROMPT)
-    if not safety_result.get("is_safe", True):
-        post_ref.update({"status": "rejected", "aiReason": "Image failed safety check."})
-        print(f"Post {post_id} rejected: not safe.")
+def _event_key(bucket: str, name: str, generation) -> str:
+    return hashlib.sha256(f"{bucket}/{name}#{generation or ''}".encode()).hexdigest()
+
+
+def _claim_active(entry: dict, now: datetime) -> bool:
+    """True when the ledger entry is finished or still leased to another invocation."""
+    if entry.get("status") != "processing":
+        return True
+    lease_expires_at = entry.get("leaseExpiresAt")
+    return lease_expires_at is not None and lease_expires_at > now
+
+
+def _claim_event(event_key: str, event: dict, post_id: str) -> bool:
+    """
+    Claims an object generation in the event ledger. Returns False when it was
+    already handled or is being handled; duplicates only cost the first read.
+    """
+    db = get_db()
+    ref = db.collection(EVENT_LEDGER_COLLECTION).document(event_key)
+    now = datetime.now(timezone.utc)
+    snapshot = ref.get()
+    if snapshot.exists and _claim_active(snapshot.to_dict(), now):
+        return False
+
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if snapshot.exists and _claim_active(snapshot.to_dict(), now):
+            return False
+        transaction.set(ref, {
+            "bucket": event.get("bucket"),
+            "name": event.get("name"),
+            "generation": str(event.get("generation") or ""),
+            "postId": post_id,
+            "status": "processing",
+            "claimedAt": firestore.SERVER_TIMESTAMP,
+            "leaseExpiresAt": now + timedelta(seconds=EVENT_CLAIM_LEASE_SECONDS),
+            "expiresAt": now + timedelta(days=EVENT_LEDGER_TTL_DAYS),
+        })
+        return True
+
+    return claim(db.transaction())
+
+
+def _finish_event(event_key: str, outcome: str):
+    """
+    Marks a claimed event done. A "pending_retry" or "post_missing" outcome
+    releases the claim instead, so the batch drain (or a redelivery) can score
+    the post later; an upload can land before its post document is written.
+    """
+    if outcome in ("pending_retry", "post_missing"):
+        _release_event(event_key)
         return
+    get_db().collection(EVENT_LEDGER_COLLECTION).document(event_key).update({
+        "status": "done",
+        "outcome": outcome,
+        "finishedAt": firestore.SERVER_TIMESTAMP,
+    })
+
+
+def _release_event(event_key: str):
+    try:
+        get_db().collection(EVENT_LEDGER_COLLECTION).document(event_key).delete()
+    except Exception as e:
+        _log("Event ledger release error.", severity="ERROR", error=str(e))
+
+
+def _retry_update(post_data: dict, reason: str) -> dict:
+    attempts = int(post_data.get("scoringAttempts", 0)) + 1
+    delay = min(SCORING_RETRY_CAP_SECONDS, SCORING_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return {
+        "status": "pending_retry",
+        "scoringAttempts": attempts,
+        "scoringError": reason,
+        "nextRetryAt": datetime.now(timezone.utc) + timedelta(seconds=delay),
+    }
+
+
+def _defer_scoring(post_ref, post_id: str, post_data: dict, error: resilience.CallFailed):
+    """Parks a post Gemini could not score so the batch drain retries it later."""
+    update_data = _retry_update(post_data, error.kind)
+    try:
+        post_ref.update(update_data)
+    except NotFound:
+        return
+    feeds.apply_post_change(get_db(), post_id, {**post_data, **update_data})
+    _log("Post requeued.", severity="WARNING", postId=post_id, attempt=update_data["scoringAttempts"], error=str(error))
+
+
+def _due_retries(db, limit: int) -> list:
+    """
+    "pending_retry" posts whose nextRetryAt has passed. Filtered here rather
+    than in the query so no composite index is needed; the set is small
+    outside of Gemini outages.
+    """
+    now = datetime.now(timezone.utc)
+    query = db.collection("posts").where(filter=firestore.FieldFilter("status", "==", "pending_retry"))
+    due = []
+    for doc in query.stream():
+        post = doc.to_dict()
+        next_retry = post.get("nextRetryAt")
+        if post.get("type") == "sdg" and (next_retry is None or next_retry <= now):
+            due.append((doc.id, post))
+            if len(due) == limit:
+                break
+    return due
+
+
+def _pending_awards(db, limit: int) -> list:
+    """Scored posts whose award steps did not all complete (see AWARD_STEPS)."""
+    query = (
+        db.collection("posts")
+        .where(filter=firestore.FieldFilter("awardPending", "array_contains_any", AWARD_STEPS))
+        .limit(limit)
+    )
+    return [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+
+def sync_post_feeds(event, context):
+    """
+    Firestore trigger (providers/cloud.firestore/eventTypes/document.write on
+    posts/{postId}): adds newly created posts to the materialized feeds and
+    removes deleted ones. Status changes are applied by the scoring paths.
+    """
+    post_id = context.resource.split("/")[-1]
+    old_value = event.get("oldValue") or {}
+    new_value = event.get("value") or {}
+    if old_value and not new_value:
+        user_id = old_value.get("fields", {}).get("userId", {}).get("stringValue")
+        feeds.apply_post_change(get_db(), post_id, None, user_id=user_id)
+    elif new_value and not old_value:
+        post_doc = get_db().collection("posts").document(post_id).get()
+        if post_doc.exists:
+            feeds.apply_post_change(get_db(), post_id, post_doc.to_dict())
+
+
+def rebuild_feeds(event=None, context=None) -> dict:
+    """Recomputes every materialized feed from scratch (backfills, repairs)."""
+    stats = feeds.rebuild(get_db())
+    _log("Feeds rebuilt.", stats=stats)
+    return stats
+
+
+def rebuild_leaderboards(event=None, context=None) -> dict:
+    """Recomputes every leaderboard and user stats doc from scored posts."""
+    stats = leaderboard.rebuild(get_db())
+    _log("Leaderboards rebuilt.", stats=stats)
+    return stats
+
+
+def sweep_expired_stories(event=None, context=None, mode: str = None, dry_run: bool = False) -> list:
+    """
+    Scheduled entry point (Pub/Sub trigger from Cloud Scheduler): removes
+    expired stories from Firestore and, when FIREBASE_DATABASE_URL is set,
+    from the Realtime Database, plus their Storage objects. See stories.py.
+    """
+    mode = mode or STORY_SWEEP_MODE
+    now = datetime.now(timezone.utc)
+    if not DATABASE_URL:
+        results = [stories.sweep_firestore(get_db(), get_storage_client(), STORIES_BUCKET, mode=mode, dry_run=dry_run, now=now)]
+    else:
+        from firebase_admin import db as rtdb
+
+        # Both backends can point at the same media object, so each sweep
+        # keeps what the other backend's live stories still use
+        root = rtdb.reference("/")
+        rtdb_live = stories.live_media_rtdb(root, STORIES_BUCKET, now) if mode == "delete" else set()
+        firestore_live = stories.live_media_firestore(get_db(), STORIES_BUCKET, now) if mode == "delete" else set()
+        results = [
+            stories.sweep_firestore(get_db(), get_storage_client(), STORIES_BUCKET, mode=mode, dry_run=dry_run, now=now, live_paths=rtdb_live),
+            stories.sweep_rtdb(root, get_storage_client(), STORIES_BUCKET, mode=mode, dry_run=dry_run, now=now, live_paths=firestore_live),
+        ]
+    for stats in results:
+        _log("Expired stories swept.", stats=stats)
+    return results
+
+
+def normalise_inline_media(event=None, context=None, max_pages=MEDIA_NORMALISE_PAGES, dry_run: bool = False, restart: bool = False) -> list:
+    """
+    Scheduled entry point (Pub/Sub trigger from Cloud Scheduler): moves inline
+    base64 images in stories and posts to Storage and replaces them with
+    download and thumbnail URLs. max_pages=None runs the full migration.
+    """
+    bucket = get_storage_client().bucket(MEDIA_BUCKET)
+    results = []
+    for collection in MEDIA_COLLECTIONS:
+        # Feed items carry the post's media fields, so migrated posts are re-applied to the feeds
+        on_update = _apply_feed_change if collection == "posts" else None
+        results.append(media.migrate_firestore(get_db(), bucket, collection, max_pages, dry_run, restart, on_update))
+        if DATABASE_URL:
+            from firebase_admin import db as rtdb
+
+            results.append(media.migrate_rtdb(get_db(), rtdb.reference("/"), bucket, collection, max_pages, dry_run, restart))
+    for stats in results:
+        _log("Inline media normalised.", severity="WARNING" if stats["errors"] else "INFO", stats=stats)
+    return results
+
+
+def roll_up_counters(event=None, context=None) -> int:
+    """
+    Scheduled entry point (Pub/Sub trigger from Cloud Scheduler): folds pending
+    counter shard deltas into users.sdgScore, donation_projects.raisedAmount etc.
+    """
+    rolled = counters.roll_up(get_db())
+    _log("Counter shards rolled up.", shards=rolled)
+    return rolled
+
+
+def _build_post_update(safety_result: dict, score_result: dict) -> tuple[dict, int]:
+    """Maps the Gemini verdicts to the post document update and the points to award."""
+    if not safety_result.get("is_safe", True):
+        return {"status": "rejected", "aiReason": "Image failed safety check."}, 0
 
-    # SDG scoring
-    score_result = _call_gemini_with_image(image_bytes, SDG_SCORING_PROMPT)
     is_sdg = score_result.get("is_sdg_related", False)
     score = int(score_result.get("score", 0))
     sdg_goals = score_result.get("sdg_goals", [])
     reason = score_result.get("reason", "")
     is_accepted = is_sdg and score > 20
 
-    # Update post document
     update_data = {
         "sdgScore": score,
         "sdgGoals": sdg_goals,
         "aiReason": reason,
         "status": "scored" if is_accepted else "rejected",
     }
-    post_ref.update(update_data)
+    return update_data, score if is_accepted and score > 0 else 0
+
+
+def _evaluate_image(image_bytes: bytes) -> tuple[dict, dict]:
+    """
+    Returns (safety_result, score_result). score_result is {} when the image
+    is unsafe and the scoring call was skipped. Raises resilience.CallFailed
+    when no model in GEMINI_MODEL_CHAIN could answer; an image the model's own
+    safety filters block counts as unsafe.
+    """
+    try:
+        return _evaluate_prepared(_GeminiImage(image_bytes))
+    except resilience.CallFailed as e:
+        if e.kind != resilience.BLOCKED:
+            raise
+        return {"is_safe": False, "reason": "Blocked by the model's safety filters."}, {}
+
 
-    # Update user score
-    if is_accepted and score > 0:
-        user_id = post_data.get("userId")
-        if user_id:
-            _update_user_score(user_id, score)
+def _evaluate_prepared(image: "_GeminiImage") -> tuple[dict, dict]:
+    if SCORING_MODE == "combined":
+        try:
+            combined = _cached_gemini_call(image, COMBINED_PROMPT, validate=_is_valid_combined)
+        except resilience.CallFailed as e:
+            if e.kind != resilience.MALFORMED:
+                raise
+            combined = None
+        if _is_valid_combined(combined):
+            return combined["safety"], combined["sdg"]
+        _log("Combined Gemini response malformed, falling back to separate calls.", severity="WARNING")
 
-    print(f"Post {post_id} scored: {score} pts, SDGs: {sdg_goals}")
+    safety_result = _cached_gemini_call(image, SAFETY_PROMPT)
+    if not safety_result.get("is_safe", True):
+        return safety_result, {}
+    return safety_result, _cached_gemini_call(image, SDG_SCORING_PROMPT)
+
+
+def _is_valid_safety(result) -> bool:
+    return isinstance(result, dict) and isinstance(result.get("is_safe"), bool)
+
+
+def _is_valid_sdg(result) -> bool:
+    if not isinstance(result, dict):
+        return False
+    goals = result.get("sdg_goals")
+    score = result.get("score")
+    return (
+        isinstance(result.get("is_sdg_related"), bool)
+        and isinstance(goals, list)
+        and all(isinstance(g, int) and 1 <= g <= 17 for g in goals)
+        and isinstance(score, (int, float))
+        and 0 <= score <= 100
+    )
 
 
-def _call_gemini_with_image(image_bytes: bytes, prompt: str) -> dict:
+def _is_valid_combined(result) -> bool:
+    return (
+        isinstance(result, dict)
+        and _is_valid_safety(result.get("safety"))
+        and _is_valid_sdg(result.get("sdg"))
+    )
+
+
+class _GeminiImage:
+    """
+    An uploaded image as seen by the Gemini calls: the digest of the original
+    bytes (the cache key) plus a downscaled, re-encoded copy that is prepared
+    once on the first cache miss and reused for every prompt.
+    """
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self.digest = hashlib.sha256(raw).hexdigest()
+        self._prepared = None
+
+    @property
+    def prepared(self) -> tuple[bytes, str]:
+        if self._prepared is None:
+            self._prepared = _prepare_image(self.raw)
+        return self._prepared
+
+
+def _sniff_image_type(data: bytes):
+    """Detects the real image format from magic bytes; None if unrecognised."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "image/heic"
+    return None
+
+
+def _prepare_image(image_bytes: bytes) -> tuple[bytes, str]:
+    """
+    Downscales the image to IMAGE_MAX_EDGE and re-encodes it as
+    IMAGE_OUTPUT_FORMAT. Returns (data, mime_type). Falls back to the original
+    bytes when Pillow is unavailable, cannot decode the format (e.g. HEIC),
+    or the re-encoded copy would not be smaller.
+    """
+    mime_type = _sniff_image_type(image_bytes) or "image/jpeg"
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return image_bytes, mime_type
+
     try:
-        image_part = {"mime_type": "image/jpeg", "data": image_bytes}
-        response = model.generate_content([image_part, prompt])
-        return json.loads(response.text)
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img = ImageOps.exif_transpose(img)
+            resized = max(img.size) > IMAGE_MAX_EDGE
+            img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            out = io.BytesIO()
+            img.save(out, format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_QUALITY)
     except Exception as e:
-        print(f"Gemini error: {e}")
-        return {}
+        _log("Image preprocessing skipped.", severity="WARNING", error=str(e))
+        return image_bytes, mime_type
+
+    data = out.getvalue()
+    if not resized and len(data) >= len(image_bytes) and mime_type in GEMINI_IMAGE_TYPES:
+        return image_bytes, mime_type
+    _log("Image prepared.", bytesIn=len(image_bytes), bytesOut=len(data))
+    return data, f"image/{IMAGE_OUTPUT_FORMAT.lower()}"
+
+
+def _gemini_cache_key(image_digest: str, prompt: str) -> str:
+    prompt_digest = hashlib.sha256(f"{GEMINI_MODEL_NAME}\n{prompt}".encode("utf-8")).hexdigest()
+    return f"{image_digest}_{prompt_digest[:16]}"
+
+
+def _lru_get(key: str):
+    with _gemini_lru_lock:
+        entry = _gemini_lru.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.time():
+            del _gemini_lru[key]
+            return None
+        _gemini_lru.move_to_end(key)
+        return result
+
+
+def _lru_put(key: str, result: dict, expires_at: float):
+    with _gemini_lru_lock:
+        _gemini_lru[key] = (expires_at, result)
+        _gemini_lru.move_to_end(key)
+        while len(_gemini_lru) > GEMINI_CACHE_LRU_SIZE:
+            _gemini_lru.popitem(last=False)
+
+
+_PROMPT_STAGES = {SAFETY_PROMPT: "safety_call", SDG_SCORING_PROMPT: "scoring_call", COMBINED_PROMPT: "combined_call"}
+
+
+def _cached_gemini_call(image: _GeminiImage, prompt: str, validate=None) -> dict:
+    """
+    Returns the Gemini verdict for (image, prompt), consulting the in-process
+    LRU and then the Firestore cache before calling the model.
+    Results rejected by `validate` are never cached so they get retried next
+    time; failed calls raise resilience.CallFailed.
+    """
+    key = _gemini_cache_key(image.digest, prompt)
+    cached = _lru_get(key)
+    if cached is not None:
+        return cached
+
+    cache_ref = get_db().collection(GEMINI_CACHE_COLLECTION).document(key)
+    try:
+        with _stage("cache_lookup"):
+            cache_doc = cache_ref.get()
+        if cache_doc.exists:
+            data = cache_doc.to_dict()
+            expires_at = data.get("expiresAt")
+            if expires_at and expires_at > datetime.now(timezone.utc):
+                result = data.get("result", {})
+                _lru_put(key, result, expires_at.timestamp())
+                return result
+    except Exception as e:
+        _log("Gemini cache read error.", severity="ERROR", error=str(e))
+
+    with _stage("image_prepare"):
+        prepared = image.prepared
+    with _stage(_PROMPT_STAGES.get(prompt, "gemini_call")):
+        result, model_name = _call_gemini_with_image(*prepared, prompt)
+    if not result or (validate is not None and not validate(result)):
+        return result
+
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=GEMINI_CACHE_TTL_SECONDS)
+    _lru_put(key, result, expires_at.timestamp())
+    try:
+        cache_ref.set({
+            "result": result,
+            "model": model_name,
+            "createdAt": firestore.SERVER_TIMESTAMP,
+            "expiresAt": expires_at,
+        })
+    except Exception as e:
+        _log("Gemini cache write error.", severity="ERROR", error=str(e))
+    return result
+
+
+_gemini_breakers: dict = {}
+_gemini_breakers_lock = threading.Lock()
+
+
+def _gemini_breaker(model_name: str) -> resilience.CircuitBreaker:
+    with _gemini_breakers_lock:
+        breaker = _gemini_breakers.get(model_name)
+        if breaker is None:
+            breaker = resilience.CircuitBreaker(model_name, GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_RESET_SECONDS)
+            _gemini_breakers[model_name] = breaker
+    return breaker
+
 
+_gemini_limiters: dict = {}
 
-def _update_user_score(user_id: str, points: int):
+
+def _gemini_limiter(model_name: str) -> ratelimit.RateLimiter:
+    with _gemini_breakers_lock:
+        limiter = _gemini_limiters.get(model_name)
+        if limiter is None:
+            db = get_db() if GEMINI_RATE_LIMIT_BACKEND == "firestore" else None
+            limits = {"requests": GEMINI_RPM, "tokens": GEMINI_TPM}
+            limiter = ratelimit.RateLimiter(model_name, limits, db=db, max_wait=GEMINI_RATE_LIMIT_MAX_WAIT, log=_log)
+            _gemini_limiters[model_name] = limiter
+    return limiter
+
+
+def gemini_rate_limit_metrics() -> dict:
+    """Queue depth and wait totals of every Gemini rate limiter in this process."""
+    return {name: limiter.metrics() for name, limiter in list(_gemini_limiters.items())}
+
+
+def _estimate_gemini_tokens(prompt: str) -> int:
+    return GEMINI_IMAGE_TOKENS + len(prompt) // 4 + GEMINI_OUTPUT_TOKENS
+
+
+def _call_gemini_with_image(image_bytes: bytes, mime_type: str, prompt: str) -> tuple[dict, str]:
+    """
+    Returns (parsed JSON verdict, model that produced it). Transient errors are
+    retried with backoff on each model of GEMINI_MODEL_CHAIN in turn, each
+    attempt waiting for that model's rate limit budget first; raises
+    the last resilience.CallFailed when every model fails. Blocked content and
+    malformed answers are not retried on other models; the caller decides
+    what to do with them (e.g. the combined prompt falls back to two calls).
+    """
+    image_part = {"mime_type": mime_type, "data": image_bytes}
+    tokens = _estimate_gemini_tokens(prompt)
+    error = None
+    for model_name in GEMINI_MODEL_CHAIN:
+        def generate():
+            response = get_model(model_name).generate_content([image_part, prompt])
+            _raise_if_blocked(response)
+            return json.loads(response.text)
+
+        limiter = _gemini_limiter(model_name)
+        try:
+            result = resilience.call_with_retry(
+                generate, _gemini_breaker(model_name), GEMINI_MAX_ATTEMPTS,
+                acquire=lambda: limiter.acquire(requests=1, tokens=tokens),
+            )
+            return result, model_name
+        except resilience.CallFailed as e:
+            _log("Gemini call failed.", severity="WARNING", model=model_name, kind=e.kind, error=e.message)
+            error = e
+            if e.kind in (resilience.BLOCKED, resilience.MALFORMED):
+                break
+    raise error
+
+
+def _raise_if_blocked(response):
+    """
+    Blocked prompts and answers come back without text, and response.text
+    would raise a bare ValueError; report them as BLOCKED instead.
+    """
+    block_reason = response.prompt_feedback.block_reason
+    if block_reason:
+        raise resilience.CallFailed(resilience.BLOCKED, f"prompt blocked ({block_reason.name})")
+    for candidate in response.candidates:
+        if candidate.finish_reason.name in ("SAFETY", "RECITATION"):
+            raise resilience.CallFailed(resilience.BLOCKED, f"answer blocked ({candidate.finish_reason.name})")
+
+
+# Award steps still owed for a scored post, listed in its awardPending field
+# until each one commits. A retry (redelivery or the batch drain) resumes from
+# whatever is left, and each step removes itself in its own transaction, so
+# points are applied exactly once even if the first attempt died half way.
+AWARD_STEPS = ["user", "leaderboard"]
+
+
+def _award_fields(post_data: dict, points: int) -> dict:
+    """Extra post fields that schedule the award for a verdict worth `points`."""
+    return {"awardPending": list(AWARD_STEPS)} if points > 0 and post_data.get("userId") else {}
+
+
+def _award_points(post_id: str, post: dict):
+    """Applies every award step still pending on the post."""
+    pending = post.get("awardPending") or []
+    points = int(post.get("sdgScore", 0))
+    if not pending or points <= 0 or not post.get("userId"):
+        return
+    post_ref = get_db().collection("posts").document(post_id)
+    if "user" in pending:
+        with _stage("user_update"):
+            _update_user_score(post["userId"], points, post_ref)
+    if "leaderboard" in pending:
+        with _stage("leaderboard_update"):
+            _record_leaderboard_score(post, points, post_ref)
+
+
+def _record_leaderboard_score(post: dict, points: int, post_ref=None):
+    profile = {"displayName": post.get("userDisplayName", ""), "photoURL": post.get("userPhotoURL", "")}
+    claim = (post_ref, "leaderboard") if post_ref is not None else None
+    # Weekly totals go to the week the post was created in, as leaderboard.rebuild counts them
+    created_at = post.get("createdAt")
+    when = created_at if isinstance(created_at, datetime) else None
+    leaderboard.record_score(get_db(), post["userId"], points, post.get("sdgGoals", []), profile, when=when, claim=claim)
+
+
+def _update_user_score(user_id: str, points: int, post_ref=None):
+    """
+    Applies the points and the posting streak in a single transaction, so the
+    streak is computed from the previous lastPostDate and concurrent posts by
+    the same user cannot lose increments. Points go to a sharded sdgScore
+    counter; the user document itself is only written when the posting day
+    changes, so a power user's posts do not all land on one document. With a
+    post_ref, the post's "user" award step is checked and cleared in the same
+    transaction.
+    """
+    db = get_db()
     user_ref = db.collection("users").document(user_id)
-    user_ref.update({
-        "sdgScore": firestore.Increment(points),
+    _apply_user_score(db.transaction(), user_ref, points, post_ref)
+
+
+@firestore.transactional
+def _apply_user_score(transaction, user_ref, points: int, post_ref=None):
+    if post_ref is not None:
+        post_doc = post_ref.get(transaction=transaction)
+        if not post_doc.exists or "user" not in (post_doc.to_dict() or {}).get("awardPending", []):
+            return
+    user_doc = user_ref.get(transaction=transaction)
+    if post_ref is not None:
+        transaction.update(post_ref, {"awardPending": firestore.ArrayRemove(["user"])})
+    if not user_doc.exists:
+        _log("User not found, score not applied.", severity="WARNING", userId=user_ref.id)
+        return
+    data = user_doc.to_dict()
+    now = datetime.now(timezone.utc)
+    last_post = data.get("lastPostDate")
+    counters.increment(user_ref, "sdgScore", points, num_shards=USER_SCORE_SHARDS, writer=transaction)
+    if last_post and last_post.astimezone(timezone.utc).date() == now.date():
+        return  # Same day: streak and lastPostDate are unchanged
+    transaction.update(user_ref, {
         "lastPostDate": firestore.SERVER_TIMESTAMP,
+        "streak": _next_streak(last_post, data.get("streak", 0), now),
     })
-    # Update streak
-    user_doc = user_ref.get()
-    if user_doc.exists:
-        data = user_doc.to_dict()
-        from datetime import datetime, timezone, timedelta
-        now = datetime.now(timezone.utc)
-        last_post = data.get("lastPostDate")
-        streak = data.get("streak", 0)
-        if last_post:
-            delta = (now - last_post).days
-            if delta == 0:
-                pass  # Same day
-            elif delta == 1:
-                streak += 1
-            else:
-                streak = 1
-        else:
-            streak = 1
-        user_ref.update({"streak": streak})
+
+
+def _next_streak(last_post, streak: int, now: datetime) -> int:
+    if not last_post:
+        return 1
+    delta = (now.date() - last_post.astimezone(timezone.utc).date()).days
+    if delta == 0:
+        return max(streak, 1)  # Same day
+    if delta == 1:
+        return streak + 1
+    return 1
+
+
+if __name__ == "__main__":
+    # Local runs: export FIRESTORE_EMULATOR_HOST=localhost:8080 and
+    # STORAGE_EMULATOR_HOST=http://localhost:9199 to target the emulators.
+    import argparse
+
+    parser = argparse.ArgumentParser(description="SDG scoring maintenance commands.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    drain = commands.add_parser("drain", help="Score all pending SDG posts.")
+    drain.add_argument("--limit", type=int, default=BATCH_LIMIT)
+    drain.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    commands.add_parser("rollup", help="Fold counter shards into their owning fields.")
+    commands.add_parser("rebuild-feeds", help="Recompute the materialized feeds from posts.")
+    commands.add_parser("rebuild-leaderboards", help="Recompute the leaderboards from scored posts.")
+    sweep = commands.add_parser("sweep-stories", help="Delete or archive expired stories and their media.")
+    sweep.add_argument("--mode", choices=["delete", "archive"], default=STORY_SWEEP_MODE)
+    sweep.add_argument("--dry-run", action="store_true", help="Report what would be removed without writing.")
+    migrate = commands.add_parser("migrate-media", help="Move inline base64 images in stories/posts to Storage.")
+    migrate.add_argument("--max-pages", type=int, default=None, help="Stop after this many pages per source (resumable).")
+    migrate.add_argument("--dry-run", action="store_true", help="Report what would be moved without writing.")
+    migrate.add_argument("--restart", action="store_true", help="Ignore saved checkpoints and start from the beginning.")
+    args = parser.parse_args()
+
+    if args.command == "drain":
+        score_pending_posts(limit=args.limit, workers=args.workers)
+    elif args.command == "rollup":
+        roll_up_counters()
+    elif args.command == "rebuild-feeds":
+        rebuild_feeds()
+    elif args.command == "rebuild-leaderboards":
+        rebuild_leaderboards()
+    elif args.command == "sweep-stories":
+        sweep_expired_stories(mode=args.mode, dry_run=args.dry_run)
+    elif args.command == "migrate-media":
+        normalise_inline_media(max_pages=args.max_pages, dry_run=args.dry_run, restart=args.restart)
@@ -0,0 +1,275 @@
+"""
+Inline media normaliser. The app writes images as `data:image/...;base64,`
+strings straight into stories.imageURL and posts.mediaURL, so every listener
+downloads full image payloads. This moves them to Storage:
+
+    media/{collection}/{sha256}.{ext}          the original bytes
+    media/{collection}/thumbs/{sha256}.jpg     THUMB_EDGE px JPEG (needs Pillow)
+
+and replaces the field with a Firebase download URL, plus `thumbnailURL`.
+Paths are content-addressed, so identical images are stored once per
+collection and re-running the migration rewrites the same URLs. Media is
+kept per collection so the story sweeper (stories.py) does not delete an
+object a post still uses. Within a collection the RTDB and Firestore copies
+of an image share one object, so the sweeper keeps anything a live story in
+either backend still references. `media/` is outside the `posts/` prefix
+that triggers scoring.
+
+Both copies of the data are handled: the RTDB nodes the app reads and the
+Firestore collections. Progress is checkpointed per source in
+_migrations/inline_media_{backend}_{collection}, so an interrupted run (or
+the next scheduled run) resumes after the last page it finished.
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from firebase_admin import firestore
+from google.api_core.exceptions import PreconditionFailed
+
+import batching
+
+MIGRATIONS_COLLECTION = "_migrations"
+MEDIA_PREFIX = "media"
+PAGE_SIZE = 200
+UPLOAD_WORKERS = 8
+MAX_REPORTED_FAILURES = 20  # failed records listed in the run stats
+THUMB_EDGE = 320
+THUMB_QUALITY = 75
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# collection -> {inline field: thumbnail field}; list fields hold plain URLs
+FIELDS = {
+    "stories": {"imageURL": "thumbnailURL"},
+    "posts": {"mediaURL": "thumbnailURL"},
+}
+LIST_FIELDS = {"posts": ["imageURLs"]}
+
+# Download tokens are derived from the content hash so a re-run produces the
+# same URL without reading the object's metadata back.
+_TOKEN_NAMESPACE = uuid.UUID("6f1d5c3e-2b1a-4f7e-9a55-1c0d2e3f4a5b")
+_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp", "image/heic": "heic"}
+
+
+def parse_data_uri(value):
+    """Returns (mime_type, bytes) for a base64 data: URI, else None."""
+    if not isinstance(value, str) or not value.startswith("data:"):
+        return None
+    header, sep, payload = value.partition(",")
+    if not sep or not header.endswith(";base64"):
+        return None
+    mime_type = header[len("data:"):-len(";base64")] or "application/octet-stream"
+    if mime_type == "image/jpg":
+        mime_type = "image/jpeg"
+    try:
+        return mime_type, base64.b64decode(payload, validate=False)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def download_url(bucket_name: str, path: str, token: str) -> str:
+    return f"https://firebasestorage.googleapis.com/v0/b/{bucket_name}/o/{quote(path, safe='')}?alt=media&token={token}"
+
+
+def _thumbnail(data: bytes):
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((THUMB_EDGE, THUMB_EDGE))
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=THUMB_QUALITY)
+            return out.getvalue()
+    except Exception:
+        return None
+
+
+def _upload(bucket, path: str, data: bytes, content_type: str, token: str) -> bool:
+    """Uploads unless the object already exists. Returns True if it was written."""
+    blob = bucket.blob(path)
+    blob.metadata = {"firebaseStorageDownloadTokens": token}
+    blob.cache_control = CACHE_CONTROL
+    try:
+        blob.upload_from_string(data, content_type=content_type, if_generation_match=0)
+        return True
+    except PreconditionFailed:
+        return False
+
+
+def store_inline(bucket, collection: str, value: str, with_thumbnail: bool, stats: dict, dry_run: bool = False):
+    """
+    Stores one data: URI in Storage. Returns (url, thumbnail_url), with
+    thumbnail_url None when not requested or not decodable; None if `value`
+    is not a usable data: URI.
+    """
+    parsed = parse_data_uri(value)
+    if parsed is None:
+        return None
+    mime_type, data = parsed
+    digest = hashlib.sha256(data).hexdigest()
+    token = str(uuid.uuid5(_TOKEN_NAMESPACE, digest))
+    path = f"{MEDIA_PREFIX}/{collection}/{digest}.{_EXTENSIONS.get(mime_type, 'bin')}"
+    if dry_run:
+        written = True
+    else:
+        written = _upload(bucket, path, data, mime_type, token)
+    stats["uploaded" if written else "deduplicated"] += 1
+    stats["bytes_uploaded"] += len(data) if written else 0
+    url = download_url(bucket.name, path, token)
+
+    thumb_url = None
+    if with_thumbnail:
+        thumb = _thumbnail(data)
+        if thumb is not None:
+            thumb_path = f"{MEDIA_PREFIX}/{collection}/thumbs/{digest}.jpg"
+            if dry_run or _upload(bucket, thumb_path, thumb, "image/jpeg", token):
+                stats["thumbnails"] += 1
+            thumb_url = download_url(bucket.name, thumb_path, token)
+    return url, thumb_url
+
+
+def _normalise(bucket, collection: str, record: dict, stats: dict, dry_run: bool) -> dict:
+    """Field updates that replace every inline image in `record` (empty if none)."""
+    updates = {}
+    for field, thumb_field in FIELDS.get(collection, {}).items():
+        value = record.get(field)
+        stored = store_inline(bucket, collection, value, True, stats, dry_run)
+        if stored is None:
+            continue
+        url, thumb_url = stored
+        updates[field] = url
+        updates[thumb_field] = thumb_url or url
+        stats["bytes_saved"] += len(value) - len(url)
+    for field in LIST_FIELDS.get(collection, []):
+        values = record.get(field)
+        if not isinstance(values, list) or not any(isinstance(v, str) and v.startswith("data:") for v in values):
+            continue
+        replaced = []
+        for value in values:
+            stored = store_inline(bucket, collection, value, False, stats, dry_run)
+            replaced.append(stored[0] if stored else value)
+            if stored:
+                stats["bytes_saved"] += len(value) - len(stored[0])
+        updates[field] = replaced
+    return updates
+
+
+def _new_stats(backend: str, collection: str, dry_run: bool) -> dict:
+    return {
+        "backend": backend, "collection": collection, "dry_run": dry_run, "scanned": 0, "migrated": 0,
+        "uploaded": 0, "deduplicated": 0, "thumbnails": 0, "errors": 0, "failures": [],
+        "bytes_uploaded": 0, "bytes_saved": 0, "complete": False, "elapsed_s": 0.0, "docs_per_second": 0.0,
+    }
+
+
+def _checkpoint_ref(db, backend: str, collection: str):
+    return db.collection(MIGRATIONS_COLLECTION).document(f"inline_media_{backend}_{collection}")
+
+
+def _run(db, backend: str, collection: str, fetch_page, apply_updates, bucket, max_pages, dry_run, restart) -> dict:
+    """Shared page loop: fetch, normalise in parallel, write, checkpoint."""
+    started = time.perf_counter()
+    stats = _new_stats(backend, collection, dry_run)
+    checkpoint = _checkpoint_ref(db, backend, collection)
+    cursor = None
+    if not restart:
+        snapshot = checkpoint.get()
+        cursor = (snapshot.to_dict() or {}).get("cursor") if snapshot.exists else None
+
+    def normalise(item):
+        # Counts go to a per-record dict and are merged on the calling thread;
+        # a failure is returned in place of the counts and reported in the stats
+        key, record = item
+        counts = defaultdict(int)
+        try:
+            return key, _normalise(bucket, collection, record, counts, dry_run), counts
+        except Exception as e:
+            return key, {}, e
+
+    pages = 0
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as pool:
+        while max_pages is None or pages < max_pages:
+            page = fetch_page(cursor)
+            if not page:
+                stats["complete"] = True
+                cursor = None  # start over next run to pick up new inline writes
+                break
+            stats["scanned"] += len(page)
+            updates = {}
+            for key, fields, counts in pool.map(normalise, page):
+                if isinstance(counts, Exception):
+                    stats["errors"] += 1
+                    if len(stats["failures"]) < MAX_REPORTED_FAILURES:
+                        stats["failures"].append({"key": key, "error": str(counts)})
+                    continue
+                for name, value in counts.items():
+                    stats[name] += value
+                if fields:
+                    updates[key] = fields
+            if updates and not dry_run:
+                apply_updates(updates, dict(page))
+            stats["migrated"] += len(updates)
+            cursor = page[-1][0]
+            pages += 1
+            if len(page) < PAGE_SIZE:
+                stats["complete"] = True
+                cursor = None
+                break
+            if not dry_run:
+                checkpoint.set({"cursor": cursor, "updatedAt": firestore.SERVER_TIMESTAMP})
+
+    if not dry_run:
+        checkpoint.set({"cursor": cursor, "updatedAt": firestore.SERVER_TIMESTAMP, "lastRun": stats})
+    elapsed = time.perf_counter() - started
+    stats["elapsed_s"] = round(elapsed, 3)
+    stats["docs_per_second"] = round(stats["scanned"] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+
+def migrate_firestore(db, bucket, collection: str, max_pages: int = None, dry_run: bool = False, restart: bool = False,
+                      on_update=None) -> dict:
+    """
+    Normalises inline media in a Firestore collection, paging by document id.
+    on_update(doc_id, record) is called with each rewritten record once its
+    page is committed, e.g. to refresh the materialized feeds.
+    """
+    query = db.collection(collection).order_by("__name__").limit(PAGE_SIZE)
+
+    def fetch_page(cursor):
+        page_query = query.start_after({"__name__": db.collection(collection).document(cursor)}) if cursor else query
+        return [(doc.id, doc.to_dict()) for doc in page_query.stream()]
+
+    def apply_updates(updates, records):
+        with batching.BatchCommitter(db) as writer:
+            for key, fields in updates.items():
+                writer.update(db.collection(collection).document(key), fields)
+        if on_update is not None:
+            for key, fields in updates.items():
+                on_update(key, {**records[key], **fields})
+
+    return _run(db, "firestore", collection, fetch_page, apply_updates, bucket, max_pages, dry_run, restart)
+
+
+def migrate_rtdb(db, root_ref, bucket, collection: str, max_pages: int = None, dry_run: bool = False, restart: bool = False) -> dict:
+    """Normalises inline media under an RTDB node, paging by key."""
+    node = root_ref.child(collection)
+
+    def fetch_page(cursor):
+        return [(k, v if isinstance(v, dict) else {}) for k, v in batching.rtdb_page(node, cursor, PAGE_SIZE)]
+
+    def apply_updates(updates, records):
+        node.update({f"{key}/{field}": value for key, fields in updates.items() for field, value in fields.items()})
+
+    return _run(db, "rtdb", collection, fetch_page, apply_updates, bucket, max_pages, dry_run, restart)
@@ -0,0 +1,176 @@
+"""
+Token-bucket rate limiting for calls that share a quota across every
+function instance (Gemini requests-per-minute and tokens-per-minute).
+
+    limiter = RateLimiter("gemini-1.5-flash", {"requests": 2000, "tokens": 4_000_000}, db=db)
+    limiter.acquire(requests=1, tokens=900)   # blocks until the budget allows it
+
+Each dimension is a bucket holding up to one minute of budget and refilling
+continuously. With a `db`, the buckets live in rate_limits/{name} and are
+shared by all instances; an instance leases about LEASE_SECONDS worth of
+budget per transaction and spends it locally, so the shared doc sees a few
+writes per second instead of one per call. If Firestore is unreachable the
+limiter falls back to in-process buckets for FALLBACK_SECONDS; each switch
+is counted in metrics() and reported through the optional `log` callable
+(the caller's structured logger, e.g. main._log).
+
+Callers wait (up to max_wait) instead of failing at the ceiling; Saturated
+is raised only when the wait would be longer. metrics() reports the number
+of callers currently queued and totals since start.
+"""
+
+import threading
+import time
+
+from firebase_admin import firestore
+
+RATE_LIMITS_COLLECTION = "rate_limits"
+LEASE_SECONDS = 1.0  # budget leased from the shared doc per transaction
+FALLBACK_SECONDS = 60.0
+DEFAULT_MAX_WAIT = 60.0
+
+
+class Saturated(Exception):
+    """The budget will not allow the call within max_wait seconds."""
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+
+def _refilled(state: dict, limits: dict, now: float) -> dict:
+    """Shared bucket levels at `now` (epoch seconds) from the stored doc."""
+    elapsed = max(0.0, now - state.get("updatedAt", now))
+    return {
+        dim: min(float(per_minute), state.get(dim, float(per_minute)) + elapsed * per_minute / 60.0)
+        for dim, per_minute in limits.items()
+    }
+
+
+class RateLimiter:
+    def __init__(self, name: str, limits: dict, db=None, max_wait: float = DEFAULT_MAX_WAIT, log=None):
+        # Dimensions with a budget of 0 (or less) are unlimited
+        self.name = name
+        self.log = log
+        self.limits = {dim: per_minute for dim, per_minute in limits.items() if per_minute > 0}
+        self.db = db
+        self.max_wait = max_wait
+        self._local = {dim: TokenBucket(per_minute) for dim, per_minute in self.limits.items()}
+        self._leased = {dim: 0.0 for dim in self.limits}
+        self._fallback_until = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"waiting": 0, "max_waiting": 0, "acquired": 0, "saturated": 0, "fallbacks": 0, "wait_seconds": 0.0}
+
+    def acquire(self, **amounts):
+        """Blocks until every dimension has budget for `amounts`, then spends it."""
+        amounts = {dim: amounts.get(dim, 0) for dim in self.limits}
+        if not amounts:
+            return
+        for dim, amount in amounts.items():
+            if amount > self.limits[dim]:
+                raise Saturated(f"{self.name}: {amount} {dim} is more than a minute of budget")
+        started = time.monotonic()
+        with self._lock:
+            self._stats["waiting"] += 1
+            self._stats["max_waiting"] = max(self._stats["max_waiting"], self._stats["waiting"])
+        try:
+            while True:
+                wait = self._take(amounts)
+                if wait == 0:
+                    with self._lock:
+                        self._stats["acquired"] += 1
+                        self._stats["wait_seconds"] += time.monotonic() - started
+                    return
+                if time.monotonic() - started + wait > self.max_wait:
+                    with self._lock:
+                        self._stats["saturated"] += 1
+                    raise Saturated(f"{self.name}: no budget within {self.max_wait:g}s")
+                time.sleep(wait)
+        finally:
+            with self._lock:
+                self._stats["waiting"] -= 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["backend"] = "firestore" if self.db is not None and time.monotonic() >= self._fallback_until else "local"
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        return stats
+
+    def _take(self, amounts: dict) -> float:
+        """Spends `amounts` and returns 0, or returns how long to wait before trying again."""
+        if self.db is None or time.monotonic() < self._fallback_until:
+            return self._take_local(amounts)
+        with self._lock:
+            if all(self._leased[dim] >= amount for dim, amount in amounts.items()):
+                for dim, amount in amounts.items():
+                    self._leased[dim] -= amount
+                return 0.0
+        try:
+            return self._take_shared(amounts)
+        except Exception as e:
+            with self._lock:
+                self._stats["fallbacks"] += 1
+            if self.log is not None:
+                self.log("Rate limiter shared state unavailable, using local buckets.", severity="WARNING",
+                         limiter=self.name, error=str(e))
+            self._fallback_until = time.monotonic() + FALLBACK_SECONDS
+            return self._take_local(amounts)
+
+    def _take_local(self, amounts: dict) -> float:
+        with self._lock:
+            wait = max(self._local[dim].wait_time(amount) for dim, amount in amounts.items())
+            if wait == 0:
+                for dim, amount in amounts.items():
+                    self._local[dim].tokens -= amount
+            return wait
+
+    def _take_shared(self, amounts: dict) -> float:
+        ref = self.db.collection(RATE_LIMITS_COLLECTION).document(self.name)
+        with self._lock:
+            # Top the lease up to the amount needed plus LEASE_SECONDS of budget
+            wanted = {
+                dim: max(0.0, amount - self._leased[dim]) + self.limits[dim] / 60.0 * LEASE_SECONDS
+                for dim, amount in amounts.items()
+            }
+            needed = {dim: max(0.0, amount - self._leased[dim]) for dim, amount in amounts.items()}
+
+        @firestore.transactional
+        def lease(transaction):
+            snapshot = ref.get(transaction=transaction)
+            now = time.time()
+            levels = _refilled((snapshot.to_dict() or {}) if snapshot.exists else {}, self.limits, now)
+            short = {dim: needed[dim] - levels[dim] for dim in needed if levels[dim] < needed[dim]}
+            if short:
+                return None, max(s / (self.limits[dim] / 60.0) for dim, s in short.items())
+            granted = {dim: min(levels[dim], wanted[dim]) for dim in wanted}
+            transaction.set(ref, {
+                **{dim: levels[dim] - granted.get(dim, 0.0) for dim in levels},
+                "updatedAt": now,
+            })
+            return granted, 0.0
+
+        granted, wait = lease(self.db.transaction())
+        if granted is None:
+            return wait
+        with self._lock:
+            for dim, amount in granted.items():
+                self._leased[dim] += amount
+            if all(self._leased[dim] >= amount for dim, amount in amounts.items()):
+                for dim, amount in amounts.items():
+                    self._leased[dim] -= amount
+                return 0.0
+        return self._take(amounts)
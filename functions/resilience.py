@@ -0,0 +1,176 @@
+"""
+Failure handling for calls to external services (Gemini): error
+classification, exponential backoff with full jitter and a per-process
+circuit breaker.
+
+    kind = classify(exc)            # "rate_limited", "unavailable", ...
+    breaker = CircuitBreaker("gemini-1.5-flash")
+    result = call_with_retry(fn, breaker=breaker)
+
+call_with_retry retries only transient kinds (RETRYABLE_KINDS) and raises
+CallFailed with the last kind once attempts run out, the error is permanent,
+or the breaker is open.
+"""
+
+import json
+import random
+import threading
+import time
+
+from google.api_core import exceptions as gexc
+
+MAX_ATTEMPTS = 4
+MALFORMED_MAX_ATTEMPTS = 2  # a bad answer is usually the prompt's fault, so retry it only once
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_CAP_SECONDS = 8.0
+
+# Error kinds. Transient ones are retried on the same model; MODEL_KINDS mean
+# this model cannot serve the request, so callers should move to the next one.
+RATE_LIMITED = "rate_limited"
+UNAVAILABLE = "unavailable"
+TIMEOUT = "timeout"
+MALFORMED = "malformed"  # response was not the JSON we asked for
+MODEL_NOT_FOUND = "model_not_found"
+BLOCKED = "blocked"  # prompt or response blocked by the model's safety filters
+INVALID_REQUEST = "invalid_request"
+UNKNOWN = "unknown"
+CIRCUIT_OPEN = "circuit_open"
+THROTTLED = "throttled"  # our own rate limiter had no budget in time
+
+RETRYABLE_KINDS = {RATE_LIMITED, UNAVAILABLE, TIMEOUT, MALFORMED}
+_HTTP_KINDS = {
+    400: INVALID_REQUEST, 401: INVALID_REQUEST, 403: INVALID_REQUEST, 404: MODEL_NOT_FOUND,
+    408: TIMEOUT, 429: RATE_LIMITED, 500: UNAVAILABLE, 502: UNAVAILABLE, 503: UNAVAILABLE, 504: TIMEOUT,
+}
+MODEL_KINDS = {MODEL_NOT_FOUND, CIRCUIT_OPEN, THROTTLED}
+
+
+class CallFailed(Exception):
+    """A call that failed after classification and any retries."""
+
+    def __init__(self, kind: str, message: str):
+        super().__init__(f"{kind}: {message}")
+        self.kind = kind
+        self.message = message
+
+    @property
+    def transient(self) -> bool:
+        return self.kind in RETRYABLE_KINDS or self.kind in (CIRCUIT_OPEN, THROTTLED)
+
+
+def classify(exc: Exception) -> str:
+    """Maps an exception from the Gemini SDK (or our own parsing) to an error kind."""
+    if isinstance(exc, CallFailed):
+        return exc.kind
+    if isinstance(exc, (gexc.ResourceExhausted, gexc.TooManyRequests)):
+        return RATE_LIMITED
+    if isinstance(exc, (gexc.ServiceUnavailable, gexc.InternalServerError, gexc.BadGateway)):
+        return UNAVAILABLE
+    if isinstance(exc, (gexc.DeadlineExceeded, gexc.GatewayTimeout, TimeoutError)):
+        return TIMEOUT
+    if isinstance(exc, gexc.NotFound):
+        return MODEL_NOT_FOUND
+    if isinstance(exc, (gexc.InvalidArgument, gexc.PermissionDenied, gexc.Unauthenticated)):
+        return INVALID_REQUEST
+    if isinstance(exc, json.JSONDecodeError):
+        return MALFORMED
+    # Other API errors by HTTP status. Nothing is matched on the message text:
+    # blocked content is reported by the caller as CallFailed(BLOCKED)
+    code = getattr(exc, "code", None)
+    if isinstance(code, int) and not isinstance(code, bool):
+        return _HTTP_KINDS.get(code, UNKNOWN)
+    return UNKNOWN
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE_SECONDS, cap: float = BACKOFF_CAP_SECONDS) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Per-process breaker. Opens after `failure_threshold` consecutive transient
+    failures, rejects calls for `reset_timeout` seconds, then lets a single
+    probe through (half-open); the probe's outcome closes or re-opens it.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+def call_with_retry(fn, breaker: CircuitBreaker = None, max_attempts: int = MAX_ATTEMPTS, sleep=time.sleep, acquire=None):
+    """
+    Calls fn() until it succeeds, retrying transient errors with backoff.
+    Raises CallFailed with the classified kind otherwise. Only transient
+    failures count against the breaker; a bad request or a malformed answer
+    says nothing about the health of the service. Malformed answers are
+    retried at most MALFORMED_MAX_ATTEMPTS times in total.
+
+    `acquire`, if given, is called before every attempt (e.g. a rate
+    limiter); any exception it raises becomes CallFailed(THROTTLED) without
+    touching the breaker.
+    """
+    for attempt in range(max_attempts):
+        if breaker is not None and breaker.state == "open":
+            raise CallFailed(CIRCUIT_OPEN, f"circuit for {breaker.name} is open")
+        if acquire is not None:
+            try:
+                acquire()
+            except Exception as e:
+                raise CallFailed(THROTTLED, str(e)) from e
+        if breaker is not None and not breaker.allow():
+            raise CallFailed(CIRCUIT_OPEN, f"circuit for {breaker.name} is open")
+        try:
+            result = fn()
+        except Exception as e:
+            kind = classify(e)
+            if breaker is not None:
+                if kind in RETRYABLE_KINDS and kind != MALFORMED:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            last_attempt = attempt == max_attempts - 1 or (kind == MALFORMED and attempt + 1 >= MALFORMED_MAX_ATTEMPTS)
+            if kind not in RETRYABLE_KINDS or last_attempt:
+                raise CallFailed(kind, e.message if isinstance(e, CallFailed) else str(e)) from e
+            sleep(backoff_delay(attempt))
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
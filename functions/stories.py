@@ -0,0 +1,227 @@
+"""
+Expired-story sweeper. Stories carry `expiresAt` and nothing else removes
+them, so every watchStories listener downloads every story ever written.
+
+Two copies of the data exist and both are swept:
+
+    Firestore  stories/{id}       expiresAt is a timestamp (seed scripts)
+    RTDB       /stories/{id}      expiresAt is epoch millis (the app)
+
+Expired stories are found with a range query on expiresAt, never a full
+scan. Firestore indexes the field automatically. The RTDB query needs this
+in the database rules, or the server refuses it:
+
+    "stories": {".indexOn": ["expiresAt"]}
+
+mode="delete" removes the stories and the Storage objects their media URLs
+point at. Objects still used by a live story are kept; the media migration
+(media.py) stores identical images from both backends at the same path, so
+callers sweeping both pass the other backend's live_media() in as
+`live_paths`. mode="archive" moves
+the stories to stories_archive with an archivedAt stamp and keeps the media.
+With dry_run nothing is written; the stats say what would have been.
+"""
+
+import time
+from datetime import datetime, timezone
+from urllib.parse import unquote, urlparse
+
+from firebase_admin import firestore
+
+import batching
+
+STORIES = "stories"
+ARCHIVE = "stories_archive"
+PAGE_SIZE = 500  # stories per query page
+MAX_BATCH_BYTES = 8 * 1024 * 1024  # under the 10 MiB commit limit; archived stories may hold inline images
+RTDB_FANOUT_SIZE = 500  # stories per multi-path update()
+STORAGE_BATCH_SIZE = 100  # GCS limit on calls per batch request
+MEDIA_FIELDS = ("imageURL", "thumbnailURL", "mediaURL")
+
+
+def blob_path(url, bucket_name: str):
+    """
+    Object path for a URL into `bucket_name` (gs://, firebasestorage download
+    URLs, storage.googleapis.com), or None for anything else such as inline
+    data: URIs and third-party images.
+    """
+    if not isinstance(url, str):
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "gs" and parsed.netloc == bucket_name:
+        return parsed.path.lstrip("/") or None
+    if parsed.netloc == "firebasestorage.googleapis.com":
+        prefix = f"/v0/b/{bucket_name}/o/"
+        if parsed.path.startswith(prefix):
+            return unquote(parsed.path[len(prefix):]) or None
+    if parsed.netloc == "storage.googleapis.com":
+        prefix = f"/{bucket_name}/"
+        if parsed.path.startswith(prefix):
+            return unquote(parsed.path[len(prefix):]) or None
+    return None
+
+
+def _media_paths(story: dict, bucket_name: str) -> set:
+    return {p for p in (blob_path(story.get(f), bucket_name) for f in MEDIA_FIELDS) if p}
+
+
+def _new_stats(backend: str, mode: str, dry_run: bool) -> dict:
+    return {
+        "backend": backend, "mode": mode, "dry_run": dry_run,
+        "expired": 0, "removed": 0, "blobs_deleted": 0, "blobs_kept": 0, "elapsed_s": 0.0, "per_second": 0.0,
+    }
+
+
+def _finish_stats(stats: dict, started: float) -> dict:
+    elapsed = time.perf_counter() - started
+    stats["elapsed_s"] = round(elapsed, 3)
+    stats["per_second"] = round(stats["expired"] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+
+def _delete_blobs(storage_client, bucket_name: str, paths: set, live_paths: set, stats: dict, dry_run: bool):
+    doomed = sorted(paths - live_paths)
+    stats["blobs_kept"] += len(paths) - len(doomed)
+    if dry_run:
+        stats["blobs_deleted"] += len(doomed)
+        return
+    bucket = storage_client.bucket(bucket_name)
+    for i in range(0, len(doomed), STORAGE_BATCH_SIZE):
+        chunk = doomed[i:i + STORAGE_BATCH_SIZE]
+        # Objects already gone are fine; the batch reports them per call
+        with storage_client.batch(raise_exception=False):
+            for path in chunk:
+                bucket.blob(path).delete()
+        stats["blobs_deleted"] += len(chunk)
+
+
+def _remove_page(db, page: list, mode: str):
+    """
+    Deletes (or archives) a page of story docs, committing whenever the next
+    story would take the batch past batching.MAX_BATCH_WRITES writes or, with
+    the archive copies, roughly MAX_BATCH_BYTES. A story's copy and delete
+    always share a commit.
+    """
+    with batching.BatchCommitter(db, max_bytes=MAX_BATCH_BYTES) as writer:
+        for doc in page:
+            data = doc.to_dict() if mode == "archive" else None
+            if data is None:
+                writer.delete(doc.reference)
+                continue
+            writer.reserve(2, len(repr(data)))
+            writer.set(db.collection(ARCHIVE).document(doc.id), {**data, "archivedAt": firestore.SERVER_TIMESTAMP})
+            writer.delete(doc.reference)
+
+
+def live_media_firestore(db, bucket_name: str, now: datetime = None) -> set:
+    """Object paths used by unexpired Firestore stories."""
+    now = now or datetime.now(timezone.utc)
+    live = db.collection(STORIES).where(filter=firestore.FieldFilter("expiresAt", ">", now)).select(list(MEDIA_FIELDS))
+    paths = set()
+    for doc in live.stream():
+        paths |= _media_paths(doc.to_dict(), bucket_name)
+    return paths
+
+
+def live_media_rtdb(root_ref, bucket_name: str, now: datetime = None) -> set:
+    """Object paths used by unexpired RTDB stories."""
+    now_ms = int((now or datetime.now(timezone.utc)).timestamp() * 1000)
+    live = root_ref.child(STORIES).order_by_child("expiresAt").start_at(now_ms + 1).get() or {}
+    paths = set()
+    for story in live.values():
+        if isinstance(story, dict):
+            paths |= _media_paths(story, bucket_name)
+    return paths
+
+
+def sweep_firestore(db, storage_client, bucket_name: str, mode: str = "delete", dry_run: bool = False, now: datetime = None,
+                    live_paths: set = frozenset()) -> dict:
+    """
+    Sweeps expired docs from the Firestore stories collection. `live_paths`
+    adds objects to keep on top of those used by live Firestore stories.
+    """
+    started = time.perf_counter()
+    now = now or datetime.now(timezone.utc)
+    stats = _new_stats("firestore", mode, dry_run)
+    collection = db.collection(STORIES)
+
+    if mode == "delete":
+        live_paths = set(live_paths) | live_media_firestore(db, bucket_name, now)
+
+    query = collection.where(filter=firestore.FieldFilter("expiresAt", "<=", now)).order_by("expiresAt").limit(PAGE_SIZE)
+    cursor = None
+    media = set()
+    while True:
+        page = list((query.start_after(cursor) if cursor else query).stream())
+        if not page:
+            break
+        cursor = page[-1]
+        stats["expired"] += len(page)
+        if not dry_run:
+            _remove_page(db, page, mode)
+        stats["removed"] += len(page)
+        if mode == "delete":
+            for doc in page:
+                media |= _media_paths(doc.to_dict(), bucket_name)
+        if len(page) < PAGE_SIZE:
+            break
+
+    if media:
+        _delete_blobs(storage_client, bucket_name, media, live_paths, stats, dry_run)
+    return _finish_stats(stats, started)
+
+
+def _is_millis(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def sweep_rtdb(root_ref, storage_client, bucket_name: str, mode: str = "delete", dry_run: bool = False, now: datetime = None,
+               live_paths: set = frozenset()) -> dict:
+    """
+    Sweeps expired children of the RTDB /stories node. `live_paths` adds
+    objects to keep on top of those used by live RTDB stories.
+    """
+    started = time.perf_counter()
+    now = now or datetime.now(timezone.utc)
+    now_ms = int(now.timestamp() * 1000)
+    stats = _new_stats("rtdb", mode, dry_run)
+    stories = root_ref.child(STORIES)
+
+    if mode == "delete":
+        live_paths = set(live_paths) | live_media_rtdb(root_ref, bucket_name, now)
+
+    # Pages are cursored on expiresAt; children sharing the boundary value
+    # come back on the next page too, so they are skipped by key.
+    cursor, boundary = None, set()
+    media = set()
+    while True:
+        query = stories.order_by_child("expiresAt")
+        if cursor is not None:
+            query = query.start_at(cursor)
+        page = query.end_at(now_ms).limit_to_first(PAGE_SIZE).get() or {}
+        fresh = [
+            (key, story) for key, story in page.items()
+            if key not in boundary and isinstance(story, dict) and _is_millis(story.get("expiresAt"))
+        ]
+        if not fresh:
+            break
+        stats["expired"] += len(fresh)
+        for i in range(0, len(fresh), RTDB_FANOUT_SIZE):
+            chunk = fresh[i:i + RTDB_FANOUT_SIZE]
+            if not dry_run:
+                update = {f"{STORIES}/{key}": None for key, _ in chunk}
+                if mode == "archive":
+                    update.update({f"{ARCHIVE}/{key}": {**story, "archivedAt": now_ms} for key, story in chunk})
+                root_ref.update(update)
+            stats["removed"] += len(chunk)
+        if mode == "delete":
+            for _, story in fresh:
+                media |= _media_paths(story, bucket_name)
+        cursor = max(story["expiresAt"] for _, story in fresh)
+        boundary = {key for key, story in page.items() if isinstance(story, dict) and story.get("expiresAt") == cursor}
+        if len(page) < PAGE_SIZE:
+            break
+
+    if media:
+        _delete_blobs(storage_client, bucket_name, media, live_paths, stats, dry_run)
+    return _finish_stats(stats, started)
@@ -0,0 +1,60 @@
+"""
+Concurrency check for the transactional user score update. Run against the
+Firestore emulator only: it creates and overwrites `users/stress_user_*`.
+
+Usage:
+  export FIRESTORE_EMULATOR_HOST=localhost:8080
+  python stress_user_score.py [--users 5] [--posts 50] [--workers 32]
+"""
+
+import argparse
+import os
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import counters
+import main
+
+
+def run(users: int, posts: int, workers: int) -> bool:
+    db = main.get_db()
+    uids = [f"stress_user_{i}" for i in range(users)]
+    for uid in uids:
+        user_ref = db.collection("users").document(uid)
+        batch = db.batch()
+        batch.set(user_ref, {"uid": uid, "streak": 0})
+        counters.reset(user_ref, "sdgScore", 0, batch)
+        batch.commit()
+
+    awards = [(uid, random.randint(21, 100)) for uid in uids for _ in range(posts)]
+    random.shuffle(awards)
+    expected = {uid: 0 for uid in uids}
+    for uid, points in awards:
+        expected[uid] += points
+
+    # Every post for every user is applied at once
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda award: main._update_user_score(*award), awards))
+
+    ok = True
+    for uid in uids:
+        user_ref = db.collection("users").document(uid)
+        score = counters.total(user_ref, "sdgScore")
+        streak = user_ref.get().to_dict()["streak"]
+        status = "✅" if score == expected[uid] and streak == 1 else "❌"
+        ok = ok and status == "✅"
+        print(f"  {status} {uid}: sdgScore {score} (expected {expected[uid]}), streak {streak}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--posts", type=int, default=50, help="posts per user")
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        sys.exit("Refusing to run: FIRESTORE_EMULATOR_HOST is not set.")
+    sys.exit(0 if run(args.users, args.posts, args.workers) else 1)
@@ -0,0 +1,362 @@
+"""
+Bulk seeding engine shared by the seed scripts.
+
+Firestore writes go through a BulkWriter (parallel 500-op batches with
+retries) or, with mode="batch", through 500-write batch commits on a thread
+pool. RTDB writes are grouped into multi-path update() fan-outs. Independent
+collections / nodes can be loaded concurrently with load_parallel().
+patch_firestore() applies computed field updates to existing documents,
+reading only the fields it needs and writing only documents that change.
+
+With incremental=True the writers keep a seed-state manifest: a content hash
+per seeded record, stored next to the data (Firestore _seed_manifest/
+{collection}/shards/*, RTDB /_seed_manifest/{path}). A re-run hashes the
+desired records, writes only those whose hash changed or that were never
+seeded, and updates the manifest once every write has succeeded. With
+verify=True the target is also listed (ids only) so records deleted behind
+the manifest's back are written again.
+
+Every writer accepts any iterable of (key, data) pairs and keeps a bounded
+number of writes in flight, so generated datasets can be streamed through
+without holding them in memory.
+
+Usage from a seed script:
+    import bulk_loader
+    bulk_loader.write_firestore(db, "posts", ((p["id"], p) for p in posts))
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+
+# Chunking and RTDB paging are shared with the Cloud Functions
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+import batching  # noqa: E402
+
+FIRESTORE_BATCH_SIZE = batching.MAX_BATCH_WRITES
+RTDB_FANOUT_SIZE = 1000  # child paths per multi-path update()
+FLUSH_EVERY = 10_000  # BulkWriter ops buffered before a flush
+MAX_ATTEMPTS = 5
+# gRPC codes worth retrying: DEADLINE_EXCEEDED, RESOURCE_EXHAUSTED, ABORTED,
+# INTERNAL, UNAVAILABLE. Anything else (e.g. NOT_FOUND on update) fails fast.
+RETRYABLE_CODES = {4, 8, 10, 13, 14}
+DEFAULT_WORKERS = 8
+MANIFEST = "_seed_manifest"
+MANIFEST_SHARDS = 256  # Firestore manifest docs per collection, ~5M records before a shard nears 1 MiB
+
+# BulkWriter starts at Firestore's recommended 500 ops/s and ramps up by 50%
+# every 5 minutes. The emulator has no such limits, so it goes flat out.
+PRODUCTION_OPS_PER_SECOND = (500, 10_000)
+EMULATOR_OPS_PER_SECOND = (1_000_000, 1_000_000)
+
+
+def _run_bounded(fn, items, workers: int) -> int:
+    """Runs fn over items on a pool with at most 2 * workers pending; returns the sum of results."""
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for item in items:
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                total += sum(f.result() for f in done)
+            pending.add(pool.submit(fn, item))
+        total += sum(f.result() for f in pending)
+    return total
+
+
+def _report(label: str, count: int, started: float):
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed else 0
+    print(f"  ✅ {label}: {count} writes in {elapsed:.1f}s ({rate:,.0f}/s)")
+
+
+def _canonical(value):
+    """
+    JSON fallback for Firestore values, stable across runs. Never falls back
+    to repr(): for references and transforms it includes a memory address.
+    """
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if hasattr(value, "latitude") and hasattr(value, "longitude"):
+        return [value.latitude, value.longitude]
+    if isinstance(value, bytes):
+        return value.hex()
+    if hasattr(value, "path") and hasattr(value, "collection"):
+        return {"$ref": value.path}  # DocumentReference
+    if isinstance(value, transforms.Sentinel):  # SERVER_TIMESTAMP, DELETE_FIELD
+        return {"$sentinel": value.description}
+    if isinstance(value, (transforms.ArrayUnion, transforms.ArrayRemove)):
+        return {f"${type(value).__name__}": value.values}
+    if isinstance(value, (transforms.Increment, transforms.Maximum, transforms.Minimum)):
+        return {f"${type(value).__name__}": value.value}
+    raise TypeError(f"{type(value).__name__} values cannot be content-hashed")
+
+
+def content_hash(data) -> str:
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_canonical)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+class _Manifest:
+    """
+    Seed-state manifest for one collection / node: {key: content hash}.
+    changed() filters a record stream down to what needs writing and
+    remembers the new hashes; each backend's save() persists them.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.pending = {}
+        self.skipped = 0
+
+    def changed(self, records, existing: set = None):
+        for key, data in records:
+            if key is None:
+                raise ValueError("incremental writes need explicit ids")
+            digest = content_hash(data)
+            if self.hashes.get(key) == digest and (existing is None or key in existing):
+                self.skipped += 1
+                continue
+            self.pending[key] = digest
+            yield key, data
+
+
+class FirestoreManifest(_Manifest):
+    def __init__(self, db, collection: str):
+        super().__init__()
+        self.shards = db.collection(MANIFEST).document(collection.replace("/", "__")).collection("shards")
+        self.db = db
+        for snapshot in self.shards.stream():
+            self.hashes.update((snapshot.to_dict() or {}).get("hashes", {}))
+
+    @staticmethod
+    def shard(key: str) -> str:
+        return f"{int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % MANIFEST_SHARDS:03d}"
+
+    def save(self):
+        touched = {self.shard(key) for key in self.pending}
+        self.hashes.update(self.pending)
+        self.pending = {}
+        grouped = {shard: {} for shard in touched}
+        for key, digest in self.hashes.items():
+            shard = self.shard(key)
+            if shard in grouped:
+                grouped[shard][key] = digest
+        # Whole shards are rewritten, so keys with dots or slashes need no escaping
+        for chunk in batching.chunks(grouped.items(), FIRESTORE_BATCH_SIZE):
+            batch = self.db.batch()
+            for shard, hashes in chunk:
+                batch.set(self.shards.document(shard), {"hashes": hashes})
+            batch.commit()
+
+
+class RtdbManifest(_Manifest):
+    def __init__(self, root_ref, path: str):
+        super().__init__()
+        self.node = root_ref.child(f"{MANIFEST}/{path}")
+        self.hashes = self.node.get() or {}
+
+    def save(self):
+        for chunk in batching.chunks(self.pending.items(), RTDB_FANOUT_SIZE):
+            self.node.update(dict(chunk))
+        self.hashes.update(self.pending)
+        self.pending = {}
+
+
+def _finish_manifest(manifest: _Manifest, label: str, failed: int):
+    if failed:
+        print(f"  ⚠️  {label}: {failed} writes failed, manifest not updated (next run rewrites them)")
+        return
+    if manifest.pending:
+        manifest.save()
+    print(f"  ⏭️  {label}: {manifest.skipped} unchanged records skipped")
+
+
+class FirestoreWriter:
+    """
+    BulkWriter wrapper used as a context manager. Same set/update/delete
+    signatures as a WriteBatch, so helpers that take a `writer` (e.g.
+    counters.reset) work with it too.
+    """
+
+    def __init__(self, db, ops_per_second=None):
+        if ops_per_second is None:
+            on_emulator = bool(os.environ.get("FIRESTORE_EMULATOR_HOST"))
+            ops_per_second = EMULATOR_OPS_PER_SECOND if on_emulator else PRODUCTION_OPS_PER_SECOND
+        initial, maximum = ops_per_second
+        self._writer = db.bulk_writer(BulkWriterOptions(initial_ops_per_second=initial, max_ops_per_second=maximum))
+        self._writer.on_write_error(self._on_error)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.failed = 0
+
+    def _on_error(self, error, writer) -> bool:
+        if error.code in RETRYABLE_CODES and error.attempts < MAX_ATTEMPTS:
+            return True  # retry
+        with self._lock:
+            self.failed += 1
+        print(f"  ⚠️  write failed after {error.attempts} attempts: {error.message}")
+        return False
+
+    def _tick(self):
+        self.count += 1
+        if self.count % FLUSH_EVERY == 0:
+            self._writer.flush()
+
+    def set(self, ref, data, merge=False):
+        self._writer.set(ref, data, merge=merge)
+        self._tick()
+
+    def update(self, ref, data):
+        self._writer.update(ref, data)
+        self._tick()
+
+    def delete(self, ref):
+        self._writer.delete(ref)
+        self._tick()
+
+    def close(self) -> int:
+        self._writer.close()
+        return self.count - self.failed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_firestore(db, collection: str, docs, mode: str = "bulk", workers: int = DEFAULT_WORKERS, merge: bool = False,
+                    incremental: bool = False, verify: bool = False, on_write=None) -> int:
+    """
+    Writes (doc_id, data) pairs into `collection`. A doc_id of None gets an
+    auto-generated id. mode="bulk" uses a BulkWriter; mode="batch" commits
+    500-write batches on `workers` threads. incremental=True writes only
+    docs that differ from the seed-state manifest (ids required).
+    With mode="bulk", on_write(writer, ref, data) can add writes that belong
+    with each doc, e.g. counters.reset. Returns the number of writes.
+    """
+    if on_write is not None and mode != "bulk":
+        raise ValueError("on_write needs mode='bulk'")
+    started = time.perf_counter()
+    col = db.collection(collection)
+    manifest = None
+    if incremental:
+        manifest = FirestoreManifest(db, collection)
+        existing = {snapshot.id for snapshot in col.select([]).stream()} if verify else None
+        docs = manifest.changed(docs, existing)
+    failed = 0
+
+    def ref_for(doc_id):
+        return col.document(doc_id) if doc_id is not None else col.document()
+
+    if mode == "bulk":
+        with FirestoreWriter(db) as writer:
+            for doc_id, data in docs:
+                ref = ref_for(doc_id)
+                writer.set(ref, data, merge=merge)
+                if on_write is not None:
+                    on_write(writer, ref, data)
+        count = writer.count - writer.failed
+        failed = writer.failed
+    else:
+        def commit(chunk) -> int:
+            batch = db.batch()
+            for doc_id, data in chunk:
+                batch.set(ref_for(doc_id), data, merge=merge)
+            batch.commit()
+            return len(chunk)
+
+        count = _run_bounded(commit, batching.chunks(docs, FIRESTORE_BATCH_SIZE), workers)
+
+    if manifest is not None:
+        _finish_manifest(manifest, collection, failed)
+    _report(collection, count, started)
+    return count
+
+
+def patch_firestore(db, collection: str, fields, patch, page_size: int = 1000, workers: int = DEFAULT_WORKERS) -> int:
+    """
+    Streams `collection` projected to `fields`, page by page, and calls
+    patch(doc_id, data) for each document. It returns the fields to update,
+    or None/{} when the document is already correct. Updates are committed
+    in 500-write batches on `workers` threads. Returns the number of
+    documents updated.
+    """
+    started = time.perf_counter()
+    query = db.collection(collection).select(list(fields)).order_by("__name__").limit(page_size)
+
+    def changes():
+        cursor = None
+        while True:
+            page = list((query.start_after(cursor) if cursor else query).stream())
+            for snapshot in page:
+                update = patch(snapshot.id, snapshot.to_dict() or {})
+                if update:
+                    yield snapshot.reference, update
+            if len(page) < page_size:
+                return
+            cursor = page[-1]
+
+    def commit(chunk) -> int:
+        batch = db.batch()
+        for ref, update in chunk:
+            batch.update(ref, update)
+        batch.commit()
+        return len(chunk)
+
+    count = _run_bounded(commit, batching.chunks(changes(), FIRESTORE_BATCH_SIZE), workers)
+    _report(collection, count, started)
+    return count
+
+
+def write_rtdb(root_ref, path: str, records, merge: bool = False, fanout_size: int = RTDB_FANOUT_SIZE, workers: int = DEFAULT_WORKERS,
+               incremental: bool = False, verify: bool = False) -> int:
+    """
+    Writes (key, data) pairs under `path` with multi-path update() calls of up
+    to `fanout_size` children each. Every child is replaced as a whole, like
+    set(); with merge=True only the given fields are written, like a per-child
+    update(). incremental=True writes only children that differ from the
+    seed-state manifest. Returns the number of children written.
+    """
+    started = time.perf_counter()
+    node = root_ref.child(path)
+    manifest = None
+    if incremental:
+        manifest = RtdbManifest(root_ref, path)
+        existing = set((node.get(shallow=True) or {}).keys()) if verify else None
+        records = manifest.changed(records, existing)
+
+    def fan_out(chunk) -> int:
+        if merge:
+            node.update({f"{key}/{field}": value for key, data in chunk for field, value in data.items()})
+        else:
+            node.update({key: data for key, data in chunk})
+        return len(chunk)
+
+    count = _run_bounded(fan_out, batching.chunks(records, fanout_size), workers)
+    if manifest is not None:
+        # A failed update() raises out of _run_bounded, so reaching here means all succeeded
+        _finish_manifest(manifest, path, 0)
+    _report(path, count, started)
+    return count
+
+
+def load_parallel(jobs: dict) -> dict:
+    """
+    Runs independent load jobs ({name: zero-arg callable returning a count})
+    concurrently and returns {name: count}.
+    """
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(jobs) or 1) as pool:
+        futures = {name: pool.submit(job) for name, job in jobs.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    _report("all", sum(results.values()), started)
+    return results
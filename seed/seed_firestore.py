@@ -1,5 +1,7 @@
 """
-Firestore Seed Script — Run this ONCE to populate your database with demo data.
+Firestore Seed Script — populates your database with demo data.
+Safe to re-run: documents have fixed ids and go through the bulk loader's
+seed-state manifest, so only changed or missing documents are written.
 Usage: python seed_firestore.py
 Requires: firebase-admin, google-cloud-firestore
 """
@@ -8,12 +10,17 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 from datetime import datetime, timezone, timedelta
 
+import bulk_loader
+
 # 1. Download your service account key from Firebase Console (Project Settings -> Service accounts)
 # 2. Save it as 'service-account.json' in this folder.
 cred = credentials.Certificate("service-account.json")
 firebase_admin.initialize_app(cred)
 db = firestore.client()
 
+def _numbered(prefix, records):
+    return ((f"{prefix}_{i + 1}", record) for i, record in enumerate(records))
+
 def seed():
     print("Seeding Firestore...")
 
@@ -26,9 +33,7 @@ def seed():
         {"title": "Eco Warrior Badge", "description": "Showcase your commitment to climate action.", "costInScore": 150, "type": "badge", "available": True},
         {"title": "NGO Donation RM20", "description": "We donate RM20 to an NGO of your choice.", "costInScore": 800, "type": "voucher", "available": True},
     ]
-    for r in rewards:
-        db.collection("rewards").add(r)
-    print(f"  ✅ {len(rewards)} rewards seeded")
+    bulk_loader.write_firestore(db, "rewards", _numbered("reward", rewards), incremental=True, verify=True)
 
     # ── NGO Organizations ──────────────────────────────────────────────────────
     ngos = [
@@ -49,14 +54,14 @@ def seed():
             "sdgGoals": [5, 10, 16], "contactEmail": "wao@wao.org.my", "address": "Petaling Jaya, Selangor",
         },
     ]
-    ngo_ids = []
-    for ngo in ngos:
-        ref = db.collection("ngo_orgs").add(ngo)
-        ngo_ids.append(ref[1].id)
-    print(f"  ✅ {len(ngos)} NGOs seeded")
+    # Same ids as the RTDB and synthetic seeds use for these NGOs
+    ngo_ids = [f"ngo_{i + 1}" for i in range(len(ngos))]
+    bulk_loader.write_firestore(db, "ngo_orgs", zip(ngo_ids, ngos), incremental=True, verify=True)
 
     # ── Volunteer Events ───────────────────────────────────────────────────────
-    now = datetime.now(timezone.utc)
+    # Dates are relative to today, not to this second, so a re-run on the same
+    # day leaves the events untouched
+    now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
     events = [
         {
             "ngoId": ngo_ids[0], "ngoName": "WWF Malaysia",
@@ -87,9 +92,7 @@ def seed():
             "location": firestore.GeoPoint(3.1528, 101.7038),
         },
     ]
-    for e in events:
-        db.collection("volunteer_events").add(e)
-    print(f"  ✅ {len(events)} volunteer events seeded")
+    bulk_loader.write_firestore(db, "volunteer_events", _numbered("event", events), incremental=True, verify=True)
 
     # ── Marketplace Products ───────────────────────────────────────────────────
     products = [
@@ -99,9 +102,7 @@ def seed():
         {"ngoId": ngo_ids[1], "ngoName": "Yayasan Chow Kit", "name": "Upcycled Notebook", "description": "Handmade notebook crafted by youth from Chow Kit.", "price": 12.00, "stock": 100, "sdgGoals": [4, 8]},
         {"ngoId": ngo_ids[3], "ngoName": "Women's Aid Organisation", "name": "Handwoven Basket", "description": "Beautiful basket woven by women artisans.", "price": 35.00, "stock": 15, "sdgGoals": [5, 8]},
     ]
-    for p in products:
-        db.collection("marketplace_products").add(p)
-    print(f"  ✅ {len(products)} marketplace products seeded")
+    bulk_loader.write_firestore(db, "marketplace_products", _numbered("product", products), incremental=True, verify=True)
 
     print("\n🎉 Firestore seeding complete!")
 
@@ -2,12 +2,21 @@
 Patch script: Adds imageURL to existing volunteer events, NGO orgs,
 and marketplace products in Firestore.
 
+Each keyword mapping is compiled once into a KeywordMatcher (a single
+case-insensitive regex), and the four collections are patched concurrently
+through bulk_loader.patch_firestore: only the name fields and imageURL are
+read, and only documents whose imageURL is missing or wrong are written.
+
 Usage: python seed_images.py
 """
 
+import re
+
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+import bulk_loader
+
 if not firebase_admin._apps:
     cred = credentials.Certificate(r"C:\Users\user\Downloads\sdg-connect-ff16c-firebase-adminsdk-fbsvc-fed3c83489.json")
     firebase_admin.initialize_app(cred)
@@ -47,36 +56,67 @@ REWARD_IMAGES = {
     "NGO Donation":              "https://images.unsplash.com/photo-1532629345422-7515f3d16bb6?w=800",
 }
 
+FALLBACK_IMAGE = "https://images.unsplash.com/photo-1500382017468-9049fed747ef?w=800"  # fallback green
+
+
+class KeywordMatcher:
+    """
+    Maps a name to the URL of the first keyword (in mapping order) it
+    contains, case-insensitively, in one regex pass over the name. The
+    lookahead makes the search report a match at every position, so a
+    keyword that overlaps an earlier-listed one is still seen.
+    """
+
+    def __init__(self, mapping: dict, fallback: str = FALLBACK_IMAGE):
+        self.urls = list(mapping.values())
+        self.fallback = fallback
+        alternatives = "|".join(f"(?P<k{i}>{re.escape(k)})" for i, k in enumerate(mapping))
+        self.pattern = re.compile(f"(?=(?:{alternatives}))", re.IGNORECASE)
+
+    def __call__(self, name: str) -> str:
+        best = None
+        for match in self.pattern.finditer(name or ""):
+            index = int(match.lastgroup[1:])
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    break
+        return self.urls[best] if best is not None else self.fallback
+
+
 def get_image(mapping, name):
-    for keyword, url in mapping.items():
-        if keyword.lower() in name.lower():
-            return url
-    return "https://images.unsplash.com/photo-1500382017468-9049fed747ef?w=800"  # fallback green
+    return KeywordMatcher(mapping)(name)
+
 
 def patch_collection(col_name, mapping, name_field="name"):
-    docs = db.collection(col_name).stream()
-    count = 0
-    for doc in docs:
-        data = doc.to_dict()
-        title = data.get(name_field, data.get("title", ""))
-        img = get_image(mapping, title)
-        db.collection(col_name).document(doc.id).update({"imageURL": img})
+    matcher = KeywordMatcher(mapping)
+
+    def patch(doc_id, data):
+        title = data.get(name_field, data.get("title", "")) or ""
+        img = matcher(title)
+        if data.get("imageURL") == img:
+            return None
         print(f"    📸 [{col_name}] {title[:45]}")
-        count += 1
-    return count
+        return {"imageURL": img}
 
-print("Adding images to Firestore collections...\n")
+    return bulk_loader.patch_firestore(db, col_name, {name_field, "title", "imageURL"}, patch)
 
-n = patch_collection("ngo_orgs",             NGO_IMAGES,       name_field="name")
-print(f"  ✅ {n} NGO orgs updated\n")
 
-n = patch_collection("volunteer_events",     VOLUNTEER_IMAGES, name_field="title")
-print(f"  ✅ {n} volunteer events updated\n")
+PATCHES = {
+    "ngo_orgs":             (NGO_IMAGES,       "name"),
+    "volunteer_events":     (VOLUNTEER_IMAGES, "title"),
+    "marketplace_products": (PRODUCT_IMAGES,   "name"),
+    "rewards":              (REWARD_IMAGES,    "title"),
+}
 
-n = patch_collection("marketplace_products", PRODUCT_IMAGES,   name_field="name")
-print(f"  ✅ {n} marketplace products updated\n")
+if __name__ == "__main__":
+    print("Adding images to Firestore collections...\n")
 
-n = patch_collection("rewards",              REWARD_IMAGES,    name_field="title")
-print(f"  ✅ {n} rewards updated\n")
+    updated = bulk_loader.load_parallel({
+        col_name: (lambda col_name=col_name, mapping=mapping, field=field: patch_collection(col_name, mapping, field))
+        for col_name, (mapping, field) in PATCHES.items()
+    })
+    for col_name, n in updated.items():
+        print(f"  ✅ {n} {col_name} updated (already-correct docs skipped)")
 
-print("🎉 All done! Images now visible in the app.")
+    print("\n🎉 All done! Images now visible in the app.")
@@ -8,7 +8,15 @@ Usage: python seed_posts.py
 import firebase_admin
 from firebase_admin import credentials, firestore
 from datetime import datetime, timezone, timedelta
+import os
 import random
+import sys
+
+import bulk_loader
+
+# Sharded counters live with the scoring function
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+import counters
 
 # ── Initialize Firebase ──────────────────────────────────────────────────────
 if not firebase_admin._apps:
@@ -105,42 +113,51 @@ def seed_posts():
     print("Seeding 10 sample posts...")
     now = datetime.now(timezone.utc)
 
-    # Ensure demo users exist in Firestore
-    for user in USERS:
-        db.collection("users").document(user["uid"]).set({
-            "uid": user["uid"],
-            "displayName": user["displayName"],
-            "email": f"{user['uid']}@demo.com",
-            "photoURL": "",
-            "sdgScore": random.randint(200, 800),
-            "streak": random.randint(1, 14),
-            "badges": [],
-            "createdAt": firestore.SERVER_TIMESTAMP,
-        }, merge=True)
+    def users():
+        # Ensure demo users exist in Firestore; sdgScore goes through the sharded counter
+        with bulk_loader.FirestoreWriter(db) as writer:
+            for user in USERS:
+                ref = db.collection("users").document(user["uid"])
+                writer.set(ref, {
+                    "uid": user["uid"],
+                    "displayName": user["displayName"],
+                    "email": f"{user['uid']}@demo.com",
+                    "photoURL": "",
+                    "streak": random.randint(1, 14),
+                    "badges": [],
+                    "createdAt": firestore.SERVER_TIMESTAMP,
+                }, merge=True)
+                counters.reset(ref, "sdgScore", random.randint(200, 800), writer)
+        return writer.count
 
     # Create 10 posts spread over last 7 days
-    for i, post_data in enumerate(POSTS):
-        post_id = f"demo_post_{i + 1:02d}"
-        created_at = now - timedelta(hours=random.randint(1, 168))  # last 7 days
+    def posts():
+        for i, post_data in enumerate(POSTS):
+            post_id = f"demo_post_{i + 1:02d}"
+            created_at = now - timedelta(hours=random.randint(1, 168))
+            print(f"  ✅ Post {i + 1}/10: {post_data['user']['displayName']} — SDG {post_data['sdgGoals']} (+{post_data['score']} pts)")
+            yield post_id, {
+                "id": post_id,
+                "userId": post_data["user"]["uid"],
+                "userDisplayName": post_data["user"]["displayName"],
+                "userPhotoURL": "",
+                "type": "sdg",
+                "mediaURL": post_data["mediaURL"],
+                "mediaType": "image",
+                "caption": post_data["caption"],
+                "sdgScore": post_data["score"],
+                "sdgGoals": post_data["sdgGoals"],
+                "aiReason": post_data["aiReason"],
+                "status": "scored",
+                "likes": random.randint(3, 47),
+                "likedBy": [],
+                "createdAt": created_at,
+            }
 
-        db.collection("posts").document(post_id).set({
-            "id": post_id,
-            "userId": post_data["user"]["uid"],
-            "userDisplayName": post_data["user"]["displayName"],
-            "userPhotoURL": "",
-            "type": "sdg",
-            "mediaURL": post_data["mediaURL"],
-            "mediaType": "image",
-            "caption": post_data["caption"],
-            "sdgScore": post_data["score"],
-            "sdgGoals": post_data["sdgGoals"],
-            "aiReason": post_data["aiReason"],
-            "status": "scored",
-            "likes": random.randint(3, 47),
-            "likedBy": [],
-            "createdAt": created_at,
-        })
-        print(f"  ✅ Post {i + 1}/10: {post_data['user']['displayName']} — SDG {post_data['sdgGoals']} (+{post_data['score']} pts)")
+    bulk_loader.load_parallel({
+        "users": users,
+        "posts": lambda: bulk_loader.write_firestore(db, "posts", posts()),
+    })
 
     print("\n🎉 10 sample posts seeded successfully!")
     print("   Open the app → Feed to see them!")
@@ -8,7 +8,15 @@ Usage: python seed_posts_2.py
 import firebase_admin
 from firebase_admin import credentials, firestore
 from datetime import datetime, timezone, timedelta
+import os
 import random
+import sys
+
+import bulk_loader
+
+# Sharded counters live with the scoring function
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+import counters
 
 if not firebase_admin._apps:
     cred = credentials.Certificate(r"C:\Users\user\Downloads\sdg-connect-ff16c-firebase-adminsdk-fbsvc-fed3c83489.json")
@@ -101,41 +109,50 @@ def seed_posts():
     print("Seeding 10 new SDG posts (batch 2)...")
     now = datetime.now(timezone.utc)
 
-    # Ensure demo users exist
-    for user in USERS:
-        db.collection("users").document(user["uid"]).set({
-            "uid": user["uid"],
-            "displayName": user["displayName"],
-            "email": f"{user['uid']}@demo.com",
-            "photoURL": "",
-            "sdgScore": random.randint(150, 900),
-            "streak": random.randint(1, 21),
-            "badges": [],
-            "createdAt": firestore.SERVER_TIMESTAMP,
-        }, merge=True)
+    def users():
+        # Ensure demo users exist in Firestore; sdgScore goes through the sharded counter
+        with bulk_loader.FirestoreWriter(db) as writer:
+            for user in USERS:
+                ref = db.collection("users").document(user["uid"])
+                writer.set(ref, {
+                    "uid": user["uid"],
+                    "displayName": user["displayName"],
+                    "email": f"{user['uid']}@demo.com",
+                    "photoURL": "",
+                    "streak": random.randint(1, 21),
+                    "badges": [],
+                    "createdAt": firestore.SERVER_TIMESTAMP,
+                }, merge=True)
+                counters.reset(ref, "sdgScore", random.randint(150, 900), writer)
+        return writer.count
 
-    for i, post_data in enumerate(POSTS):
-        post_id = f"demo_post_{i + 11:02d}"  # IDs 11-20
-        created_at = now - timedelta(hours=random.randint(1, 120))
+    def posts():
+        for i, post_data in enumerate(POSTS):
+            post_id = f"demo_post_{i + 11:02d}"  # IDs 11-20
+            created_at = now - timedelta(hours=random.randint(1, 120))
+            print(f"  ✅ Post {i + 11}/20: {post_data['user']['displayName']} — SDG {post_data['sdgGoals']} (+{post_data['score']} pts)")
+            yield post_id, {
+                "id": post_id,
+                "userId": post_data["user"]["uid"],
+                "userDisplayName": post_data["user"]["displayName"],
+                "userPhotoURL": "",
+                "type": "sdg",
+                "mediaURL": post_data["mediaURL"],
+                "mediaType": "image",
+                "caption": post_data["caption"],
+                "sdgScore": post_data["score"],
+                "sdgGoals": post_data["sdgGoals"],
+                "aiReason": post_data["aiReason"],
+                "status": "scored",
+                "likes": random.randint(5, 63),
+                "likedBy": [],
+                "createdAt": created_at,
+            }
 
-        db.collection("posts").document(post_id).set({
-            "id": post_id,
-            "userId": post_data["user"]["uid"],
-            "userDisplayName": post_data["user"]["displayName"],
-            "userPhotoURL": "",
-            "type": "sdg",
-            "mediaURL": post_data["mediaURL"],
-            "mediaType": "image",
-            "caption": post_data["caption"],
-            "sdgScore": post_data["score"],
-            "sdgGoals": post_data["sdgGoals"],
-            "aiReason": post_data["aiReason"],
-            "status": "scored",
-            "likes": random.randint(5, 63),
-            "likedBy": [],
-            "createdAt": created_at,
-        })
-        print(f"  ✅ Post {i + 11}/20: {post_data['user']['displayName']} — SDG {post_data['sdgGoals']} (+{post_data['score']} pts)")
+    bulk_loader.load_parallel({
+        "users": users,
+        "posts": lambda: bulk_loader.write_firestore(db, "posts", posts()),
+    })
 
     print("\n🎉 Batch 2 complete! 20 total posts now in Firestore.")
 
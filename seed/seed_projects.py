@@ -8,6 +8,14 @@ Usage: python seed_projects.py
 import firebase_admin
 from firebase_admin import credentials, firestore
 from datetime import datetime, timezone, timedelta
+import os
+import sys
+
+import bulk_loader
+
+# Sharded counters live with the scoring function
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "functions"))
+import counters
 
 if not firebase_admin._apps:
     cred = credentials.Certificate(r"C:\Users\user\Downloads\sdg-connect-ff16c-firebase-adminsdk-fbsvc-fed3c83489.json")
@@ -22,7 +30,9 @@ def get_ngo_ids():
 def seed():
     print("Fetching NGO IDs...")
     ngos = get_ngo_ids()
-    now = datetime.now(timezone.utc)
+    # Dates are relative to today, not to this second, so a re-run on the same
+    # day leaves the projects (and their live donation totals) untouched
+    now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
 
     projects = [
         # ── WWF Malaysia ──────────────────────────────────────────────────
@@ -139,11 +149,15 @@ def seed():
         },
     ]
 
-    for i, p in enumerate(projects):
-        doc_id = f"project_{i + 1:02d}"
-        db.collection("donation_projects").document(doc_id).set(p)
+    def reset_totals(writer, ref, p):
+        # Totals go through the counter API so stale shard deltas are cleared
+        counters.reset(ref, "raisedAmount", p["raisedAmount"], writer)
+        counters.reset(ref, "raisedPoints", p["raisedPoints"], writer)
         print(f"  ✅ [{p['ngoName']}] {p['title'][:50]}")
 
+    records = ((f"project_{i + 1:02d}", p) for i, p in enumerate(projects))
+    bulk_loader.write_firestore(db, "donation_projects", records, incremental=True, verify=True, on_write=reset_totals)
+
     print(f"\n🎉 {len(projects)} donation projects seeded!")
     print("   → Open the app → Donate tab to see them.")
 
@@ -9,6 +9,8 @@ from firebase_admin import credentials, firestore
 from datetime import datetime, timezone, timedelta
 import random
 
+import bulk_loader
+
 if not firebase_admin._apps:
     cred = credentials.Certificate(
         r"C:\Users\user\Downloads\sdg-connect-ff16c-firebase-adminsdk-fbsvc-fed3c83489.json"
@@ -153,9 +155,10 @@ stories = [
 ]
 
 print("Seeding 10 stories...")
-for i, s in enumerate(stories):
-    doc_id = f"story_{i+1:02d}"
-    db.collection("stories").document(doc_id).set(s)
+bulk_loader.write_firestore(
+    db, "stories", ((f"story_{i+1:02d}", s) for i, s in enumerate(stories))
+)
+for s in stories:
     print(f"  ✅ [{s['userDisplayName']}] {s['caption'][:50]}...")
 
 # Also update existing posts to have imageURLs for the multi-photo carousel
@@ -185,11 +188,11 @@ extra_images = {
     ],
 }
 
-for post_id, urls in extra_images.items():
-    try:
-        db.collection("posts").document(post_id).update({"imageURLs": urls})
-        print(f"  📸 {post_id}: {len(urls)} extra images added")
-    except Exception as e:
-        print(f"  ⚠️  {post_id}: {e}")
+with bulk_loader.FirestoreWriter(db) as writer:
+    for post_id, urls in extra_images.items():
+        writer.update(db.collection("posts").document(post_id), {"imageURLs": urls})
+        print(f"  📸 {post_id}: {len(urls)} extra images queued")
+if writer.failed:
+    print(f"  ⚠️  {writer.failed} posts could not be updated (not seeded yet?)")
 
 print(f"\n🎉 Done! 10 stories + multi-photo updates complete.")
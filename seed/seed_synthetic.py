@@ -0,0 +1,321 @@
+"""
+Deterministic synthetic dataset generator for load and scaling tests.
+
+Produces users, posts, stories, donation projects, donations and volunteer
+events in the same shapes as seed_unified.py / seed_posts.py, with realistic
+skew: a few power users write most posts, a few projects get most donations
+and like counts follow a long tail. The same --seed and --epoch always give
+the same dataset.
+
+Records are generated lazily and streamed, so memory stays flat whether you
+ask for a thousand posts or ten million.
+
+Usage:
+  # NDJSON files (one per collection) for offline use
+  python seed_synthetic.py --users 10000 --posts 100000 --ndjson out/ --gzip
+  # Straight into Firestore / RTDB through the bulk loader
+  export FIRESTORE_EMULATOR_HOST=localhost:8080
+  python seed_synthetic.py --users 10000 --posts 100000 --load firestore
+  # Re-runs with the same --seed/--epoch only write what changed
+  python seed_synthetic.py --users 10000 --posts 100000 --load firestore --incremental
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+from datetime import datetime, timezone
+
+import bulk_loader
+
+SERVICE_ACCOUNT = "service-account.json"
+DATABASE_URL = "https://kitahack2026-f1f3e-default-rtdb.asia-southeast1.firebasedatabase.app"
+
+DAY_MS = 24 * 3600 * 1000
+
+FIRST_NAMES = [
+    "Aisha", "Wei Jun", "Priya", "Haziq", "Siti", "Tan Wei", "Rajan", "Nurul", "Lim Jia",
+    "Kavya", "Darren", "Farah", "Arjun", "Mei Ling", "Irfan", "Deepa", "Hafiz", "Chloe",
+]
+LAST_NAMES = [
+    "Rahman", "Lim", "Nair", "Azman", "Aminah", "Ling", "Krishnan", "Hidayah", "Hao",
+    "Subramaniam", "Tan", "Ismail", "Wong", "Pillai", "Abdullah", "Chong", "Yusof", "Lee",
+]
+NGOS = [
+    ("ngo_1", "WWF Malaysia"), ("ngo_2", "Yayasan Chow Kit"),
+    ("ngo_3", "Zero Waste Malaysia"), ("ngo_4", "Women's Aid Organisation"),
+]
+IMAGES = [
+    "https://images.unsplash.com/photo-1618365908648-e71bd5716cba?w=800",
+    "https://images.unsplash.com/photo-1509391366360-2e959784a276?w=800",
+    "https://images.unsplash.com/photo-1542838132-92c53300491e?w=800",
+    "https://images.unsplash.com/photo-1542601906990-b4d3fb778b09?w=600",
+    "https://images.unsplash.com/photo-1488521787991-ed7bbaae773c?w=600",
+    "https://images.unsplash.com/photo-1501854140801-50d01698950b?w=800",
+]
+SDG_CAPTIONS = [
+    "Beach cleanup done! Collected {n} bags of plastic. #SDG14",
+    "Planted {n} mangrove seedlings today 🌱 #SDG15",
+    "Volunteered {n} hours at the food bank 🍚 #SDG2",
+    "Taught {n} kids to code this weekend 💻 #SDG4",
+    "Cycled {n} km instead of driving this week 🚲 #SDG13",
+]
+NORMAL_CAPTIONS = [
+    "Sunset walk, {n} minutes of calm 🌅",
+    "Brunch with the team after a long week! 🥐",
+    "Weekend hike, {n} km done ⛰️",
+]
+
+# Firestore stores timestamps natively; RTDB and NDJSON use epoch millis.
+TIMESTAMP_FIELDS = ("createdAt", "expiresAt", "date", "endDate")
+
+
+def skewed_index(rng: random.Random, n: int, skew: float) -> int:
+    """Power-law pick in [0, n): index 0 is the most popular. skew=1 is uniform."""
+    return min(int(n * rng.random() ** skew), n - 1)
+
+
+def user_id(i: int) -> str:
+    return f"synthetic_user_{i:07d}"
+
+
+def user_profile(i: int) -> dict:
+    """Derived from the index alone, so posts and stories never need a user lookup."""
+    name = f"{FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)]}"
+    return {"uid": user_id(i), "displayName": name, "photoURL": f"https://i.pravatar.cc/150?img={i % 70 + 1}"}
+
+
+class SyntheticDataset:
+    def __init__(self, users: int, posts: int, stories: int, projects: int, donations: int,
+                 events: int, seed: int = 42, epoch_ms: int = None, days: int = 30, skew: float = 3.0):
+        self.counts = {
+            "users": users, "posts": posts, "stories": stories, "donation_projects": projects,
+            "donations": donations, "volunteer_events": events,
+        }
+        self.seed = seed
+        self.epoch_ms = epoch_ms if epoch_ms is not None else _today_ms()
+        self.days = days
+        self.skew = skew
+
+    def _rng(self, collection: str) -> random.Random:
+        # One independent stream per collection, so collections can be generated in parallel.
+        return random.Random(f"{self.seed}:{collection}")
+
+    def _past_ms(self, rng: random.Random) -> int:
+        return self.epoch_ms - int(rng.random() * self.days * DAY_MS)
+
+    def users(self):
+        rng = self._rng("users")
+        n = self.counts["users"]
+        for i in range(n):
+            profile = user_profile(i)
+            # Score decays with rank, so power users are also top scorers
+            yield profile["uid"], {
+                **profile,
+                "email": f"{profile['uid']}@example.com",
+                "sdgScore": int(5000 * (1 - i / n) ** self.skew) + rng.randint(0, 50),
+                "streak": rng.randint(0, 30),
+                "createdAt": self._past_ms(rng) - self.days * DAY_MS,
+            }
+
+    def posts(self):
+        rng = self._rng("posts")
+        for i in range(self.counts["posts"]):
+            author = user_profile(skewed_index(rng, self.counts["users"], self.skew))
+            is_sdg = rng.random() < 0.7
+            status = rng.choices(["scored", "pending", "rejected"], weights=[85, 5, 10])[0] if is_sdg else "scored"
+            score = rng.randint(21, 100) if is_sdg and status == "scored" else 0
+            goals = sorted(rng.sample(range(1, 18), rng.randint(1, 3))) if score else []
+            captions = SDG_CAPTIONS if is_sdg else NORMAL_CAPTIONS
+            post_id = f"synthetic_post_{i:08d}"
+            yield post_id, {
+                "id": post_id,
+                "userId": author["uid"],
+                "userDisplayName": author["displayName"],
+                "userPhotoURL": author["photoURL"],
+                "type": "sdg" if is_sdg else "normal",
+                "mediaURL": rng.choice(IMAGES),
+                "mediaType": "image",
+                "caption": rng.choice(captions).format(n=rng.randint(1, 20)),
+                "sdgScore": score,
+                "sdgGoals": goals,
+                "aiReason": "Synthetic load-test post" if is_sdg else "",
+                "status": status,
+                "likes": int(rng.paretovariate(1.2)) - 1,
+                "createdAt": self._past_ms(rng),
+            }
+
+    def stories(self):
+        rng = self._rng("stories")
+        for i in range(self.counts["stories"]):
+            author = user_profile(skewed_index(rng, self.counts["users"], self.skew))
+            # Spread over the window so a realistic share is already expired
+            created = self._past_ms(rng)
+            yield f"synthetic_story_{i:08d}", {
+                "userId": author["uid"],
+                "userDisplayName": author["displayName"],
+                "userPhotoURL": author["photoURL"],
+                "imageURL": rng.choice(IMAGES),
+                "caption": rng.choice(SDG_CAPTIONS).format(n=rng.randint(1, 20)),
+                "sdgGoals": sorted(rng.sample(range(1, 18), rng.randint(1, 2))),
+                "pointsAwarded": rng.choice([0, 20, 40]),
+                "aiReason": "Synthetic load-test story",
+                "createdAt": created,
+                "expiresAt": created + DAY_MS,
+                "viewedBy": [],
+            }
+
+    def donation_projects(self):
+        rng = self._rng("donation_projects")
+        for i in range(self.counts["donation_projects"]):
+            ngo_id, ngo_name = NGOS[i % len(NGOS)]
+            target = rng.choice([5000.0, 8000.0, 18000.0, 50000.0])
+            yield f"synthetic_project_{i:05d}", {
+                "ngoId": ngo_id,
+                "ngoName": ngo_name,
+                "title": f"Synthetic Project {i}",
+                "description": "Synthetic load-test donation project.",
+                "imageURL": rng.choice(IMAGES),
+                "sdgGoals": sorted(rng.sample(range(1, 18), 2)),
+                "neededItems": [],
+                "targetAmount": target,
+                "raisedAmount": round(target * rng.random(), 2),
+                "targetPoints": int(target * 5),
+                "raisedPoints": 0,
+                "endDate": self.epoch_ms + rng.randint(7, 120) * DAY_MS,
+                "active": True,
+            }
+
+    def donations(self):
+        rng = self._rng("donations")
+        projects = max(self.counts["donation_projects"], 1)
+        for i in range(self.counts["donations"]):
+            yield f"synthetic_donation_{i:08d}", {
+                "userId": user_id(skewed_index(rng, self.counts["users"], self.skew)),
+                "projectId": f"synthetic_project_{skewed_index(rng, projects, self.skew):05d}",
+                "type": "money",
+                "amount": float(rng.choice([5, 10, 20, 50, 100])),
+                "createdAt": self._past_ms(rng),
+            }
+
+    def volunteer_events(self):
+        rng = self._rng("volunteer_events")
+        for i in range(self.counts["volunteer_events"]):
+            ngo_id, ngo_name = NGOS[i % len(NGOS)]
+            yield f"synthetic_event_{i:06d}", {
+                "ngoId": ngo_id,
+                "ngoName": ngo_name,
+                "title": f"Synthetic Event {i}",
+                "description": "Synthetic load-test volunteer event.",
+                "address": "Kuala Lumpur",
+                "date": self.epoch_ms + rng.randint(1, 60) * DAY_MS,
+                "sdgGoals": sorted(rng.sample(range(1, 18), 2)),
+                "sdgPointsReward": rng.choice([40, 60, 80, 90]),
+                "registeredUsers": {},
+                "imageURL": rng.choice(IMAGES),
+            }
+
+    def collections(self) -> dict:
+        """{collection name: zero-arg callable returning the record stream}"""
+        return {name: getattr(self, name) for name, count in self.counts.items() if count > 0}
+
+
+def _today_ms() -> int:
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(today.timestamp() * 1000)
+
+
+def for_firestore(records):
+    for key, data in records:
+        data = dict(data)
+        for field in TIMESTAMP_FIELDS:
+            if isinstance(data.get(field), int):
+                data[field] = datetime.fromtimestamp(data[field] / 1000, tz=timezone.utc)
+        yield key, data
+
+
+def write_ndjson(path: str, records, compress: bool) -> int:
+    """One {"id": key, "data": record} object per line."""
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(path, "wt", encoding="utf-8") as f:
+        for key, data in records:
+            f.write(json.dumps({"id": key, "data": data}, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--stories", type=int, default=1000)
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--donations", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--epoch", type=int, help="reference time in epoch ms (default: today 00:00 UTC)")
+    parser.add_argument("--days", type=int, default=30, help="history window for timestamps")
+    parser.add_argument("--skew", type=float, default=3.0, help="power-law exponent, 1 = uniform")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--ndjson", metavar="DIR", help="write one NDJSON file per collection")
+    target.add_argument("--load", choices=["firestore", "rtdb"], help="stream into the database")
+    parser.add_argument("--gzip", action="store_true", help="gzip the NDJSON files")
+    parser.add_argument("--mode", choices=["bulk", "batch"], default="batch", help="Firestore write path")
+    parser.add_argument("--incremental", action="store_true",
+                        help="write only records that changed since the last load (seed-state manifest)")
+    parser.add_argument("--verify", action="store_true", help="with --incremental, also rewrite records missing from the target")
+    args = parser.parse_args()
+
+    dataset = SyntheticDataset(
+        users=args.users, posts=args.posts, stories=args.stories, projects=args.projects,
+        donations=args.donations, events=args.events, seed=args.seed, epoch_ms=args.epoch,
+        days=args.days, skew=args.skew,
+    )
+
+    if args.ndjson:
+        os.makedirs(args.ndjson, exist_ok=True)
+        suffix = ".ndjson.gz" if args.gzip else ".ndjson"
+        jobs = {
+            name: (lambda name=name, stream=stream: write_ndjson(os.path.join(args.ndjson, name + suffix), stream(), args.gzip))
+            for name, stream in dataset.collections().items()
+        }
+        print(f"Writing synthetic dataset to {args.ndjson}...")
+        print(bulk_loader.load_parallel(jobs))
+        return
+
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if not firebase_admin._apps:
+        options = {"databaseURL": DATABASE_URL}
+        if os.path.exists(SERVICE_ACCOUNT):
+            firebase_admin.initialize_app(credentials.Certificate(SERVICE_ACCOUNT), options)
+        else:
+            firebase_admin.initialize_app(options=options)
+
+    print(f"Loading synthetic dataset into {args.load}...")
+    if args.load == "firestore":
+        from firebase_admin import firestore
+        db = firestore.client()
+        jobs = {
+            name: (lambda name=name, stream=stream: bulk_loader.write_firestore(
+                db, name, for_firestore(stream()), mode=args.mode, incremental=args.incremental, verify=args.verify))
+            for name, stream in dataset.collections().items()
+        }
+    else:
+        from firebase_admin import db as rtdb
+        root = rtdb.reference()
+        jobs = {
+            name: (lambda name=name, stream=stream: bulk_loader.write_rtdb(
+                root, name, stream(), incremental=args.incremental, verify=args.verify))
+            for name, stream in dataset.collections().items()
+        }
+    bulk_loader.load_parallel(jobs)
+    print("\n🎉 Synthetic dataset loaded!")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ from datetime import datetime, timezone, timedelta
 import random
 import uuid
 
+import bulk_loader
+
 # -- Configuration --
 SERVICE_ACCOUNT = r"c:\2.0 Ethan Tiang\Projects\KitaHack 2026\service-account.json"
 DATABASE_URL = "https://kitahack2026-f1f3e-default-rtdb.asia-southeast1.firebasedatabase.app"
@@ -26,16 +28,16 @@ USERS = [
 
 def seed_users():
     print("Seeding dummy users...")
-    for u in USERS:
-        ref.child("users").child(u["uid"]).update({
-            "uid": u["uid"],
-            "displayName": u["displayName"],
-            "photoURL": u["photoURL"],
-            "email": f"{u['uid']}@example.com",
-            "sdgScore": random.randint(100, 500),
-            "streak": random.randint(1, 10),
-            "createdAt": int(datetime.now().timestamp() * 1000)
-        })
+    users = ((u["uid"], {
+        "uid": u["uid"],
+        "displayName": u["displayName"],
+        "photoURL": u["photoURL"],
+        "email": f"{u['uid']}@example.com",
+        "sdgScore": random.randint(100, 500),
+        "streak": random.randint(1, 10),
+        "createdAt": int(datetime.now().timestamp() * 1000)
+    }) for u in USERS)
+    return bulk_loader.write_rtdb(ref, "users", users, merge=True)
 
 def seed_posts():
     print("Seeding posts (SDG and For-You)...")
@@ -76,6 +78,7 @@ def seed_posts():
         user = random.choice(USERS)
         all_data.append({**p, "user": user})
 
+    posts = {}
     for i, p in enumerate(all_data):
         pid = str(uuid.uuid4())
         created_at = int((datetime.now() - timedelta(hours=i)).timestamp() * 1000)
@@ -96,8 +99,9 @@ def seed_posts():
             "likes": random.randint(5, 50),
             "createdAt": created_at
         }
-        ref.child("posts").child(pid).set(post_data)
+        posts[pid] = post_data
         print(f"  Post {p['type'].upper()} created by {p['user']['displayName']}")
+    return bulk_loader.write_rtdb(ref, "posts", posts.items())
 
 def seed_stories():
     print("Seeding stories...")
@@ -117,10 +121,11 @@ def seed_stories():
         }
     ]
 
+    stories = {}
     for s in story_samples:
         user = random.choice(USERS)
         sid = str(uuid.uuid4())
-        ref.child("stories").child(sid).set({
+        stories[sid] = {
             "userId": user["uid"],
             "userDisplayName": user["displayName"],
             "userPhotoURL": user["photoURL"],
@@ -132,12 +137,15 @@ def seed_stories():
             "createdAt": int(now.timestamp() * 1000),
             "expiresAt": int(expires.timestamp() * 1000),
             "viewedBy": []
-        })
+        }
         print(f"  Story created for {user['displayName']}")
+    return bulk_loader.write_rtdb(ref, "stories", stories.items())
 
 if __name__ == "__main__":
     print("Unified Seeding Started...")
-    seed_users()
-    seed_posts()
-    seed_stories()
+    bulk_loader.load_parallel({
+        "users": seed_users,
+        "posts": seed_posts,
+        "stories": seed_stories,
+    })
     print("All demo data seeded to RTDB!")
@@ -0,0 +1,382 @@
+"""
+Snapshot export / import for Firestore collections and RTDB nodes.
+
+Export streams a collection (ordered by document id) or an RTDB node
+(ordered by key) page by page, so memory stays flat however large it is:
+
+  ndjson   {name}.ndjson[.gz], one {"id": key, "data": record} per line,
+           the same format seed_synthetic.py --ndjson writes
+  parquet  {name}-00000.parquet, ...; one row per record, the key in
+           __key__ and top-level fields as columns (the union over the page),
+           maps and lists JSON-encoded (needs pyarrow). A new part starts
+           whenever a page's columns or types differ.
+
+Firestore timestamps are written as epoch millis, as in RTDB and the
+synthetic dataset, geo points as {"latitude", "longitude"}, document
+references as their path and bytes as base64. {name}.meta.json records the
+path of every such value (nested maps and lists included) so an import into
+Firestore restores the original types.
+
+Import reads the files back lazily and loads them through bulk_loader
+(optionally --incremental, so only changed records are written).
+
+Usage:
+  python snapshot.py export --source firestore --out snap/ --gzip
+  python snapshot.py export --source rtdb --collections posts stories --out snap/ --format parquet
+  export FIRESTORE_EMULATOR_HOST=localhost:8080
+  python snapshot.py import snap/ --target firestore
+  python snapshot.py check --format parquet   # round-trip self-check, no Firebase
+"""
+
+import argparse
+import base64
+import glob
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import bulk_loader
+import batching  # functions/batching.py, put on the path by bulk_loader
+from seed_synthetic import DATABASE_URL, SERVICE_ACCOUNT, TIMESTAMP_FIELDS, SyntheticDataset, write_ndjson
+
+COLLECTIONS = ["posts", "users", "stories", "donation_projects", "volunteer_events"]
+PAGE_SIZE = 1000
+# Parquet columns for the record key and for non-map records; reserved so they
+# never collide with a record's own fields (posts carry an "id" field)
+KEY_COLUMN = "__key__"
+VALUE_COLUMN = "__value__"
+
+
+def _file_name(collection: str) -> str:
+    return collection.strip("/").replace("/", "__")
+
+
+# ── Value encoding ────────────────────────────────────────────────────────────
+
+TYPED_FIELDS = ("timestampFields", "geoPointFields", "referenceFields", "bytesFields")
+
+
+def _encode(value, types: dict = None, path: tuple = ()):
+    """
+    Firestore value -> JSON-safe value. When `types` is given, the path of every
+    value that loses its type ((field, ...), None standing for "any list item")
+    is added to types[kind] for kind in TYPED_FIELDS.
+    """
+    if isinstance(value, dict):
+        return {k: _encode(v, types, path + (k,)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_encode(v, types, path + (None,)) for v in value]
+    if isinstance(value, datetime):
+        kind, value = "timestampFields", int(value.timestamp() * 1000)
+    elif isinstance(value, bytes):
+        kind, value = "bytesFields", base64.b64encode(value).decode("ascii")
+    elif hasattr(value, "latitude") and hasattr(value, "longitude"):
+        kind, value = "geoPointFields", {"latitude": value.latitude, "longitude": value.longitude}
+    elif hasattr(value, "path") and hasattr(value, "collection"):
+        kind, value = "referenceFields", value.path  # DocumentReference
+    else:
+        return value
+    if types is not None:
+        types.setdefault(kind, set()).add(path)
+    return value
+
+
+def _decode_path(value, path, decode):
+    if not path:
+        return decode(value)
+    head, rest = path[0], path[1:]
+    if head is None and isinstance(value, list):
+        return [_decode_path(v, rest, decode) for v in value]
+    if isinstance(value, dict) and head in value:
+        return {**value, head: _decode_path(value[head], rest, decode)}
+    return value
+
+
+def firestore_decoders(db) -> dict:
+    """{TYPED_FIELDS kind: JSON value -> Firestore value}; values of another shape pass through."""
+    from firebase_admin import firestore
+
+    def timestamp(v):
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            return datetime.fromtimestamp(v / 1000, tz=timezone.utc)
+        return v
+
+    def geo_point(v):
+        if isinstance(v, dict) and v.keys() == {"latitude", "longitude"}:
+            return firestore.GeoPoint(v["latitude"], v["longitude"])
+        return v
+
+    return {
+        "timestampFields": timestamp,
+        "geoPointFields": geo_point,
+        "referenceFields": lambda v: db.document(v) if isinstance(v, str) else v,
+        "bytesFields": lambda v: base64.b64decode(v) if isinstance(v, str) else v,
+    }
+
+
+def _decode_types(data, types: dict, decoders: dict):
+    """Inverse of _encode for the paths in `types`; a bare field name is a top-level path."""
+    for kind, paths in types.items():
+        for path in paths:
+            data = _decode_path(data, [path] if isinstance(path, str) else path, decoders[kind])
+    return data
+
+
+# ── Sources ───────────────────────────────────────────────────────────────────
+
+def firestore_records(db, collection: str, types: dict, page_size: int = PAGE_SIZE):
+    """Yields (doc_id, data) pages of a collection; adds the paths of typed values to `types` (see _encode)."""
+    query = db.collection(collection).order_by("__name__").limit(page_size)
+    cursor = None
+    while True:
+        page = list((query.start_after(cursor) if cursor else query).stream())
+        for snapshot in page:
+            yield snapshot.id, _encode(snapshot.to_dict() or {}, types)
+        if len(page) < page_size:
+            return
+        cursor = page[-1]
+
+
+def rtdb_records(root_ref, path: str, page_size: int = PAGE_SIZE):
+    """Yields (key, value) pages of an RTDB node ordered by key."""
+    return batching.rtdb_pages(root_ref.child(path), page_size)
+
+
+# ── Formats ───────────────────────────────────────────────────────────────────
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("Parquet needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def write_parquet(prefix: str, records, page_size: int = PAGE_SIZE) -> int:
+    """Writes records as {prefix}-NNNNN.parquet parts, one row group per page."""
+    pa = _pyarrow()
+    writer, schema, part, count = None, None, 0, 0
+    try:
+        for chunk in batching.chunks(records, page_size):
+            rows = [{KEY_COLUMN: key, **(data if isinstance(data, dict) else {VALUE_COLUMN: data})} for key, data in chunk]
+            # A column holding a map or list anywhere on the page, or values of
+            # more than one type (Arrow would reject int + str and widen int +
+            # float to double), is JSON-encoded for every row
+            types = {}
+            for row in rows:
+                for field, value in row.items():
+                    if value is not None:
+                        types.setdefault(field, set()).add(type(value))
+            json_columns = {field for field, seen in types.items() if len(seen) > 1 or seen & {dict, list}}
+            for row in rows:
+                for field in json_columns & row.keys():
+                    row[field] = json.dumps(row[field], ensure_ascii=False)
+            # Columns are the union of every row's fields; a row without one gets a null
+            names = sorted({field for row in rows for field in row})
+            table = pa.Table.from_pydict({name: [row.get(name) for row in rows] for name in names})
+            table = table.replace_schema_metadata({"json_columns": json.dumps(sorted(json_columns))})
+            if writer is None or not table.schema.equals(schema, check_metadata=True):
+                if writer is not None:
+                    writer.close()
+                    part += 1
+                schema = table.schema
+                writer = pa.parquet.ParquetWriter(f"{prefix}-{part:05d}.parquet", schema, compression="zstd")
+            writer.write_table(table)
+            count += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def read_ndjson(path: str):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record["id"], record["data"]
+
+
+def read_parquet(paths, batch_size: int = PAGE_SIZE):
+    pa = _pyarrow()
+    for path in paths:
+        parquet_file = pa.parquet.ParquetFile(path)
+        metadata = parquet_file.schema_arrow.metadata or {}
+        json_columns = set(json.loads(metadata.get(b"json_columns", b"[]")))
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            for row in batch.to_pylist():
+                key = row.pop(KEY_COLUMN)
+                # Missing fields come back as nulls from the shared schema
+                data = {
+                    field: json.loads(value) if field in json_columns else value
+                    for field, value in row.items() if value is not None
+                }
+                yield key, data.get(VALUE_COLUMN, data)
+
+
+def check_roundtrip(fmt: str, page_size: int = 50) -> int:
+    """
+    Writes a sample snapshot in `fmt` to a temp directory, reads it back and
+    raises AssertionError on the first record that differs. The sample mixes
+    synthetic records with ragged ones whose fields only appear after the
+    first row of a page, and with columns mixing value types.
+    """
+    dataset = SyntheticDataset(users=20, posts=120, stories=30, projects=5, donations=0, events=5, epoch_ms=0)
+    records = [record for name in dataset.collections() for record in getattr(dataset, name)()]
+    records += [
+        ("ragged_0", {"a": 1}),
+        ("ragged_1", {"a": 2, "late": "field"}),
+        ("ragged_2", {"nested": {"b": [1, 2]}, "a": 3.5}),
+        ("scalar_0", 42),
+        ("mixed_0", {"a": "x", "n": 1}),
+        ("mixed_1", {"a": 4, "n": 1.5, "flag": True}),
+        ("mixed_2", {"n": 2, "flag": 0}),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        if fmt == "ndjson":
+            path = os.path.join(tmp, "check.ndjson.gz")
+            write_ndjson(path, iter(records), True)
+            restored = list(read_ndjson(path))
+        else:
+            write_parquet(os.path.join(tmp, "check"), iter(records), page_size)
+            restored = list(read_parquet(sorted(glob.glob(os.path.join(tmp, "check-*.parquet")))))
+    assert len(restored) == len(records), f"{fmt}: {len(restored)} of {len(records)} records read back"
+    for expected, actual in zip(records, restored):
+        # Compared as JSON so 1 vs 1.0 and True vs 1 count as differences
+        assert json.dumps(expected, sort_keys=True) == json.dumps(actual, sort_keys=True), \
+            f"{fmt}: {expected[0]} read back as {actual}"
+    return len(records)
+
+
+# ── Export / import ───────────────────────────────────────────────────────────
+
+def export_collection(source: str, handle, collection: str, out_dir: str, fmt: str, compress: bool, page_size: int) -> int:
+    started = time.perf_counter()
+    name = _file_name(collection)
+    types = {}
+    if source == "firestore":
+        records = firestore_records(handle, collection, types, page_size)
+    else:
+        records = rtdb_records(handle, collection, page_size)
+
+    if fmt == "ndjson":
+        count = write_ndjson(os.path.join(out_dir, name + (".ndjson.gz" if compress else ".ndjson")), records, compress)
+    else:
+        count = write_parquet(os.path.join(out_dir, name), records, page_size)
+
+    with open(os.path.join(out_dir, f"{name}.meta.json"), "w") as f:
+        json.dump({
+            "collection": collection, "source": source, "format": fmt, "count": count,
+            **{kind: sorted((list(p) for p in types.get(kind, ())), key=json.dumps) for kind in TYPED_FIELDS},
+            "exportedAt": datetime.now(timezone.utc).isoformat(),
+        }, f, indent=2)
+    elapsed = time.perf_counter() - started
+    print(f"  ✅ {collection}: {count} records exported in {elapsed:.1f}s ({count / elapsed if elapsed else 0:,.0f}/s)")
+    return count
+
+
+def snapshot_files(in_dir: str) -> dict:
+    """{collection: (meta, records generator factory)} for every snapshot in `in_dir`."""
+    found = {}
+    for meta_path in sorted(glob.glob(os.path.join(in_dir, "*.meta.json"))):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        name = os.path.basename(meta_path)[:-len(".meta.json")]
+        if meta["format"] == "ndjson":
+            path = next(p for p in (os.path.join(in_dir, name + ext) for ext in (".ndjson.gz", ".ndjson")) if os.path.exists(p))
+            found[meta["collection"]] = (meta, lambda path=path: read_ndjson(path))
+        else:
+            parts = sorted(glob.glob(os.path.join(in_dir, f"{name}-*.parquet")))
+            found[meta["collection"]] = (meta, lambda parts=parts: read_parquet(parts))
+    return found
+
+
+def import_snapshot(target: str, handle, in_dir: str, collections=None, incremental: bool = False, mode: str = "batch") -> dict:
+    snapshots = snapshot_files(in_dir)
+    if collections:
+        snapshots = {name: snapshots[name] for name in collections if name in snapshots}
+    decoders = firestore_decoders(handle) if target == "firestore" else None
+    jobs = {}
+    for collection, (meta, records) in snapshots.items():
+        if target == "firestore":
+            # Exports from RTDB carry no type information; fall back to the known timestamp fields
+            if meta["source"] == "firestore":
+                types = {kind: meta.get(kind, []) for kind in TYPED_FIELDS}
+            else:
+                types = {"timestampFields": TIMESTAMP_FIELDS}
+            jobs[collection] = (lambda collection=collection, records=records, types=types: bulk_loader.write_firestore(
+                handle, collection, ((key, _decode_types(data, types, decoders)) for key, data in records()),
+                mode=mode, incremental=incremental))
+        else:
+            jobs[collection] = (lambda collection=collection, records=records: bulk_loader.write_rtdb(
+                handle, collection, records(), incremental=incremental))
+    return bulk_loader.load_parallel(jobs)
+
+
+def _connect(backend: str):
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if not firebase_admin._apps:
+        options = {"databaseURL": DATABASE_URL}
+        if os.path.exists(SERVICE_ACCOUNT):
+            firebase_admin.initialize_app(credentials.Certificate(SERVICE_ACCOUNT), options)
+        else:
+            firebase_admin.initialize_app(options=options)
+    if backend == "firestore":
+        from firebase_admin import firestore
+        return firestore.client()
+    from firebase_admin import db as rtdb
+    return rtdb.reference()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="stream collections / nodes to files")
+    export.add_argument("--source", choices=["firestore", "rtdb"], required=True)
+    export.add_argument("--collections", nargs="+", default=COLLECTIONS)
+    export.add_argument("--out", required=True, metavar="DIR")
+    export.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    export.add_argument("--gzip", action="store_true", help="gzip the NDJSON files")
+    export.add_argument("--page-size", type=int, default=PAGE_SIZE)
+
+    load = commands.add_parser("import", help="load a snapshot through the bulk loader")
+    load.add_argument("snapshot", metavar="DIR")
+    load.add_argument("--target", choices=["firestore", "rtdb"], required=True)
+    load.add_argument("--collections", nargs="+", help="default: everything in the snapshot")
+    load.add_argument("--incremental", action="store_true", help="write only records that changed (seed-state manifest)")
+    load.add_argument("--mode", choices=["bulk", "batch"], default="batch", help="Firestore write path")
+    check = commands.add_parser("check", help="round-trip a sample snapshot through a format (no Firebase needed)")
+    check.add_argument("--format", choices=["ndjson", "parquet"], nargs="+", default=["ndjson", "parquet"])
+    args = parser.parse_args()
+
+    if args.command == "check":
+        for fmt in args.format:
+            print(f"  ✅ {fmt}: {check_roundtrip(fmt)} records round-tripped")
+    elif args.command == "export":
+        if args.format == "parquet":
+            _pyarrow()
+        os.makedirs(args.out, exist_ok=True)
+        handle = _connect(args.source)
+        print(f"Exporting {args.source} to {args.out}...")
+        jobs = {
+            name: (lambda name=name: export_collection(
+                args.source, handle, name, args.out, args.format, args.gzip, args.page_size))
+            for name in args.collections
+        }
+        print(bulk_loader.load_parallel(jobs))
+    else:
+        handle = _connect(args.target)
+        print(f"Importing {args.snapshot} into {args.target}...")
+        print(import_snapshot(args.target, handle, args.snapshot, args.collections, args.incremental, args.mode))
+
+
+if __name__ == "__main__":
+    main()